@@ -21,6 +21,7 @@ class User(UserMixin, db.Model):
     gmail_token = db.relationship('GmailToken', backref='user', uselist=False, cascade='all, delete-orphan')
     preferences = db.relationship('UserPreferences', backref='user', uselist=False, cascade='all, delete-orphan')
     newsletters = db.relationship('Newsletter', backref='user', cascade='all, delete-orphan')
+    boilerplate_templates = db.relationship('BoilerplateTemplate', backref='user', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<User {self.email}>'
@@ -35,6 +36,8 @@ class GmailToken(db.Model):
     access_token = db.Column(db.Text, nullable=False)
     refresh_token = db.Column(db.Text)
     token_expires_at = db.Column(db.DateTime)
+    history_id = db.Column(db.String(64))  # Gmail sync cursor for incremental fetches
+    backfill_page_token = db.Column(db.Text)  # Resume point for an interrupted backfill
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -49,10 +52,14 @@ class UserPreferences(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True)
     newsletter_label = db.Column(db.String(255), default='To-Summarize')
+    newsletter_label_id = db.Column(db.String(255))  # cached Gmail ID for newsletter_label
+    label_id_resolved_at = db.Column(db.DateTime)
     summary_style = db.Column(db.String(50), default='bullet-points')  # 'bullet-points', 'paragraph', 'summary'
     min_length = db.Column(db.Integer, default=5)  # minimum lines for processing
     auto_send = db.Column(db.Boolean, default=False)
     send_to_email = db.Column(db.String(255))
+    sender_allowlist = db.Column(db.Text)  # comma separated addresses, domains or list IDs
+    max_message_kb = db.Column(db.Integer)  # skip messages larger than this
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -68,17 +75,72 @@ class Newsletter(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     gmail_message_id = db.Column(db.String(255), nullable=False)
     original_subject = db.Column(db.String(500))
+    sender = db.Column(db.String(255), index=True)  # normalized From address
     original_content = db.Column(db.Text)
     cleaned_content = db.Column(db.Text)
     summary = db.Column(db.Text)
     status = db.Column(db.String(50), default='pending')  # pending, processing, completed, failed
+    attempts = db.Column(db.Integer, default=0)  # processing runs; failed rows are retried up to NEWSLETTER_MAX_ATTEMPTS
+    links = db.Column(db.Text)  # ranked links as a JSON array of [url, text] pairs
+    boilerplate_tokens_saved = db.Column(db.Integer, default=0)  # template blocks stripped before summarizing
+    simhash = db.Column(db.BigInteger)  # SimHash of cleaned_content, stored signed
+    duplicate_of = db.Column(db.Integer, db.ForeignKey('newsletters.id'))  # newsletter whose summary was reused
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     processed_at = db.Column(db.DateTime)
     
+    # Relationships
+    simhash_buckets = db.relationship('SimhashBucket', backref='newsletter', cascade='all, delete-orphan')
+    
     def __repr__(self):
         return f'<Newsletter {self.id} user_id={self.user_id}>'
 
 
+class SimhashBucket(db.Model):
+    """LSH band of a newsletter's SimHash, for near-duplicate lookups"""
+    __tablename__ = 'simhash_buckets'
+    __table_args__ = (db.Index('ix_simhash_buckets_lookup', 'user_id', 'sender', 'band', 'value'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    newsletter_id = db.Column(db.Integer, db.ForeignKey('newsletters.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    sender = db.Column(db.String(255), nullable=False)
+    band = db.Column(db.SmallInteger, nullable=False)
+    value = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<SimhashBucket newsletter_id={self.newsletter_id} band={self.band}>'
+
+
+class BoilerplateTemplate(db.Model):
+    """Learned template blocks for one sender, per user"""
+    __tablename__ = 'boilerplate_templates'
+    __table_args__ = (db.UniqueConstraint('user_id', 'sender'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    sender = db.Column(db.String(255), nullable=False)
+    fingerprints = db.Column(db.LargeBinary, nullable=False)  # packed SenderTemplate
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<BoilerplateTemplate {self.sender} user_id={self.user_id}>'
+
+
+class SummaryCacheEntry(db.Model):
+    """Cached provider output, shared by every user who gets the same issue"""
+    __tablename__ = 'summary_cache'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), unique=True, nullable=False)  # hash of prompt version, model, style and content
+    value = db.Column(db.LargeBinary, nullable=False)  # summary bullets as JSON
+    size = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    accessed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<SummaryCacheEntry {self.key[:12]}>'
+
+
 @login_manager.user_loader
 def load_user(user_id):
     """Load user by ID for Flask-Login"""
@@ -40,10 +40,18 @@ def settings():
     prefs = current_user.preferences or UserPreferences(user_id=current_user.id)
     
     if request.method == 'POST':
-        prefs.newsletter_label = request.form.get('newsletter_label', 'To-Summarize')
+        newsletter_label = request.form.get('newsletter_label', 'To-Summarize')
+        if newsletter_label != prefs.newsletter_label:
+            # Cached label ID belongs to the old label
+            prefs.newsletter_label_id = None
+            prefs.label_id_resolved_at = None
+        prefs.newsletter_label = newsletter_label
         prefs.summary_style = request.form.get('summary_style', 'bullet-points')
         prefs.auto_send = request.form.get('auto_send') == 'on'
         prefs.send_to_email = request.form.get('send_to_email', current_user.email)
+        prefs.sender_allowlist = request.form.get('sender_allowlist', '').strip() or None
+        max_message_kb = request.form.get('max_message_kb', '').strip()
+        prefs.max_message_kb = int(max_message_kb) if max_message_kb.isdigit() else None
         
         if not prefs.user_id:
             prefs.user_id = current_user.id
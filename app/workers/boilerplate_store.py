@@ -0,0 +1,32 @@
+"""
+Database-backed boilerplate template store
+"""
+
+from app import db
+from app.models import BoilerplateTemplate
+
+
+class DatabaseTemplateStore:
+    """
+    Keeps a user's per-sender templates in the boilerplate_templates table.
+    
+    Saves are added to the session and committed with the newsletter they
+    were learned from.
+    """
+    
+    def __init__(self, user_id):
+        self.user_id = user_id
+    
+    def load(self, sender):
+        record = self._get(sender)
+        return record.fingerprints if record else None
+    
+    def save(self, sender, data):
+        record = self._get(sender)
+        if not record:
+            record = BoilerplateTemplate(user_id=self.user_id, sender=sender)
+            db.session.add(record)
+        record.fingerprints = data
+    
+    def _get(self, sender):
+        return BoilerplateTemplate.query.filter_by(user_id=self.user_id, sender=sender).first()
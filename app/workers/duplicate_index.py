@@ -0,0 +1,72 @@
+"""
+Database-backed near-duplicate index
+"""
+
+import os
+from datetime import datetime, timedelta
+from app import db
+from app.models import Newsletter, SimhashBucket
+from phases.dedupe import bands, hamming, get_max_distance
+
+SIGN_BIT = 1 << 63
+
+
+def to_signed(signature):
+    """Fits an unsigned 64-bit signature into a signed BIGINT column."""
+    return signature - (SIGN_BIT << 1) if signature >= SIGN_BIT else signature
+
+
+def from_signed(value):
+    """Inverse of to_signed()."""
+    return value + (SIGN_BIT << 1) if value < 0 else value
+
+
+class DatabaseDuplicateIndex:
+    """
+    Finds a user's recent newsletters from the same sender whose SimHash is
+    within NEAR_DUPLICATE_DISTANCE bits, through the simhash_buckets table.
+    """
+    
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.max_distance = get_max_distance()
+        self.window = timedelta(days=int(os.getenv('NEAR_DUPLICATE_DAYS', '30')))
+    
+    def find(self, sender, signature, exclude_id=None):
+        """
+        Returns the closest recent, summarized near-duplicate, or None.
+        
+        Only newsletters sharing at least one LSH band are compared.
+        """
+        band_filter = db.or_(*[
+            db.and_(SimhashBucket.band == band, SimhashBucket.value == value)
+            for band, value in bands(signature)
+        ])
+        candidates = Newsletter.query.join(
+            SimhashBucket, SimhashBucket.newsletter_id == Newsletter.id
+        ).filter(
+            SimhashBucket.user_id == self.user_id,
+            SimhashBucket.sender == sender,
+            band_filter,
+            Newsletter.id != exclude_id,
+            Newsletter.status == 'completed',
+            Newsletter.summary.isnot(None),
+            Newsletter.created_at >= datetime.utcnow() - self.window
+        ).distinct().all()
+        
+        best = None
+        best_distance = self.max_distance + 1
+        for candidate in candidates:
+            distance = hamming(signature, from_signed(candidate.simhash))
+            if distance < best_distance:
+                best, best_distance = candidate, distance
+        return best
+    
+    def add(self, newsletter, sender, signature):
+        """Stores the signature on the newsletter and indexes its bands."""
+        newsletter.sender = sender
+        newsletter.simhash = to_signed(signature)
+        newsletter.simhash_buckets = [
+            SimhashBucket(user_id=self.user_id, sender=sender, band=band, value=value)
+            for band, value in bands(signature)
+        ]
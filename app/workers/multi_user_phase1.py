@@ -5,18 +5,40 @@ Gmail API authentication and message fetching for each user
 
 import os
 import logging
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
+from datetime import datetime
 from google.auth.exceptions import RefreshError
-from googleapiclient import discovery
+from googleapiclient.errors import HttpError
 from app import db
 from app.models import GmailToken, Newsletter
+from app.workers.token_manager import get_token_manager
+from phases.gmail_api import (
+    BodyExtractor,
+    RateLimiter,
+    TriageRules,
+    batch_get_messages,
+    batch_modify_messages,
+    build_gmail_service,
+    chunked,
+    ensure_label_id,
+    get_batch_size,
+    get_label_cache_ttl,
+    get_processed_label,
+    is_label_not_found,
+    is_message_not_found,
+    resolve_label_id,
+    triage_messages,
+)
 
 logger = logging.getLogger(__name__)
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 
 
+def get_max_attempts():
+    """Processing runs a newsletter gets before it is no longer retried."""
+    return int(os.getenv('NEWSLETTER_MAX_ATTEMPTS', '3'))
+
+
 class MultiUserGmailAccessLayer:
     """Handles per-user Gmail OAuth and message fetching."""
     
@@ -29,38 +51,34 @@ class MultiUserGmailAccessLayer:
         """
         self.user = user
         self.gmail_token = user.gmail_token
+        self.quota_user = f"user-{user.id}"
         self.newsletter_label = user.preferences.newsletter_label if user.preferences else 'To-Summarize'
+        self.batch_size = get_batch_size()
+        self.max_results = int(os.getenv('GMAIL_MAX_RESULTS', '10'))
+        self.sync_history_id = None
+        self._pending_acks = []
+        self._processed_label_id = None
+        self.body_extractor = BodyExtractor(stats_hook=self._log_body_stats)
+        self.triage_rules = TriageRules.from_settings(
+            user.preferences.sender_allowlist if user.preferences else None,
+            user.preferences.max_message_kb if user.preferences else None
+        )
         self.service = self._authenticate()
     
     def _authenticate(self):
         """
         Authenticate using stored OAuth token.
-        Automatically refreshes if expired.
+        Refreshes inline only if the background refresh missed an expiry.
         """
         if not self.gmail_token:
             raise ValueError(f"No Gmail token found for user {self.user.email}")
         
         try:
-            # Create credentials from stored token
-            creds = Credentials(
-                token=self.gmail_token.access_token,
-                refresh_token=self.gmail_token.refresh_token,
-                token_uri='https://oauth2.googleapis.com/token',
-                client_id=os.getenv('GOOGLE_CLIENT_ID'),
-                client_secret=os.getenv('GOOGLE_CLIENT_SECRET'),
-                scopes=SCOPES
-            )
-            
-            # Refresh if expired
-            if creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-                # Update token in database
-                self.gmail_token.access_token = creds.token
-                self.gmail_token.token_expires_at = creds.expiry
-                db.session.commit()
+            # Cached credentials, refreshed ahead of expiry by the token manager
+            creds = get_token_manager().get_credentials(self.gmail_token)
             
             logger.info(f"Gmail authentication successful for {self.user.email}")
-            return discovery.build('gmail', 'v1', credentials=creds)
+            return build_gmail_service(creds, quota_user=self.quota_user)
         
         except RefreshError as e:
             logger.error(f"Token refresh failed for {self.user.email}: {e}")
@@ -77,118 +95,361 @@ class MultiUserGmailAccessLayer:
             List of newsletter objects
         """
         try:
-            # Get label ID
-            results = self.service.users().labels().list(userId='me').execute()
-            labels = results.get('labels', [])
-            
-            label_id = None
-            for label in labels:
-                if label['name'] == self.newsletter_label:
-                    label_id = label['id']
-                    break
-            
+            label_id = self._get_label_id()
             if not label_id:
                 logger.warning(f"Label '{self.newsletter_label}' not found for {self.user.email}")
                 return []
             
-            # Fetch unread messages with label
-            query = f"label:{label_id} is:unread"
-            results = self.service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=10
-            ).execute()
+            try:
+                msg_ids = self._list_new_messages(label_id)
+            except HttpError as e:
+                if not is_label_not_found(e):
+                    raise
+                # Cached label ID is stale; resolve it again once
+                label_id = self._get_label_id(refresh=True)
+                if not label_id:
+                    logger.warning(f"Label '{self.newsletter_label}' no longer exists for {self.user.email}")
+                    return []
+                msg_ids = self._list_new_messages(label_id)
             
-            messages = results.get('messages', [])
-            logger.info(f"Found {len(messages)} newsletters for {self.user.email}")
+            logger.info(f"Found {len(msg_ids)} newsletters for {self.user.email}")
             
-            newsletters = []
-            for msg in messages:
-                try:
-                    newsletter = self._parse_message(msg['id'])
-                    if newsletter:
-                        newsletters.append(newsletter)
-                except Exception as e:
-                    logger.error(f"Error parsing message {msg['id']}: {e}")
-            
-            return newsletters
+            return self._fetch_messages(msg_ids)
         
         except Exception as e:
             logger.error(f"Error fetching newsletters for {self.user.email}: {e}")
+            self.sync_history_id = None
             return []
     
-    def _parse_message(self, msg_id):
-        """Parse a Gmail message into a newsletter object."""
+    def _get_label_id(self, refresh=False):
+        """
+        Resolve the newsletter label name to its Gmail label ID.
+        
+        The ID is cached on UserPreferences and trusted until the TTL runs
+        out, unless `refresh` is set.
+        """
+        prefs = self.user.preferences
+        if prefs and not refresh and prefs.newsletter_label_id and prefs.label_id_resolved_at:
+            age = (datetime.utcnow() - prefs.label_id_resolved_at).total_seconds()
+            if age < get_label_cache_ttl():
+                return prefs.newsletter_label_id
+        
+        label_id = resolve_label_id(self.service, self.newsletter_label)
+        
+        if prefs:
+            prefs.newsletter_label_id = label_id
+            prefs.label_id_resolved_at = datetime.utcnow() if label_id else None
+            db.session.commit()
+        
+        return label_id
+    
+    def _list_new_messages(self, label_id):
+        """List messages to process, incrementally when we have a cursor."""
+        msg_ids = None
+        if self.gmail_token.history_id:
+            msg_ids = self._list_history_messages(label_id)
+        
+        if msg_ids is None:
+            msg_ids = self._list_label_messages(label_id)
+        
+        # Messages that failed last time are behind the cursor; retry them
+        return list(dict.fromkeys(msg_ids + self._list_retry_messages()))
+    
+    def _list_label_messages(self, label_id):
+        """
+        Full scan: list every unread message with the label.
+        Also records the mailbox historyId to start incremental syncs from.
+        """
+        profile = self.service.users().getProfile(userId='me').execute()
+        
+        msg_ids = []
+        for page, _ in self.iter_label_pages(
+            label_id, labels=['UNREAD'], page_size=self.max_results
+        ):
+            msg_ids.extend(page)
+        
+        self.sync_history_id = profile.get('historyId')
+        return msg_ids
+    
+    def _list_retry_messages(self):
+        """
+        List messages stored on an earlier run that never completed and
+        have attempts left.
+        """
+        return [
+            row.gmail_message_id
+            for row in Newsletter.query.filter(
+                Newsletter.user_id == self.user.id,
+                Newsletter.status.in_(['pending', 'failed']),
+                db.func.coalesce(Newsletter.attempts, 0) < get_max_attempts()
+            ).with_entities(Newsletter.gmail_message_id)
+        ]
+    
+    def _list_history_messages(self, label_id):
+        """
+        Incremental sync: list unread messages added to the label since the
+        stored historyId.
+        
+        Returns:
+            List of message IDs, or None if the cursor has expired
+        """
+        msg_ids = []
+        page_token = None
+        
         try:
-            msg = self.service.users().messages().get(
-                userId='me',
-                id=msg_id,
-                format='full'
-            ).execute()
-            
-            headers = msg['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            from_addr = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
+            while True:
+                request_kwargs = {
+                    'userId': 'me',
+                    'startHistoryId': self.gmail_token.history_id,
+                    'labelId': label_id,
+                    'historyTypes': ['messageAdded', 'labelAdded'],
+                }
+                if page_token:
+                    request_kwargs['pageToken'] = page_token
+                
+                results = self.service.users().history().list(**request_kwargs).execute()
+                
+                for record in results.get('history', []):
+                    changes = record.get('messagesAdded', []) + record.get('labelsAdded', [])
+                    for change in changes:
+                        message = change['message']
+                        label_ids = message.get('labelIds', [])
+                        if label_id in label_ids and 'UNREAD' in label_ids:
+                            msg_ids.append(message['id'])
+                
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+        
+        except HttpError as e:
+            if e.resp.status == 404:
+                logger.info(f"History cursor expired for {self.user.email}, falling back to full scan")
+                return None
+            raise
+        
+        self.sync_history_id = results.get('historyId', self.gmail_token.history_id)
+        return list(dict.fromkeys(msg_ids))
+    
+    def save_sync_cursor(self):
+        """Persist the historyId reached by the last fetch."""
+        if self.sync_history_id and self.sync_history_id != self.gmail_token.history_id:
+            self.gmail_token.history_id = str(self.sync_history_id)
+            db.session.commit()
+    
+    def iter_label_pages(self, label_id, page_token=None, labels=(), page_size=None):
+        """
+        Page through every message in the label.
+        
+        Args:
+            label_id: Gmail label ID
+            page_token: Page to start from, or None for the first page
+            labels: Further label IDs a message must have, e.g. UNREAD
+            page_size: Messages per page (GMAIL_BACKFILL_PAGE_SIZE by default)
+        
+        Yields:
+            (message IDs on the page, token of the following page or None)
+        """
+        page_size = page_size or int(os.getenv('GMAIL_BACKFILL_PAGE_SIZE', '100'))
+        
+        while True:
+            request_kwargs = {
+                'userId': 'me',
+                'labelIds': [label_id, *labels],
+                'maxResults': page_size,
+            }
+            if page_token:
+                request_kwargs['pageToken'] = page_token
             
-            # Get body
-            body = self._get_message_body(msg['payload'])
+            results = self.service.users().messages().list(**request_kwargs).execute()
+            page_token = results.get('nextPageToken')
             
-            # Create or update newsletter record
-            newsletter = Newsletter.query.filter_by(
-                user_id=self.user.id,
-                gmail_message_id=msg_id
-            ).first()
+            yield [msg['id'] for msg in results.get('messages', [])], page_token
             
+            if not page_token:
+                return
+    
+    def backfill_newsletters(self):
+        """
+        Fetch every newsletter in the label, resuming from the saved cursor.
+        
+        Messages that were already processed are skipped. The cursor for the
+        next page is only saved once the consumer has finished with the
+        current one, so a killed worker repeats at most one page.
+        
+        Yields:
+            Lists of newsletter objects
+        """
+        label_id = self._get_label_id()
+        if not label_id:
+            logger.warning(f"Label '{self.newsletter_label}' not found for {self.user.email}")
+            return
+        
+        rate_limiter = RateLimiter(float(os.getenv('GMAIL_BACKFILL_RATE', '5')))
+        page_token = self.gmail_token.backfill_page_token
+        if page_token:
+            logger.info(f"Resuming backfill for {self.user.email}")
+        
+        try:
+            for msg_ids, next_page_token in self.iter_label_pages(label_id, page_token):
+                pending = self._filter_unseen(msg_ids)
+                
+                for chunk in chunked(pending, self.batch_size):
+                    rate_limiter.acquire(len(chunk))
+                    newsletters = self._fetch_messages(chunk)
+                    if newsletters:
+                        yield newsletters
+                
+                self.gmail_token.backfill_page_token = next_page_token
+                db.session.commit()
+        
+        except HttpError as e:
+            if is_label_not_found(e):
+                # The cursor belongs to a label that is gone; start over next time
+                self.gmail_token.backfill_page_token = None
+                db.session.commit()
+                self._get_label_id(refresh=True)
+            raise
+        
+        logger.info(f"Backfill complete for {self.user.email}")
+    
+    def _fetch_messages(self, msg_ids):
+        """
+        Fetch and store messages using batched Gmail requests.
+        
+        Args:
+            msg_ids: List of Gmail message IDs
+        
+        Returns:
+            List of newsletter objects
+        """
+        # Triage on cheap checks first; only survivors are downloaded in full
+        errors = {}
+        msg_ids = self._filter_unseen(msg_ids)
+        msg_ids = triage_messages(
+            self.service, msg_ids, self.triage_rules,
+            batch_size=self.batch_size, quota_user=self.quota_user, errors=errors
+        )
+        
+        newsletters = []
+        unstored = []
+        for messages in batch_get_messages(
+            self.service, msg_ids, batch_size=self.batch_size, quota_user=self.quota_user,
+            errors=errors
+        ):
+            try:
+                newsletters.extend(self._store_batch(messages))
+            except Exception as e:
+                db.session.rollback()
+                unstored.extend(msg['id'] for msg in messages)
+                logger.error(f"Error storing batch of {len(messages)} messages for {self.user.email}: {e}")
+        
+        # Deleted messages will never be fetched; stop retrying them
+        gone = [msg_id for msg_id, error in errors.items() if is_message_not_found(error)]
+        self._mark_unavailable(gone)
+        
+        # Rejected by triage, gone or unparseable messages do not hold the
+        # cursor; ones lost to transient errors are listed again next run
+        if unstored or len(errors) > len(gone):
+            self.sync_history_id = None
+        
+        return newsletters
+    
+    def _mark_unavailable(self, msg_ids):
+        """Fails stored newsletters whose messages no longer exist, for good."""
+        if not msg_ids:
+            return
+        
+        Newsletter.query.filter(
+            Newsletter.user_id == self.user.id,
+            Newsletter.gmail_message_id.in_(msg_ids),
+            Newsletter.status != 'completed'
+        ).update({'status': 'failed', 'attempts': get_max_attempts()}, synchronize_session=False)
+        db.session.commit()
+        logger.info(f"{len(msg_ids)} messages no longer exist for {self.user.email}")
+    
+    def _filter_unseen(self, msg_ids):
+        """Drop messages that were already processed successfully."""
+        if not msg_ids:
+            return []
+        
+        completed = {
+            row.gmail_message_id
+            for row in Newsletter.query.filter(
+                Newsletter.user_id == self.user.id,
+                Newsletter.gmail_message_id.in_(msg_ids),
+                Newsletter.status == 'completed'
+            ).with_entities(Newsletter.gmail_message_id)
+        }
+        return [msg_id for msg_id in msg_ids if msg_id not in completed]
+    
+    def _store_batch(self, messages):
+        """Upsert Newsletter records for one batch in a single transaction."""
+        parsed = []
+        for msg in messages:
+            try:
+                parsed.append(self._parse_message(msg))
+            except Exception as e:
+                logger.error(f"Error parsing message {msg.get('id')}: {e}")
+        
+        if not parsed:
+            return []
+        
+        existing = {
+            newsletter.gmail_message_id: newsletter
+            for newsletter in Newsletter.query.filter(
+                Newsletter.user_id == self.user.id,
+                Newsletter.gmail_message_id.in_([item['id'] for item in parsed])
+            )
+        }
+        
+        records = []
+        for item in parsed:
+            newsletter = existing.get(item['id'])
             if not newsletter:
                 newsletter = Newsletter(
                     user_id=self.user.id,
-                    gmail_message_id=msg_id,
-                    original_subject=subject,
-                    original_content=body,
+                    gmail_message_id=item['id'],
+                    original_subject=item['subject'],
+                    original_content=item['body'],
                     status='pending'
                 )
                 db.session.add(newsletter)
-                db.session.commit()
-            
-            return {
-                'id': msg_id,
-                'subject': subject,
-                'from': from_addr,
-                'body': body,
-                'db_id': newsletter.id
-            }
+            records.append(newsletter)
         
-        except Exception as e:
-            logger.error(f"Error parsing message {msg_id}: {e}")
-            return None
+        db.session.commit()
+        
+        for item, newsletter in zip(parsed, records):
+            item['db_id'] = newsletter.id
+        
+        return parsed
+    
+    def _parse_message(self, msg):
+        """Parse a Gmail message resource into a newsletter object."""
+        headers = msg['payload']['headers']
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+        from_addr = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
+        
+        # Get body
+        body = self._get_message_body(msg['payload'])
+        
+        return {
+            'id': msg['id'],
+            'subject': subject,
+            'from': from_addr,
+            'body': body,
+        }
     
     def _get_message_body(self, payload):
         """Extract body from Gmail message payload."""
-        if 'parts' in payload:
-            return self._get_body_from_parts(payload['parts'])
-        
-        if 'body' in payload and 'data' in payload['body']:
-            import base64
-            return base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
-        
-        return ''
-    
-    def _get_body_from_parts(self, parts):
-        """Recursively extract body from message parts."""
-        body = ''
-        for part in parts:
-            if part['mimeType'] == 'text/plain':
-                if 'body' in part and 'data' in part['body']:
-                    import base64
-                    body += base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-            elif part['mimeType'] == 'text/html':
-                if 'body' in part and 'data' in part['body']:
-                    import base64
-                    body += base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-            elif 'parts' in part:
-                body += self._get_body_from_parts(part['parts'])
-        
-        return body
+        return self.body_extractor.extract(payload)
+    
+    def _log_body_stats(self, stats):
+        """Stats hook for the body extractor."""
+        if stats['bytes_skipped']:
+            logger.debug(
+                f"Skipped {stats['bytes_skipped']} bytes in {stats['parts_skipped']} parts "
+                f"for {self.user.email}"
+            )
     
     def mark_as_read(self, msg_id):
         """Mark a message as read."""
@@ -200,3 +461,52 @@ class MultiUserGmailAccessLayer:
             ).execute()
         except Exception as e:
             logger.error(f"Error marking message {msg_id} as read: {e}")
+    
+    def acknowledge(self, msg_id):
+        """Queue a processed message to be marked as read on the next flush."""
+        self._pending_acks.append(msg_id)
+    
+    def flush_acknowledgements(self):
+        """
+        Mark all queued messages as read with batchModify.
+        Also adds the GMAIL_PROCESSED_LABEL label when one is configured.
+        
+        Returns:
+            Number of messages acknowledged
+        """
+        if not self._pending_acks:
+            return 0
+        
+        msg_ids, self._pending_acks = self._pending_acks, []
+        try:
+            processed_label = get_processed_label()
+            try:
+                modified = batch_modify_messages(
+                    self.service, msg_ids, add_label_ids=self._processed_label_ids(processed_label)
+                )
+            except HttpError as e:
+                if not processed_label or not is_label_not_found(e):
+                    raise
+                # The label was deleted since its ID was cached; recreate it once
+                self._processed_label_id = None
+                modified = batch_modify_messages(
+                    self.service, msg_ids, add_label_ids=self._processed_label_ids(processed_label)
+                )
+            
+            logger.info(f"Marked {modified} messages as read for {self.user.email}")
+            return modified
+        
+        except Exception as e:
+            logger.error(f"Error marking {len(msg_ids)} messages as read for {self.user.email}: {e}")
+            return 0
+    
+    def _processed_label_ids(self, processed_label):
+        """
+        Label IDs to add on acknowledgement. The processed label's ID is
+        resolved (or the label created) once per access layer, not per flush.
+        """
+        if not processed_label:
+            return None
+        if not self._processed_label_id:
+            self._processed_label_id = ensure_label_id(self.service, processed_label)
+        return [self._processed_label_id]
@@ -0,0 +1,106 @@
+"""
+Database-backed summary cache tier
+"""
+
+import os
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from app.models import SummaryCacheEntry
+from phases.cache import create_cache
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseCache:
+    """
+    Persistent tier in the summary_cache table, shared by all workers.
+    
+    Reads ignore expired rows; prune() deletes them and then the least
+    recently used rows until the table is back under max_bytes. Writes go
+    through a savepoint, so two workers caching the same key cannot fail
+    the newsletter commit they are part of.
+    """
+    
+    def __init__(self, ttl, max_bytes):
+        self.ttl = timedelta(seconds=ttl)
+        self.max_bytes = max_bytes
+    
+    def get(self, key):
+        entry = SummaryCacheEntry.query.filter_by(key=key).first()
+        now = datetime.utcnow()
+        if not entry or entry.expires_at < now:
+            return None
+        entry.accessed_at = now
+        return entry.value
+    
+    def set(self, key, value):
+        now = datetime.utcnow()
+        try:
+            with db.session.begin_nested():
+                entry = SummaryCacheEntry.query.filter_by(key=key).first()
+                if not entry:
+                    entry = SummaryCacheEntry(key=key)
+                    db.session.add(entry)
+                entry.value = value
+                entry.size = len(value)
+                entry.expires_at = now + self.ttl
+                entry.accessed_at = now
+        except SQLAlchemyError as e:
+            logger.warning(f"Summary cache write failed: {e}")
+    
+    def prune(self):
+        """
+        Deletes expired entries, then least recently used ones over max_bytes.
+        
+        Returns:
+            Number of entries deleted
+        """
+        deleted = SummaryCacheEntry.query.filter(
+            SummaryCacheEntry.expires_at < datetime.utcnow()
+        ).delete(synchronize_session=False)
+        
+        total = db.session.query(db.func.coalesce(db.func.sum(SummaryCacheEntry.size), 0)).scalar()
+        if total > self.max_bytes:
+            target = self.max_bytes * 0.9
+            stale = []
+            for entry_id, size in db.session.query(
+                SummaryCacheEntry.id, SummaryCacheEntry.size
+            ).order_by(SummaryCacheEntry.accessed_at).yield_per(1000):
+                if total <= target:
+                    break
+                stale.append(entry_id)
+                total -= size
+            for start in range(0, len(stale), 500):
+                deleted += SummaryCacheEntry.query.filter(
+                    SummaryCacheEntry.id.in_(stale[start:start + 500])
+                ).delete(synchronize_session=False)
+        
+        db.session.commit()
+        return deleted
+
+
+def database_cache(ttl):
+    return DatabaseCache(ttl, int(float(os.getenv('SUMMARY_CACHE_DB_MB', '256')) * 1024 * 1024))
+
+
+_cache = None
+_cache_ready = False
+
+
+def get_worker_summary_cache():
+    """
+    Returns the worker's summary cache: an in-process LRU in front of the
+    summary_cache table unless SUMMARY_CACHE_BACKEND says otherwise.
+    """
+    global _cache, _cache_ready
+    if not _cache_ready:
+        _cache = create_cache(
+            'SUMMARY_CACHE',
+            os.path.join('.cache', 'summaries'),
+            backends={'database': database_cache},
+            default_backend='database'
+        )
+        _cache_ready = True
+    return _cache
@@ -2,13 +2,27 @@
 Background job processor using Celery
 """
 
+import os
+import asyncio
 import logging
+import threading
 from celery import Celery
+from celery.signals import worker_process_init
 from app import create_app, db
 from app.models import User, Newsletter
 from app.workers.multi_user_phase1 import MultiUserGmailAccessLayer
+from app.workers.token_manager import get_token_manager
+from app.workers.boilerplate_store import DatabaseTemplateStore
+from phases.boilerplate import BoilerplateFilter
+from phases.tokenizer import get_token_counter
+from phases.links import encode_links
+from phases.boilerplate import sender_key
+from phases.dedupe import simhash
+from app.workers.duplicate_index import DatabaseDuplicateIndex
+from app.workers.summary_cache import get_worker_summary_cache
 from phases.phase2_cleaning import CleaningEngine
-from phases.phase3_intelligence import IntelligenceLayer
+from phases.phase3_intelligence import IntelligenceLayer, ERROR_SUMMARY, get_provider_concurrency
+from phases.ollama_client import get_ollama_client
 from phases.phase4_delivery import DeliverySystem
 
 logger = logging.getLogger(__name__)
@@ -26,9 +40,221 @@ celery_app.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
+    # Backfills go to their own worker, which may start the cleaning pool
+    task_routes={
+        f'{__name__}.backfill_user_newsletters': {'queue': 'backfill'},
+    },
+    beat_schedule={
+        'refresh-expiring-gmail-tokens': {
+            'task': f'{__name__}.refresh_expiring_tokens',
+            'schedule': int(os.getenv('TOKEN_REFRESH_INTERVAL', '300')),
+        },
+        'prune-summary-cache': {
+            'task': f'{__name__}.prune_summary_cache',
+            'schedule': int(os.getenv('SUMMARY_CACHE_PRUNE_INTERVAL', '3600')),
+        },
+    },
 )
 
 
+@worker_process_init.connect
+def warm_up_ollama(**kwargs):
+    """
+    Loads the Ollama model as each worker process starts, so the first
+    newsletter does not wait for it. Runs in the background, since loading
+    can outlast the time a process gets to initialize.
+    """
+    if os.getenv('AI_PROVIDER', 'openai').lower() != 'ollama':
+        return
+    if os.getenv('OLLAMA_WARM_UP', 'true').lower() != 'true':
+        return
+    
+    client = get_ollama_client(
+        os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434'),
+        os.getenv('OLLAMA_MODEL', 'llama3'),
+        pool_size=get_provider_concurrency('ollama')
+    )
+    
+    def warm_up():
+        try:
+            client.warm_up()
+        except Exception as e:
+            logger.warning(f"Ollama warm-up failed: {e}")
+    
+    threading.Thread(target=warm_up, daemon=True).start()
+
+
+_loops = threading.local()
+
+
+def run_async(coroutine):
+    """
+    Runs a coroutine on this thread's long-lived event loop. Unlike
+    asyncio.run(), the loop outlives the task, so the pooled async Ollama
+    connections are reused by the worker's later tasks.
+    """
+    loop = getattr(_loops, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = _loops.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coroutine)
+
+
+def _process_newsletters(user, access_layer, newsletters, digest=None):
+    """
+    Run phases 2-4 on fetched newsletters for a user.
+    
+    Args:
+        digest: List to collect digest entries in, for a caller that sends
+            one digest for several calls; by default one is sent here
+    
+    Returns:
+        Number of newsletters processed successfully
+    """
+    # Learned templates live in the database rather than the CLI's file
+    boilerplate = None
+    if os.getenv('BOILERPLATE_FILTER', 'true').lower() == 'true':
+        boilerplate = BoilerplateFilter(DatabaseTemplateStore(user.id), get_token_counter())
+    
+    cleaning_engine = CleaningEngine(boilerplate=boilerplate)
+    intelligence_layer = IntelligenceLayer(
+        summary_style=user.preferences.summary_style if user.preferences else None,
+        cache=get_worker_summary_cache() or False
+    )
+    duplicate_index = DatabaseDuplicateIndex(user.id)
+    
+    records = {
+        newsletter.id: newsletter
+        for newsletter in Newsletter.query.filter(
+            Newsletter.id.in_([item['db_id'] for item in newsletters])
+        )
+    }
+    newsletters = [item for item in newsletters if item['db_id'] in records]
+    for newsletter in records.values():
+        newsletter.status = 'processing'
+        newsletter.attempts = (newsletter.attempts or 0) + 1
+    db.session.commit()
+    
+    # Phase 2: Clean the whole batch up front; large backfill batches use the
+    # process pool on the solo-pool backfill worker, the rest clean in-process
+    cleaned_batch = cleaning_engine.clean_all([
+        {
+            'subject': records[item['db_id']].original_subject or '',
+            'from': item.get('from', ''),
+            'body': records[item['db_id']].original_content or ''
+        }
+        for item in newsletters
+    ])
+    
+    # Store Phase 2 results; resends and syndicated copies of an earlier,
+    # already summarized issue reuse its summary
+    batch = []
+    to_summarize = []
+    for newsletter_data, cleaned_newsletter in zip(newsletters, cleaned_batch):
+        newsletter = records[newsletter_data['db_id']]
+        try:
+            cleaned = cleaned_newsletter['clean_body']
+            newsletter.cleaned_content = cleaned
+            newsletter.links = encode_links(cleaned_newsletter.get('links', []))
+            newsletter.boilerplate_tokens_saved = cleaned_newsletter.get('boilerplate_tokens_saved', 0)
+            
+            original = None
+            sender = sender_key(newsletter_data.get('from', ''))
+            signature = simhash(cleaned)
+            if sender and signature is not None:
+                original = duplicate_index.find(sender, signature, exclude_id=newsletter.id)
+                duplicate_index.add(newsletter, sender, signature)
+            
+            if original:
+                newsletter.summary = original.summary
+                newsletter.duplicate_of = original.duplicate_of or original.id
+                logger.info(f"Newsletter {newsletter.id} is a near-duplicate of {newsletter.duplicate_of}")
+            else:
+                to_summarize.append({
+                    'db_id': newsletter.id,
+                    'sender': sender or newsletter_data.get('from', 'Unknown'),
+                    'clean_body': cleaned
+                })
+            batch.append((newsletter_data, newsletter, cleaned_newsletter))
+        
+        except Exception as e:
+            logger.error(f"Error processing newsletter for {user.email}: {e}")
+            newsletter.status = 'failed'
+            db.session.commit()
+    
+    # Phase 3: Summarize the rest concurrently (identical content may hit
+    # the summary cache; near-duplicates within the batch share a request)
+    summarized = {}
+    if to_summarize:
+        timeout = float(os.getenv('SUMMARY_TIMEOUT', '0')) or None
+        for item in run_async(intelligence_layer.summarize_all_async(to_summarize, timeout=timeout)):
+            summarized[item['db_id']] = item
+    
+    processed_count = 0
+    entries = []
+    for newsletter_data, newsletter, cleaned_newsletter in batch:
+        try:
+            item = summarized.get(newsletter.id)
+            if item:
+                if item['summary'] == ERROR_SUMMARY:
+                    raise Exception("Summarization failed")
+                newsletter.summary = '\n'.join(item['summary'])
+                
+                if 'duplicate_of' in item:
+                    newsletter.duplicate_of = to_summarize[item['duplicate_of']]['db_id']
+                else:
+                    # Phase 4 sends one digest for the run (never a duplicate again)
+                    entries.append({
+                        'sender': newsletter_data.get('from', 'Unknown'),
+                        'subject': newsletter.original_subject,
+                        'summary': item['summary'],
+                        'links': cleaned_newsletter.get('links', [])
+                    })
+            
+            # Mark as complete
+            newsletter.status = 'completed'
+            from datetime import datetime
+            newsletter.processed_at = datetime.utcnow()
+            db.session.commit()
+            
+            # Mark as read in Gmail (sent in bulk below)
+            access_layer.acknowledge(newsletter.gmail_message_id)
+            
+            processed_count += 1
+            logger.info(f"Processed newsletter {newsletter.id} for {user.email}")
+        
+        except Exception as e:
+            logger.error(f"Error processing newsletter for {user.email}: {e}")
+            newsletter.status = 'failed'
+            db.session.commit()
+    
+    # Checkpoint: one batchModify for everything processed above
+    access_layer.flush_acknowledgements()
+    
+    # Phase 4: Deliver. DeliverySystem only sends digests (the CLI sends one
+    # per run too), so summaries go out together rather than one email each
+    if digest is None:
+        _send_digest(user, entries)
+    else:
+        digest.extend(entries)
+    
+    return processed_count
+
+
+def _send_digest(user, digest):
+    """Email one digest of the given entries, if the user has auto-send on."""
+    if not digest or not (user.preferences and user.preferences.auto_send):
+        return
+    
+    delivery_system = DeliverySystem()
+    try:
+        delivery_system.send_digest(
+            delivery_system.compile_digest(digest),
+            recipient_email=user.preferences.send_to_email or user.email
+        )
+    except Exception as e:
+        logger.error(f"Error sending digest to {user.email}: {e}")
+
+
 @celery_app.task
 def process_user_newsletters(user_id):
     """
@@ -51,61 +277,16 @@ def process_user_newsletters(user_id):
             newsletters = access_layer.fetch_newsletters()
             
             if not newsletters:
+                access_layer.save_sync_cursor()
                 logger.info(f"No newsletters found for {user.email}")
                 return {'status': 'success', 'processed': 0, 'message': 'No newsletters to process'}
             
             logger.info(f"Found {len(newsletters)} newsletters for {user.email}")
             
             # Phase 2-4: Process each newsletter
-            cleaning_engine = CleaningEngine()
-            intelligence_layer = IntelligenceLayer()
-            delivery_system = DeliverySystem()
+            processed_count = _process_newsletters(user, access_layer, newsletters)
             
-            processed_count = 0
-            for newsletter_data in newsletters:
-                try:
-                    newsletter_id = newsletter_data['db_id']
-                    newsletter = Newsletter.query.get(newsletter_id)
-                    
-                    # Phase 2: Clean
-                    newsletter.status = 'processing'
-                    db.session.commit()
-                    
-                    cleaned = cleaning_engine.clean(newsletter.original_content)
-                    newsletter.cleaned_content = cleaned
-                    
-                    # Phase 3: Summarize
-                    summary = intelligence_layer.summarize(
-                        cleaned,
-                        style=user.preferences.summary_style if user.preferences else 'bullet-points'
-                    )
-                    newsletter.summary = summary
-                    
-                    # Phase 4: Deliver
-                    if user.preferences and user.preferences.auto_send:
-                        delivery_system.send_summary(
-                            to_email=user.preferences.send_to_email or user.email,
-                            subject=f"Summary: {newsletter.original_subject}",
-                            content=summary
-                        )
-                    
-                    # Mark as complete
-                    newsletter.status = 'completed'
-                    from datetime import datetime
-                    newsletter.processed_at = datetime.utcnow()
-                    db.session.commit()
-                    
-                    # Mark as read in Gmail
-                    access_layer.mark_as_read(newsletter.gmail_message_id)
-                    
-                    processed_count += 1
-                    logger.info(f"Processed newsletter {newsletter_id} for {user.email}")
-                
-                except Exception as e:
-                    logger.error(f"Error processing newsletter for {user.email}: {e}")
-                    if newsletter:
-                        newsletter.status = 'failed'
-                        db.session.commit()
+            access_layer.save_sync_cursor()
             
             logger.info(f"Completed processing {processed_count} newsletters for {user.email}")
             return {
@@ -119,6 +300,49 @@ def process_user_newsletters(user_id):
             return {'status': 'error', 'message': str(e)}
 
 
+@celery_app.task
+def backfill_user_newsletters(user_id):
+    """
+    Background task to work through a user's whole newsletter label.
+    
+    Pages through every message in the label, skipping ones already
+    processed. The page cursor is saved as it goes, so re-queueing the
+    task after a worker is killed resumes where it stopped.
+    
+    Args:
+        user_id: ID of the user to backfill newsletters for
+    """
+    with flask_app.app_context():
+        try:
+            user = User.query.get(user_id)
+            if not user or not user.gmail_token:
+                logger.warning(f"Cannot backfill: User {user_id} not found or no Gmail token")
+                return {'status': 'error', 'message': 'User or Gmail token not found'}
+            
+            logger.info(f"Starting newsletter backfill for {user.email}")
+            
+            access_layer = MultiUserGmailAccessLayer(user)
+            
+            # One digest for the whole backfill rather than one per chunk
+            processed_count = 0
+            digest = []
+            for newsletters in access_layer.backfill_newsletters():
+                processed_count += _process_newsletters(user, access_layer, newsletters, digest)
+            
+            _send_digest(user, digest)
+            
+            logger.info(f"Backfill processed {processed_count} newsletters for {user.email}")
+            return {
+                'status': 'success',
+                'processed': processed_count,
+                'user': user.email
+            }
+        
+        except Exception as e:
+            logger.error(f"Error in backfill_user_newsletters: {e}")
+            return {'status': 'error', 'message': str(e)}
+
+
 @celery_app.task
 def process_all_users():
     """
@@ -140,3 +364,29 @@ def process_all_users():
         
         logger.info(f"Queued {len(results)} users for newsletter processing")
         return results
+
+
+@celery_app.task
+def refresh_expiring_tokens():
+    """
+    Periodic task that refreshes Gmail tokens before they expire,
+    so pipeline runs never wait on the OAuth endpoint.
+    """
+    with flask_app.app_context():
+        refreshed = get_token_manager().refresh_expiring()
+        logger.info(f"Checked {refreshed} expiring Gmail tokens")
+        return {'status': 'success', 'refreshed': refreshed}
+
+
+@celery_app.task
+def prune_summary_cache():
+    """
+    Periodic task that deletes expired and least recently used rows from
+    the summary_cache table.
+    """
+    with flask_app.app_context():
+        cache = get_worker_summary_cache()
+        tiers = [tier for tier in cache.tiers if hasattr(tier, 'prune')] if cache else []
+        deleted = sum(tier.prune() for tier in tiers)
+        logger.info(f"Pruned {deleted} summary cache entries")
+        return {'status': 'success', 'deleted': deleted}
@@ -0,0 +1,214 @@
+"""
+OAuth token manager
+Proactive Gmail token refresh with per-user single-flight locking
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from app import db
+from app.models import GmailToken
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
+TOKEN_URI = 'https://oauth2.googleapis.com/token'
+
+
+class LocalLockBackend:
+    """In-process stand-in for Redis locks (tests and single-worker setups)."""
+    
+    def __init__(self):
+        self._locks = {}
+        self._guard = threading.Lock()
+    
+    def lock(self, name, timeout):
+        with self._guard:
+            return self._locks.setdefault(name, _LocalLock())
+
+
+class _LocalLock:
+    """threading.Lock with the acquire/release signature of redis-py locks."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+    
+    def acquire(self, blocking=True, blocking_timeout=None):
+        if not blocking:
+            return self._lock.acquire(blocking=False)
+        return self._lock.acquire(timeout=-1 if blocking_timeout is None else blocking_timeout)
+    
+    def release(self):
+        self._lock.release()
+
+
+class RedisLockBackend:
+    """Locks shared by every worker process through Redis."""
+    
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+    
+    def lock(self, name, timeout):
+        return self.client.lock(name, timeout=timeout)
+
+
+def _create_lock_backend():
+    """Picks the lock backend from TOKEN_LOCK_BACKEND."""
+    backend = os.getenv('TOKEN_LOCK_BACKEND', 'redis').lower()
+    if backend == 'local':
+        return LocalLockBackend()
+    if backend == 'redis':
+        return RedisLockBackend(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+    raise ValueError(f"Unknown token lock backend: {backend}")
+
+
+class TokenManager:
+    """
+    Keeps Gmail access tokens fresh ahead of their expiry.
+    
+    Refreshes run in a periodic task, one at a time per user across all
+    workers. Pipeline runs read credentials from a short-lived in-process
+    cache and only refresh inline if the background refresh was missed.
+    """
+    
+    def __init__(self, lock_backend=None):
+        self.lock_backend = lock_backend or _create_lock_backend()
+        self.refresh_margin = timedelta(seconds=int(os.getenv('TOKEN_REFRESH_MARGIN', '600')))
+        self.cache_ttl = int(os.getenv('TOKEN_CACHE_TTL', '60'))
+        self.lock_timeout = int(os.getenv('TOKEN_LOCK_TIMEOUT', '30'))
+        self._cache = {}
+    
+    def get_credentials(self, gmail_token):
+        """
+        Returns valid credentials for a user without blocking on a refresh
+        unless the stored token has already expired.
+        
+        Args:
+            gmail_token: GmailToken record
+        """
+        cached = self._cache.get(gmail_token.user_id)
+        if cached:
+            creds, cached_at = cached
+            if (
+                time.monotonic() - cached_at < self.cache_ttl
+                and creds.token == gmail_token.access_token
+                and not creds.expired
+            ):
+                return creds
+        
+        creds = self._build_credentials(gmail_token)
+        if creds.expired and creds.refresh_token:
+            logger.warning(f"Token for user {gmail_token.user_id} expired before background refresh")
+            creds = self.refresh(gmail_token)
+        
+        self._cache[gmail_token.user_id] = (creds, time.monotonic())
+        return creds
+    
+    def needs_refresh(self, gmail_token):
+        """True if the token expires within the refresh margin."""
+        if not gmail_token.token_expires_at:
+            return True
+        return gmail_token.token_expires_at <= datetime.utcnow() + self.refresh_margin
+    
+    def refresh(self, gmail_token):
+        """
+        Refreshes a user's token, single-flight across workers.
+        
+        If another worker holds the lock, waits for it and uses the token it
+        stored instead of refreshing again. Tokens outside the refresh margin
+        are left alone.
+        
+        Args:
+            gmail_token: GmailToken record
+        
+        Returns:
+            Current credentials for the user
+        """
+        lock = self.lock_backend.lock(
+            f"gmail-token-refresh:{gmail_token.user_id}",
+            timeout=self.lock_timeout
+        )
+        if not lock.acquire(blocking_timeout=self.lock_timeout):
+            logger.warning(f"Timed out waiting for token refresh lock for user {gmail_token.user_id}")
+            db.session.refresh(gmail_token)
+            return self._build_credentials(gmail_token)
+        
+        try:
+            # Another worker may have refreshed while we waited
+            db.session.refresh(gmail_token)
+            creds = self._build_credentials(gmail_token)
+            
+            if not self.needs_refresh(gmail_token):
+                return creds
+            
+            creds.refresh(Request())
+            gmail_token.access_token = creds.token
+            gmail_token.token_expires_at = creds.expiry
+            db.session.commit()
+            
+            self._cache[gmail_token.user_id] = (creds, time.monotonic())
+            logger.info(f"Refreshed Gmail token for user {gmail_token.user_id}")
+            return creds
+        
+        finally:
+            lock.release()
+    
+    def refresh_expiring(self):
+        """
+        Refreshes every token that expires within the refresh margin.
+        
+        Returns:
+            Number of tokens checked without errors
+        """
+        cutoff = datetime.utcnow() + self.refresh_margin
+        tokens = GmailToken.query.filter(
+            GmailToken.refresh_token.isnot(None),
+            db.or_(
+                GmailToken.token_expires_at.is_(None),
+                GmailToken.token_expires_at <= cutoff
+            )
+        ).all()
+        
+        refreshed = 0
+        for gmail_token in tokens:
+            try:
+                self.refresh(gmail_token)
+                refreshed += 1
+            except Exception as e:
+                db.session.rollback()
+                self.invalidate(gmail_token.user_id)
+                logger.error(f"Error refreshing token for user {gmail_token.user_id}: {e}")
+        
+        return refreshed
+    
+    def invalidate(self, user_id):
+        """Drops a user's cached credentials."""
+        self._cache.pop(user_id, None)
+    
+    def _build_credentials(self, gmail_token):
+        """Creates credentials from a stored token."""
+        return Credentials(
+            token=gmail_token.access_token,
+            refresh_token=gmail_token.refresh_token,
+            token_uri=TOKEN_URI,
+            client_id=os.getenv('GOOGLE_CLIENT_ID'),
+            client_secret=os.getenv('GOOGLE_CLIENT_SECRET'),
+            scopes=SCOPES,
+            expiry=gmail_token.token_expires_at
+        )
+
+
+_token_manager = None
+
+
+def get_token_manager():
+    """Returns the process-wide TokenManager."""
+    global _token_manager
+    if _token_manager is None:
+        _token_manager = TokenManager()
+    return _token_manager
@@ -0,0 +1 @@
+# Benchmarks for Newsletter Distiller
@@ -0,0 +1,77 @@
+"""
+Benchmark: sequential vs concurrent summarization
+
+Summarizes a batch of newsletters against a local fake Ollama server
+(benchmarks/fake_provider.py) that answers after a fixed delay: one at a
+time with summarize_all, then with summarize_all_async, and then with
+summarize_all_async packing several newsletters into each request.
+
+Run from the project root:
+    python -m benchmarks.bench_async_summarization [newsletters] [latency ms] [concurrency]
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+from benchmarks.corpus import WORDS
+from benchmarks.fake_provider import FakeOllama
+
+
+def make_batch(count, seed=0):
+    """Newsletters with unrelated text, so none is a near-duplicate."""
+    rng = random.Random(seed)
+    vocab = WORDS['en']
+    return [
+        {
+            'sender': f'news{i}@mailer.example',
+            'clean_body': ' '.join(rng.choice(vocab) for _ in range(300)),
+        }
+        for i in range(count)
+    ]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 500) / 1000
+    concurrency = sys.argv[3] if len(sys.argv) > 3 else '4'
+    
+    with FakeOllama(latency=latency) as server:
+        os.environ['AI_PROVIDER'] = 'ollama'
+        os.environ['OLLAMA_BASE_URL'] = server.url
+        os.environ['SUMMARY_CONCURRENCY_OLLAMA'] = concurrency
+        os.environ['SUMMARY_USER_CONCURRENCY'] = concurrency
+        
+        # Imported after the environment is set up
+        from phases.phase3_intelligence import IntelligenceLayer
+        layer = IntelligenceLayer(cache=False)
+        
+        print(f"{count} newsletters, {latency * 1000:.0f} ms provider latency, concurrency {concurrency}")
+        
+        start = time.perf_counter()
+        layer.summarize_all(make_batch(count))
+        sequential = time.perf_counter() - start
+        print(f"sequential: {sequential:6.2f} s  (max in flight {server.max_in_flight})")
+        
+        server.reset()
+        start = time.perf_counter()
+        results = asyncio.run(layer.summarize_all_async(make_batch(count)))
+        concurrent = time.perf_counter() - start
+        print(f"async:      {concurrent:6.2f} s  (max in flight {server.max_in_flight})")
+        print(f"speedup:    {sequential / concurrent:.1f}x")
+        
+        server.reset()
+        layer.packing = True
+        start = time.perf_counter()
+        results = asyncio.run(layer.summarize_all_async(make_batch(count)))
+        packed = time.perf_counter() - start
+        print(f"packed:     {packed:6.2f} s  ({server.requests} requests)")
+        
+        failed = sum(1 for item in results if item['summary'][0].startswith('Error'))
+        if failed:
+            print(f"{failed} summaries failed")
+
+
+if __name__ == '__main__':
+    main()
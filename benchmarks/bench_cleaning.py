@@ -0,0 +1,182 @@
+"""
+Benchmark suite: cleaning stage
+
+Runs clean_single, _extract_text_and_links and _truncate_text over a
+seeded synthetic corpus (benchmarks/corpus.py) and reports throughput
+(documents/s and MB/s), p50/p99 latency and peak traced memory. Results
+can be saved as JSON and compared with an earlier run.
+
+Run from the project root:
+    python -m benchmarks.bench_cleaning --count 200 --output results.json
+    python -m benchmarks.bench_cleaning --baseline results.json
+"""
+
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+from datetime import datetime
+from phases.phase2_cleaning import CleaningEngine
+from benchmarks.corpus import generate_corpus, DEFAULT_MIN_SIZE, DEFAULT_MAX_SIZE
+
+MB = 1024 * 1024
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_case(func, inputs, sizes, prepare=None):
+    """
+    Times func over every input, then runs it again under tracemalloc.
+    
+    Memory is measured in a separate pass because tracing slows Python
+    down enough to distort the latency numbers. `prepare` turns an input
+    into func's argument outside the timed and traced region.
+    """
+    prepare = prepare or (lambda item: item)
+    
+    latencies = []
+    for item in inputs:
+        arg = prepare(item)
+        start = time.perf_counter()
+        func(arg)
+        latencies.append(time.perf_counter() - start)
+    
+    peak = 0
+    for item in inputs:
+        arg = prepare(item)
+        tracemalloc.start()
+        try:
+            func(arg)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    
+    total = sum(latencies)
+    megabytes = sum(sizes) / MB
+    latencies.sort()
+    return {
+        'documents': len(inputs),
+        'megabytes': round(megabytes, 3),
+        'seconds': round(total, 4),
+        'documents_per_second': round(len(inputs) / total, 2) if total else None,
+        'megabytes_per_second': round(megabytes / total, 3) if total else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def reset_caches(engine):
+    """Empties the token counter's memo so no case runs on another's warm cache."""
+    counter = engine.token_counter
+    counter._block_cache.clear()
+    if hasattr(counter, '_word_tokens'):
+        counter._word_tokens.cache_clear()
+
+
+def run_suite(corpus, engine):
+    """Runs every cleaning benchmark over the corpus."""
+    sizes = [len(item['body'].encode('utf-8')) for item in corpus]
+    results = {}
+    
+    # Each run gets a fresh dict, since clean_single writes to its input
+    reset_caches(engine)
+    results['clean_single'] = run_case(
+        lambda item: engine.clean_single({'subject': item['subject'], 'body': item['body']}),
+        corpus,
+        sizes
+    )
+    
+    # Parsing is not part of the extraction benchmark
+    reset_caches(engine)
+    results['extract_text_and_links'] = run_case(
+        engine._extract_text_and_links,
+        corpus,
+        sizes,
+        prepare=lambda item: engine._parse(item['body'])
+    )
+    
+    texts = [engine._extract_text_and_links(engine._parse(item['body']))[0] for item in corpus]
+    reset_caches(engine)
+    results['truncate_text'] = run_case(
+        engine._truncate_text,
+        texts,
+        [len(text.encode('utf-8')) for text in texts]
+    )
+    
+    return results
+
+
+def compare(results, baseline):
+    """Prints the change in throughput and p99 against a saved run."""
+    print(f"\nchange vs baseline ({baseline['meta']['timestamp']}):")
+    for name, current in results.items():
+        previous = baseline['results'].get(name)
+        if not previous or not previous['documents_per_second']:
+            continue
+        throughput = current['documents_per_second'] / previous['documents_per_second'] - 1
+        p99 = current['p99_ms'] / previous['p99_ms'] - 1 if previous['p99_ms'] else 0
+        print(f"  {name:24s} throughput {throughput:+7.1%}   p99 {p99:+7.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--count', type=int, default=100, help='newsletters in the corpus')
+    parser.add_argument('--seed', type=int, default=0, help='corpus seed')
+    parser.add_argument('--min-size', type=int, default=DEFAULT_MIN_SIZE, help='smallest document in bytes')
+    parser.add_argument('--max-size', type=int, default=DEFAULT_MAX_SIZE, help='largest document in bytes')
+    parser.add_argument('--parser', help='HTML parser backend (default: HTML_PARSER)')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare with results from an earlier --output')
+    args = parser.parse_args()
+    
+    corpus = generate_corpus(args.count, args.seed, args.min_size, args.max_size)
+    engine = CleaningEngine(parser=args.parser, boilerplate=False, cache=False)
+    
+    results = run_suite(corpus, engine)
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parser': engine.parser,
+            'token_counter': type(engine.token_counter).__name__,
+            'count': args.count,
+            'seed': args.seed,
+            'min_size': args.min_size,
+            'max_size': args.max_size,
+        },
+        'results': results,
+    }
+    
+    total_mb = sum(len(item['body'].encode('utf-8')) for item in corpus) / MB
+    print(f"{args.count} newsletters, {total_mb:.1f} MB, seed {args.seed}, parser {engine.parser}")
+    print(f"{'benchmark':24s} {'docs/s':>9s} {'MB/s':>8s} {'p50 ms':>9s} {'p99 ms':>9s} {'peak KB':>10s}")
+    for name, result in results.items():
+        print(
+            f"{name:24s} {result['documents_per_second']:9.1f} {result['megabytes_per_second']:8.2f} "
+            f"{result['p50_ms']:9.2f} {result['p99_ms']:9.2f} {result['peak_memory_kb']:10.0f}"
+        )
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nresults written to {args.output}")
+    
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""
+Benchmark: per-task Gmail service setup cost
+
+Compares building a fresh service with discovery.build (what each task
+used to do) against the process-wide factory in phases.gmail_api.
+
+Run from the project root:
+    python -m benchmarks.bench_gmail_service [iterations]
+"""
+
+import sys
+import time
+from google.oauth2.credentials import Credentials
+from googleapiclient import discovery
+from phases.gmail_api import build_gmail_service
+
+
+def _time_per_call(build, iterations):
+    """Returns the mean seconds per call of build(creds)."""
+    start = time.perf_counter()
+    for i in range(iterations):
+        creds = Credentials(token=f'token-{i}')
+        service = build(creds)
+        # Touch a method so lazily built resources are included
+        service.users().messages()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    
+    before = _time_per_call(
+        lambda creds: discovery.build('gmail', 'v1', credentials=creds, cache_discovery=False),
+        iterations
+    )
+    after = _time_per_call(build_gmail_service, iterations)
+    
+    print(f"iterations:          {iterations}")
+    print(f"discovery.build:     {before * 1000:.2f} ms/task")
+    print(f"build_gmail_service: {after * 1000:.2f} ms/task")
+    print(f"speedup:             {before / after:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark: Ollama client round trips
+
+Against a local fake Ollama server (benchmarks/fake_provider.py) whose
+replies carry three bullets and then some chatter, compares:
+    
+    requests.post     a new connection and a full reply per call (the old client)
+    pooled            OllamaClient keep-alive session, full reply
+    pooled + stream   keep-alive session, streamed, stopping after three bullets
+
+and the first call's latency with and without a warm-up at worker start.
+
+Run from the project root:
+    python -m benchmarks.bench_ollama_client [calls] [token ms] [load ms]
+"""
+
+import sys
+import time
+import requests
+from phases.ollama_client import OllamaClient
+from benchmarks.fake_provider import FakeOllama
+
+PROMPT = "Summarize this newsletter."
+
+
+def _run(server, call, count):
+    """Returns (mean seconds per call, new connections) over count calls."""
+    server.reset()
+    start = time.perf_counter()
+    for _ in range(count):
+        call()
+    return (time.perf_counter() - start) / count, server.connections
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    token_latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 5) / 1000
+    load_time = (int(sys.argv[3]) if len(sys.argv) > 3 else 2000) / 1000
+    
+    with FakeOllama(latency=0.005, token_latency=token_latency, load_time=load_time) as server:
+        client = OllamaClient(server.url, 'fake')
+        
+        # First call of the day, then the same after a warm-up
+        start = time.perf_counter()
+        client.generate(PROMPT)
+        cold = time.perf_counter() - start
+        server.reset(unload=True)
+        client.warm_up()
+        start = time.perf_counter()
+        client.generate(PROMPT)
+        warm = time.perf_counter() - start
+        
+        def bare():
+            response = requests.post(
+                f"{server.url}/api/generate",
+                json={"model": "fake", "prompt": PROMPT, "stream": False},
+                timeout=60
+            )
+            return response.json()['response']
+        
+        cases = [
+            ('requests.post', bare),
+            ('pooled', lambda: client.generate(PROMPT)),
+            ('pooled + stream', lambda: client.generate(PROMPT, stream=True, stop_after_bullets=3)),
+        ]
+        
+        print(f"{count} calls, {token_latency * 1000:.0f} ms per token, {load_time * 1000:.0f} ms model load")
+        print(f"first call cold:       {cold * 1000:8.1f} ms")
+        print(f"first call warmed up:  {warm * 1000:8.1f} ms")
+        print(f"{'client':20s} {'ms/call':>9s} {'connections':>12s}")
+        for name, call in cases:
+            seconds, connections = _run(server, call, count)
+            print(f"{name:20s} {seconds * 1000:9.2f} {connections:12d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark: parallel cleaning across cores
+
+Cleans the same batch of synthetic newsletters in-process and then
+through CleaningPool with 1, 2, 4 ... N worker processes, and reports
+throughput and speedup over the in-process run.
+
+Run from the project root:
+    python -m benchmarks.bench_parallel_cleaning [newsletters] [max workers]
+"""
+
+import os
+import sys
+import time
+from phases.phase2_cleaning import CleaningEngine
+from phases.parallel import CleaningPool
+from benchmarks.bench_text_extraction import nested_layout
+
+
+def worker_counts(max_workers):
+    """1, 2, 4 ... up to max_workers, always ending with max_workers."""
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    
+    # Every job has the same body, so the cleaned-output cache would turn
+    # the runs into cache hits; worker processes inherit this setting
+    os.environ['CLEAN_CACHE_MEMORY_MB'] = '0'
+    os.environ['CLEAN_CACHE_BACKEND'] = 'none'
+    
+    engine = CleaningEngine(boilerplate=False, cache=False)
+    html = nested_layout(6, 60)
+    
+    print(f"{count} newsletters, {len(html) / 1024:.0f} KB HTML each, parser {engine.parser}")
+    
+    start = time.perf_counter()
+    for i in range(count):
+        engine.clean_single({'subject': f'Issue {i}', 'body': html})
+    baseline = time.perf_counter() - start
+    print(f"in-process:  {baseline:7.2f} s  {count / baseline:7.1f} newsletters/s")
+    
+    jobs = [(engine.parser, html.encode('utf-8'), f'Issue {i}', None, None) for i in range(count)]
+    for workers in worker_counts(max_workers):
+        pool = CleaningPool(workers=workers)
+        pool.map(jobs[:workers])  # start the processes before timing
+        
+        start = time.perf_counter()
+        pool.map(jobs)
+        elapsed = time.perf_counter() - start
+        pool.shutdown()
+        
+        print(
+            f"{workers:3d} workers: {elapsed:7.2f} s  {count / elapsed:7.1f} newsletters/s  "
+            f"speedup {baseline / elapsed:.2f}x"
+        )
+
+
+if __name__ == '__main__':
+    main()
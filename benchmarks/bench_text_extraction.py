@@ -0,0 +1,83 @@
+"""
+Benchmark: text extraction on deeply nested newsletter layouts
+
+Compares the single-walk extractor in CleaningEngine with the previous
+find_all + get_text approach, which re-visits nested text at every
+ancestor level.
+
+Run from the project root:
+    python -m benchmarks.bench_text_extraction [depth] [sections]
+"""
+
+import sys
+import time
+from bs4 import BeautifulSoup
+from phases.phase2_cleaning import CleaningEngine
+
+
+def legacy_extract(soup):
+    """The find_all based extractor this benchmark compares against."""
+    text_parts = []
+    links = []
+    
+    for script in soup(['script', 'style', 'noscript']):
+        script.decompose()
+    
+    for tag in soup.find_all(['p', 'div', 'li', 'td', 'h1', 'h2', 'h3']):
+        text = tag.get_text(strip=True)
+        if text:
+            text_parts.append(text)
+    
+    for link in soup.find_all('a', href=True):
+        url = link['href']
+        link_text = link.get_text(strip=True)
+        if url.startswith('http') and len(link_text) > 0:
+            links.append({'text': link_text, 'url': url})
+    
+    return '\n\n'.join(text_parts), links
+
+
+def nested_layout(depth, sections):
+    """Builds table-in-div layout nested `depth` levels around each section."""
+    section = (
+        '<h2>Section heading</h2>'
+        '<p>Newsletter paragraph with <a href="https://example.com/story">a story link</a> '
+        'and enough words to look like real content in an issue.</p>'
+        '<ul><li>First point</li><li>Second point</li></ul>'
+    )
+    open_tags = '<div><table><tr><td>' * depth
+    close_tags = '</td></tr></table></div>' * depth
+    body = ''.join(open_tags + section + close_tags for _ in range(sections))
+    return f'<html><body>{body}</body></html>'
+
+
+def _measure(extract, html, parser, rounds=3):
+    """Returns (best CPU seconds, output chars) over a few rounds."""
+    best = None
+    for _ in range(rounds):
+        soup = BeautifulSoup(html, parser)
+        start = time.process_time()
+        text, _ = extract(soup)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(text)
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    sections = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    
+    engine = CleaningEngine()
+    html = nested_layout(depth, sections)
+    
+    legacy_time, legacy_chars = _measure(legacy_extract, html, engine.parser)
+    walk_time, walk_chars = _measure(engine._extract_text_and_links, html, engine.parser)
+    
+    print(f"layout: depth {depth}, {sections} sections, {len(html) / 1024:.0f} KB HTML")
+    print(f"find_all + get_text: {legacy_time * 1000:8.1f} ms CPU, {legacy_chars:9d} chars")
+    print(f"single walk:         {walk_time * 1000:8.1f} ms CPU, {walk_chars:9d} chars")
+    print(f"speedup {legacy_time / walk_time:.1f}x, output {legacy_chars / walk_chars:.1f}x smaller")
+
+
+if __name__ == '__main__':
+    main()
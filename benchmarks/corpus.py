@@ -0,0 +1,139 @@
+"""
+Synthetic newsletter corpus
+Seeded generator of realistic newsletter HTML for the cleaning benchmarks
+
+Documents mix the things that make real newsletters slow to clean: layout
+tables nested many levels deep, tracking pixels, large <style> blocks and
+inline styles, click-tracking links and non-English text.
+"""
+
+import math
+import random
+
+# Small vocabularies; enough to give each script realistic byte and token counts
+WORDS = {
+    'en': 'the market report shows that investors expect rates to fall while new startups raise funding for ai tools and cloud services this quarter'.split(),
+    'de': 'der markt bericht zeigt dass anleger sinkende zinsen erwarten während neue unternehmen kapital für werkzeuge und dienste sammeln'.split(),
+    'es': 'el informe del mercado muestra que los inversores esperan tasas más bajas mientras nuevas empresas reciben financiación'.split(),
+    'ru': 'отчёт рынка показывает что инвесторы ожидают снижения ставок пока новые компании привлекают финансирование'.split(),
+    'ar': 'يظهر تقرير السوق أن المستثمرين يتوقعون انخفاض الأسعار بينما تجمع الشركات الناشئة التمويل'.split(),
+    'hi': 'बाजार रिपोर्ट दिखाती है कि निवेशक दरों में गिरावट की उम्मीद करते हैं जबकि नई कंपनियां धन जुटाती हैं'.split(),
+    'zh': list('市场报告显示投资者预计利率下降而新的创业公司为人工智能工具和云服务筹集资金'),
+    'ja': list('市場レポートによると投資家は金利の低下を予想しており新しい企業が資金を調達しています'),
+}
+
+# Scripts written without spaces between words
+NO_SPACES = {'zh', 'ja'}
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_MAX_SIZE = 1024 * 1024
+
+
+def _sentence(rng, language, words=14):
+    vocab = WORDS[language]
+    joiner = '' if language in NO_SPACES else ' '
+    text = joiner.join(rng.choice(vocab) for _ in range(words))
+    return text[0].upper() + text[1:] + ('。' if language in NO_SPACES else '.')
+
+
+def _tracked(rng, url):
+    """Wraps a URL the way an email service provider's click tracker does."""
+    return f"https://click.mailer.example/ls/click?upn={rng.getrandbits(64):x}&u={url}%3Futm_source%3Dnewsletter"
+
+
+def _style_block(rng, rules):
+    parts = []
+    for i in range(rules):
+        parts.append(
+            f".c{i}-{rng.getrandbits(16):x} {{ color: #{rng.getrandbits(24):06x}; "
+            f"padding: {rng.randint(0, 24)}px {rng.randint(0, 24)}px; font-family: Helvetica, Arial, sans-serif; "
+            f"line-height: 1.{rng.randint(2, 8)}; }}"
+        )
+        if i % 25 == 0:
+            parts.append(f"@media only screen and (max-width: 600px) {{ .c{i} {{ width: 100% !important; }} }}")
+    return '<style type="text/css">' + '\n'.join(parts) + '</style>'
+
+
+def _nest(content, depth):
+    """Wraps content in `depth` layers of email layout tables."""
+    open_tags = (
+        '<table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0" '
+        'style="max-width:600px;margin:0 auto;"><tr><td align="left" style="padding:0 12px;">'
+    ) * depth
+    close_tags = '</td></tr></table>' * depth
+    return open_tags + content + close_tags
+
+
+def _section(rng, language, depth, index):
+    paragraphs = ''.join(
+        f'<p style="margin:0 0 12px;font-size:16px;color:#333;">{_sentence(rng, language)} '
+        f'{_sentence(rng, language)} <a href="{_tracked(rng, f"https://news.example/story/{index}-{p}")}" '
+        f'style="color:#0a66c2;">{_sentence(rng, language, 3)}</a></p>'
+        for p in range(rng.randint(2, 5))
+    )
+    pixel = (
+        f'<img src="https://track.mailer.example/open/{rng.getrandbits(64):x}.gif" '
+        'width="1" height="1" alt="" style="display:block;border:0;">'
+    )
+    heading = f'<h2 style="font-size:22px;margin:24px 0 8px;">{_sentence(rng, language, 5)}</h2>'
+    return _nest(heading + paragraphs + pixel, depth)
+
+
+def generate_newsletter(rng, size, language='en', depth=6):
+    """
+    Builds one newsletter of roughly `size` bytes of UTF-8 HTML.
+    
+    About a fifth of the bytes are CSS, as in template-heavy real issues.
+    """
+    head = _style_block(rng, max(1, size // 5 // 180))
+    header = _nest(
+        f'<a href="https://mailer.example/view/{rng.getrandbits(32):x}">View this email in your browser</a>'
+        '<img src="https://cdn.mailer.example/logo.png" width="200" alt="Logo">',
+        depth
+    )
+    footer = _nest(
+        '<p>Follow us: <a href="https://twitter.com/example">Twitter</a> '
+        '<a href="https://www.linkedin.com/company/example">LinkedIn</a></p>'
+        '<p>You are receiving this email because you subscribed. '
+        '<a href="https://mailer.example/unsubscribe?u=1">Unsubscribe</a> | '
+        '<a href="https://mailer.example/preferences?u=1">Update preferences</a></p>',
+        depth
+    )
+    
+    sections = []
+    used = len(head) + len(header) + len(footer)
+    index = 0
+    while used < size or not sections:
+        section = _section(rng, language, depth, index)
+        sections.append(section)
+        used += len(section.encode('utf-8'))
+        index += 1
+    
+    return (
+        f'<!DOCTYPE html><html><head><meta charset="utf-8">{head}</head>'
+        f'<body style="margin:0;background:#f4f4f4;">{header}{"".join(sections)}{footer}</body></html>'
+    )
+
+
+def generate_corpus(count, seed=0, min_size=DEFAULT_MIN_SIZE, max_size=DEFAULT_MAX_SIZE):
+    """
+    Generates `count` newsletters with sizes spread log-uniformly between
+    min_size and max_size bytes. The same seed always gives the same corpus.
+    
+    Returns:
+        List of newsletter dicts with subject, sender, language and body
+    """
+    rng = random.Random(seed)
+    languages = list(WORDS)
+    corpus = []
+    for i in range(count):
+        size = int(math.exp(rng.uniform(math.log(min_size), math.log(max_size))))
+        language = rng.choice(languages) if rng.random() < 0.4 else 'en'
+        depth = rng.randint(2, 12)
+        corpus.append({
+            'subject': f'Issue {i}',
+            'sender': f'news{i % 7}@mailer.example',
+            'language': language,
+            'body': generate_newsletter(rng, size, language, depth),
+        })
+    return corpus
@@ -0,0 +1,179 @@
+"""
+Local stand-in for the Ollama HTTP API
+Answers /api/generate after an injected delay, so summarization can be
+benchmarked without a model or network
+"""
+
+import re
+import json
+import time
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = (
+    "- Investors expect rates to fall this quarter.\n"
+    "- Startups raised new funding for AI tools.\n"
+    "- Cloud services keep growing.\n"
+)
+
+# Item headers of a packed prompt
+ITEM_ID = re.compile(r'^=== ITEM (\d+)', re.MULTILINE)
+
+# What chatty models tend to add after the bullets they were asked for
+EPILOGUE = (
+    "\nThese takeaways capture the main points of the newsletter. Let me know "
+    "if you would like a longer summary or more detail on any of them."
+)
+
+
+class FakeOllama:
+    """
+    Threaded HTTP server on a free local port.
+    
+    The first request, or warm-up, also waits `load_time` seconds while the
+    "model" loads. Replies take `latency` seconds before the first token,
+    then `token_latency` per whitespace-separated token, and are streamed
+    as NDJSON when the request asks for it. With `stream_error` set, a
+    streamed reply ends in an error line, as Ollama's does when generation
+    fails part way. JSON-format requests get one entry per packed item in
+    the prompt. Records requests, new connections, warm-ups (requests
+    without a prompt) and the most requests in flight at once, to check
+    pooling and concurrency limits.
+    """
+    
+    def __init__(self, latency=0.5, token_latency=0.0, load_time=0.0, reply=REPLY + EPILOGUE,
+                 stream_error=None):
+        self.load_time = load_time
+        self.loaded = False
+        self.latency = latency
+        self.token_latency = token_latency
+        self.reply = reply
+        self.stream_error = stream_error
+        self.requests = 0
+        self.connections = 0
+        self.warm_ups = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+    
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+    
+    def __enter__(self):
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def reset(self, unload=False):
+        with self._lock:
+            if unload:
+                self.loaded = False
+            self.requests = 0
+            self.connections = 0
+            self.warm_ups = 0
+            self.max_in_flight = 0
+    
+    def reply_to(self, request):
+        """Reply text for a generate request."""
+        if request.get('format') != 'json':
+            return self.reply
+        bullets = [line[2:] for line in REPLY.splitlines()]
+        return json.dumps({item_id: bullets for item_id in ITEM_ID.findall(request.get('prompt', ''))})
+    
+    def tokens(self, reply):
+        """The reply split into tokens that keep their whitespace."""
+        tokens = []
+        for word in reply.split(' '):
+            tokens.append(word if not tokens else ' ' + word)
+        return tokens
+    
+    def _handler(self):
+        fake = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def setup(self):
+                super().setup()
+                # As real servers do; otherwise Nagle's algorithm delays
+                # small writes on kept-alive connections
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with fake._lock:
+                    fake.connections += 1
+            
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                request = json.loads(body or b'{}')
+                
+                with fake._lock:
+                    load = not fake.loaded
+                    fake.loaded = True
+                if load:
+                    time.sleep(fake.load_time)
+                
+                if 'prompt' not in request:
+                    with fake._lock:
+                        fake.warm_ups += 1
+                    self._send_json({'response': '', 'done': True, 'done_reason': 'load'})
+                    return
+                
+                with fake._lock:
+                    fake.requests += 1
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                try:
+                    time.sleep(fake.latency)
+                    reply = fake.reply_to(request)
+                    if request.get('stream', True):
+                        self._stream(reply)
+                    else:
+                        time.sleep(fake.token_latency * len(fake.tokens(reply)))
+                        self._send_json({'response': reply, 'done': True})
+                finally:
+                    with fake._lock:
+                        fake.in_flight -= 1
+            
+            def _send_json(self, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def _stream(self, reply):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                
+                lines = [{'response': token, 'done': False} for token in fake.tokens(reply)]
+                if fake.stream_error:
+                    lines.append({'error': fake.stream_error})
+                else:
+                    lines.append({'response': '', 'done': True})
+                try:
+                    for line in lines:
+                        time.sleep(fake.token_latency)
+                        data = json.dumps(line).encode('utf-8') + b'\n'
+                        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading, as a real client stopping
+                    # early would; Ollama then stops generating
+                    self.close_connection = True
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
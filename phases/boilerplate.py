@@ -0,0 +1,273 @@
+"""
+Boilerplate learning
+Per-sender template fingerprints for stripping recurring blocks
+"""
+
+import os
+import re
+import json
+import base64
+import struct
+import hashlib
+import logging
+import tempfile
+from email.utils import parseaddr
+from phases.dedupe import simhash, hamming, get_max_distance
+
+logger = logging.getLogger(__name__)
+
+DIGITS = re.compile(r'\d+')
+
+# Serialized template: issue count and fingerprint count, then the entries,
+# then the count and SimHash signatures of recent issues
+_HEADER = struct.Struct('<II')
+_COUNT = struct.Struct('<I')
+
+
+def sender_key(value):
+    """Normalizes a From header or sender name to a template key."""
+    if not value:
+        return None
+    address = parseaddr(value)[1]
+    return (address or value).strip().lower() or None
+
+
+def fingerprint(block):
+    """
+    64-bit fingerprint of a text block.
+    
+    Case, whitespace and numbers are normalized first, so a footer that
+    carries the issue number or date still matches across issues.
+    """
+    normalized = DIGITS.sub('0', ' '.join(block.lower().split()))
+    digest = hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class SenderTemplate:
+    """
+    How often each block fingerprint has appeared in a sender's issues.
+    
+    Counts are halved once the history grows past `window` issues, so
+    blocks a sender stops using age out and the model stays small. The
+    SimHash signatures of the last `window` issues are kept so an issue
+    cleaned again (a retry or a resend) is not counted twice.
+    """
+    
+    def __init__(self, issues=0, counts=None, window=30, max_fingerprints=2000, recent=None):
+        self.issues = issues
+        self.counts = counts or {}
+        self.window = window
+        self.max_fingerprints = max_fingerprints
+        self.recent = list(recent or [])
+    
+    def frequency(self, fp):
+        """Fraction of past issues containing the fingerprint."""
+        if not self.issues:
+            return 0.0
+        return self.counts.get(fp, 0) / self.issues
+    
+    def seen(self, signature, max_distance):
+        """True if a recent issue is within `max_distance` bits of the signature."""
+        return any(hamming(signature, other) <= max_distance for other in self.recent)
+    
+    def observe(self, fingerprints, signature=None):
+        """Records one issue's block fingerprints."""
+        if signature is not None:
+            self.recent = (self.recent + [signature])[-self.window:]
+        
+        self.issues += 1
+        for fp in set(fingerprints):
+            self.counts[fp] = self.counts.get(fp, 0) + 1
+        
+        if self.issues > self.window:
+            self.issues //= 2
+            self.counts = {fp: count // 2 for fp, count in self.counts.items() if count > 1}
+        
+        if len(self.counts) > self.max_fingerprints:
+            # Keep the most frequent blocks; rare ones are content, not template
+            ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+            self.counts = dict(ranked[:self.max_fingerprints])
+    
+    def to_bytes(self):
+        """Packs the template into 12 bytes per fingerprint and 8 per recent issue."""
+        fps = list(self.counts)
+        return (
+            _HEADER.pack(self.issues, len(fps))
+            + struct.pack(f'<{len(fps)}Q', *fps)
+            + struct.pack(f'<{len(fps)}I', *(self.counts[fp] for fp in fps))
+            + _COUNT.pack(len(self.recent))
+            + struct.pack(f'<{len(self.recent)}Q', *self.recent)
+        )
+    
+    @classmethod
+    def from_bytes(cls, data, **kwargs):
+        """Inverse of to_bytes(); also reads templates saved without signatures."""
+        issues, size = _HEADER.unpack_from(data)
+        fps = struct.unpack_from(f'<{size}Q', data, _HEADER.size)
+        offset = _HEADER.size + 8 * size
+        counts = struct.unpack_from(f'<{size}I', data, offset)
+        offset += 4 * size
+        
+        recent = []
+        if len(data) > offset:
+            (length,) = _COUNT.unpack_from(data, offset)
+            recent = struct.unpack_from(f'<{length}Q', data, offset + _COUNT.size)
+        return cls(issues, dict(zip(fps, counts)), recent=recent, **kwargs)
+
+
+class MemoryTemplateStore:
+    """Templates held in this process (tests and one-off runs)."""
+    
+    def __init__(self):
+        self._data = {}
+    
+    def load(self, sender):
+        return self._data.get(sender)
+    
+    def save(self, sender, data):
+        self._data[sender] = data
+
+
+class FileTemplateStore:
+    """Templates kept in a JSON file next to the CLI's token file."""
+    
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+    
+    def load(self, sender):
+        encoded = self._read().get(sender)
+        return base64.b64decode(encoded) if encoded else None
+    
+    def save(self, sender, data):
+        templates = self._read()
+        templates[sender] = base64.b64encode(data).decode('ascii')
+        
+        # Write a temp file and rename it so a crash never leaves half a file
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(templates, f)
+        os.replace(tmp_path, self.path)
+    
+    def _read(self):
+        if self._data is None:
+            try:
+                with open(self.path) as f:
+                    self._data = json.load(f)
+            except FileNotFoundError:
+                self._data = {}
+            except ValueError as e:
+                logger.warning(f"Ignoring unreadable boilerplate file {self.path}: {e}")
+                self._data = {}
+        return self._data
+
+
+class BoilerplateFilter:
+    """
+    Strips blocks that appeared in most of a sender's previous issues.
+    
+    Nothing is stripped until a sender has `min_issues` issues on record.
+    Each cleaned issue is then added to the sender's template, unless it
+    is the same as or a near-duplicate of one of the sender's recent issues.
+    """
+    
+    def __init__(self, store, token_counter, threshold=None, min_issues=None):
+        """
+        Args:
+            store: Object with load(sender) and save(sender, data) for
+                serialized templates
+            token_counter: TokenCounter used to report savings
+            threshold: Fraction of past issues a block must appear in
+            min_issues: Issues needed before anything is stripped
+        """
+        self.store = store
+        self.token_counter = token_counter
+        self.threshold = threshold or float(os.getenv('BOILERPLATE_THRESHOLD', '0.6'))
+        self.min_issues = min_issues or int(os.getenv('BOILERPLATE_MIN_ISSUES', '3'))
+        self.max_distance = get_max_distance()
+        self._templates = {}
+    
+    def template(self, sender):
+        """Returns the sender's template, loading it on first use."""
+        template = self._templates.get(sender)
+        if template is None:
+            data = self.store.load(sender)
+            template = SenderTemplate.from_bytes(data) if data else SenderTemplate()
+            self._templates[sender] = template
+        return template
+    
+    def snapshot(self, sender):
+        """Fingerprints currently treated as template text for a sender."""
+        template = self.template(sender)
+        if template.issues < self.min_issues:
+            return frozenset()
+        return frozenset(fp for fp in template.counts if template.frequency(fp) >= self.threshold)
+    
+    def matcher(self, sender):
+        """Returns a predicate telling whether a block is template text."""
+        fingerprints = self.snapshot(sender)
+        if not fingerprints:
+            return lambda block: False
+        return lambda block: fingerprint(block) in fingerprints
+    
+    def strip(self, sender, blocks):
+        """
+        Removes template blocks and learns from this issue.
+        
+        Returns:
+            (kept blocks, indices of the removed blocks, tokens saved)
+        """
+        is_boilerplate = self.matcher(sender)
+        removed = {i for i, block in enumerate(blocks) if is_boilerplate(block)}
+        kept = [block for i, block in enumerate(blocks) if i not in removed]
+        
+        self.learn(sender, blocks)
+        return kept, removed, self.savings(blocks, kept)
+    
+    def learn(self, sender, blocks):
+        """Adds one issue's blocks to the sender's template and saves it."""
+        self.observe(sender, [fingerprint(block) for block in blocks], simhash('\n'.join(blocks)))
+    
+    def observe(self, sender, fingerprints, signature=None):
+        """
+        Adds one issue's block fingerprints to the sender's template and
+        saves it. Skipped if `signature` matches a recent issue, so cleaning
+        the same issue again does not make its own blocks look like template.
+        """
+        template = self.template(sender)
+        if signature is not None and template.seen(signature, self.max_distance):
+            logger.debug(f"Not learning from a repeated issue from {sender}")
+            return
+        template.observe(fingerprints, signature)
+        try:
+            self.store.save(sender, template.to_bytes())
+        except Exception as e:
+            logger.warning(f"Could not save boilerplate template for {sender}: {e}")
+    
+    def savings(self, blocks, kept):
+        """Tokens saved by sending `kept` instead of `blocks`."""
+        if len(kept) == len(blocks):
+            return 0
+        return self.token_counter.count_blocks(blocks) - self.token_counter.count_blocks(kept)
+
+
+class SnapshotBoilerplate(BoilerplateFilter):
+    """
+    Fixed view of one sender's template, for cleaning in a worker process.
+    
+    Nothing is saved: each issue's fingerprints are collected in `observed`
+    and handed back to the owning BoilerplateFilter.
+    """
+    
+    def __init__(self, fingerprints, token_counter):
+        super().__init__(MemoryTemplateStore(), token_counter, threshold=1.0, min_issues=1)
+        self.fingerprints = fingerprints
+        self.observed = []
+    
+    def snapshot(self, sender):
+        return self.fingerprints
+    
+    def observe(self, sender, fingerprints, signature=None):
+        self.observed.append((list(fingerprints), signature))
@@ -0,0 +1,240 @@
+"""
+Content-addressed caches
+A bounded in-process LRU tier in front of an optional shared Redis or disk tier
+"""
+
+import os
+import time
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    In-process tier, evicting least recently used entries by total size.
+    Entries older than `ttl` seconds, if given, are treated as missing.
+    """
+    
+    def __init__(self, max_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                self.size -= len(value)
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._entries[key] = (value, expires_at)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class RedisCache:
+    """
+    Shared tier in Redis. Entries expire after `ttl` seconds; size-aware
+    eviction is left to the server's maxmemory policy (e.g. allkeys-lru).
+    """
+    
+    def __init__(self, url, prefix, ttl=None):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+    
+    def get(self, key):
+        try:
+            return self.client.get(self.prefix + key)
+        except Exception as e:
+            # A cache outage only costs us the work it would have saved
+            logger.warning(f"Cache read failed: {e}")
+            return None
+    
+    def set(self, key, value):
+        try:
+            self.client.set(self.prefix + key, value, ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Cache write failed: {e}")
+
+
+class DiskCache:
+    """
+    Shared tier on a local or network disk, one file per entry.
+    
+    Reads touch the file, so when the directory grows past max_bytes the
+    least recently used files are deleted first.
+    """
+    
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)
+            return value
+        except OSError:
+            return None
+    
+    def set(self, key, value):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Cache write failed: {e}")
+            return
+        
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._files())
+            else:
+                self._size += len(value)
+            if self._size > self.max_bytes:
+                self._evict()
+    
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+    
+    def _files(self):
+        """(mtime, path, size) for every cached file."""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, path, stat.st_size))
+        return files
+    
+    def _evict(self):
+        """Deletes least recently used files until 90% of max_bytes is free."""
+        files = sorted(self._files())
+        self._size = sum(size for _, _, size in files)
+        target = self.max_bytes * 0.9
+        for _, path, size in files:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                continue
+
+
+class TieredCache:
+    """
+    Looks keys up tier by tier, copying hits into the faster tiers.
+    
+    Counts hits per tier and misses, so the hit rate can be logged.
+    """
+    
+    def __init__(self, tiers):
+        self.tiers = tiers
+        self.hits = [0] * len(tiers)
+        self.misses = 0
+    
+    def get(self, key):
+        for i, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                self.hits[i] += 1
+                for faster in self.tiers[:i]:
+                    faster.set(key, value)
+                return value
+        self.misses += 1
+        return None
+    
+    def set(self, key, value):
+        for tier in self.tiers:
+            tier.set(key, value)
+    
+    def stats(self):
+        """Hit and miss counts since the cache was created."""
+        hits = sum(self.hits)
+        lookups = hits + self.misses
+        return {
+            'hits': hits,
+            'misses': self.misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'tier_hits': {type(tier).__name__: count for tier, count in zip(self.tiers, self.hits)},
+        }
+
+
+def create_cache(prefix, default_dir, backends=None, default_backend='none'):
+    """
+    Builds a TieredCache from `<prefix>_*` settings:
+        
+        <prefix>_MEMORY_MB  in-process LRU size (0 disables it)
+        <prefix>_BACKEND    shared tier: none, redis, disk or one of `backends`
+        <prefix>_TTL        entry lifetime in seconds (memory and Redis tiers)
+        <prefix>_DIR        disk tier directory
+        <prefix>_DISK_MB    disk tier size
+    
+    Args:
+        backends: Extra shared tiers, mapping a backend name to a factory
+            called with the TTL
+        default_backend: Backend used when <prefix>_BACKEND is not set
+    
+    Returns:
+        TieredCache, or None if every tier is disabled
+    """
+    tiers = []
+    ttl = int(os.getenv(f'{prefix}_TTL', '604800'))
+    
+    memory_mb = float(os.getenv(f'{prefix}_MEMORY_MB', '32'))
+    if memory_mb > 0:
+        tiers.append(LRUCache(int(memory_mb * 1024 * 1024), ttl=ttl))
+    
+    backend = os.getenv(f'{prefix}_BACKEND', default_backend).lower()
+    if backends and backend in backends:
+        tiers.append(backends[backend](ttl))
+    elif backend == 'redis':
+        tiers.append(RedisCache(
+            os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+            prefix=f'{prefix.lower()}:',
+            ttl=ttl
+        ))
+    elif backend == 'disk':
+        tiers.append(DiskCache(
+            os.getenv(f'{prefix}_DIR', default_dir),
+            int(float(os.getenv(f'{prefix}_DISK_MB', '512')) * 1024 * 1024)
+        ))
+    elif backend != 'none':
+        raise ValueError(f"Unknown cache backend: {backend}")
+    
+    return TieredCache(tiers) if tiers else None
@@ -0,0 +1,99 @@
+"""
+Near-duplicate detection
+SimHash signatures with banded LSH lookup, so resends reuse a summary
+"""
+
+import os
+import re
+import hashlib
+
+WORDS = re.compile(r'\w+')
+
+SIGNATURE_BITS = 64
+
+# 4 bands of 16 bits: two signatures within 3 bits of each other always
+# share at least one band exactly (pigeonhole), so lookups cannot miss them
+BANDS = 4
+BAND_BITS = SIGNATURE_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+SHINGLE_SIZE = 3
+
+
+def simhash(text):
+    """
+    64-bit SimHash of text over overlapping 3-word shingles.
+    
+    Returns:
+        Signature as an unsigned int, or None if the text has no words
+    """
+    words = WORDS.findall(text.lower())
+    if not words:
+        return None
+    
+    size = min(SHINGLE_SIZE, len(words))
+    weights = {}
+    for i in range(len(words) - size + 1):
+        shingle = ' '.join(words[i:i + size])
+        weights[shingle] = weights.get(shingle, 0) + 1
+    
+    totals = [0] * SIGNATURE_BITS
+    for shingle, weight in weights.items():
+        h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+        for bit in range(SIGNATURE_BITS):
+            if h >> bit & 1:
+                totals[bit] += weight
+            else:
+                totals[bit] -= weight
+    
+    signature = 0
+    for bit, total in enumerate(totals):
+        if total > 0:
+            signature |= 1 << bit
+    return signature
+
+
+def hamming(a, b):
+    """Number of differing bits between two signatures."""
+    return bin(a ^ b).count('1')
+
+
+def bands(signature):
+    """The (band index, band value) LSH bucket keys of a signature."""
+    return [(band, signature >> (band * BAND_BITS) & BAND_MASK) for band in range(BANDS)]
+
+
+def get_max_distance():
+    """Largest Hamming distance treated as a near-duplicate (below BANDS)."""
+    return min(int(os.getenv('NEAR_DUPLICATE_DISTANCE', '3')), BANDS - 1)
+
+
+class NearDuplicateIndex:
+    """
+    In-memory near-duplicate index keyed by sender and LSH bucket.
+    
+    Used by the command line pipeline within a run; the web app keeps the
+    same buckets in the database.
+    """
+    
+    def __init__(self, max_distance=None):
+        self.max_distance = get_max_distance() if max_distance is None else max_distance
+        self._buckets = {}
+    
+    def find(self, sender, signature):
+        """
+        Returns the key of the closest indexed item within max_distance,
+        or None.
+        """
+        best = None
+        best_distance = self.max_distance + 1
+        for band in bands(signature):
+            for candidate, key in self._buckets.get((sender, band), ()):
+                distance = hamming(signature, candidate)
+                if distance < best_distance:
+                    best, best_distance = key, distance
+        return best
+    
+    def add(self, sender, signature, key):
+        for band in bands(signature):
+            self._buckets.setdefault((sender, band), []).append((signature, key))
@@ -0,0 +1,508 @@
+"""
+Shared Gmail API helpers
+Used by both the single-user and multi-user access layers
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import codecs
+import logging
+import threading
+from email.utils import parseaddr
+
+import httplib2
+import google_auth_httplib2
+from googleapiclient import discovery
+from googleapiclient.discovery_cache import get_static_doc
+from phases.gmail_quota import get_quota_governor, governed_request_builder, is_rate_limited
+
+logger = logging.getLogger(__name__)
+
+# Gmail rejects batch requests with more than 100 calls
+GMAIL_BATCH_LIMIT = 100
+
+# messages.batchModify accepts at most 1000 IDs per call
+GMAIL_MODIFY_LIMIT = 1000
+
+# Headers requested for metadata-only triage fetches
+TRIAGE_HEADERS = ['Subject', 'From', 'List-Id', 'Message-ID']
+
+
+# Parsed Gmail discovery document, loaded once per process
+_discovery_document = None
+_discovery_lock = threading.Lock()
+
+# One keep-alive HTTP transport per thread, shared by every user
+_transport = threading.local()
+
+
+def _get_discovery_document():
+    """Loads the discovery document bundled with google-api-python-client."""
+    global _discovery_document
+    if _discovery_document is None:
+        with _discovery_lock:
+            if _discovery_document is None:
+                doc = get_static_doc('gmail', 'v1')
+                if doc is None:
+                    raise RuntimeError("Bundled Gmail discovery document not found")
+                _discovery_document = json.loads(doc)
+    return _discovery_document
+
+
+def _get_transport():
+    """Returns this thread's pooled httplib2 transport."""
+    http = getattr(_transport, 'http', None)
+    if http is None:
+        http = httplib2.Http(timeout=int(os.getenv('GMAIL_HTTP_TIMEOUT', '60')))
+        _transport.http = http
+    return http
+
+
+def build_gmail_service(credentials, quota_user='me'):
+    """
+    Builds a Gmail service object without any network setup.
+    
+    The discovery document is parsed once per process and the underlying
+    connections are reused across users; only the credentials attached to
+    each request differ. Every request goes through the quota governor.
+    
+    Args:
+        credentials: google.auth credentials for the user
+        quota_user: Key of the user's quota bucket
+    """
+    http = google_auth_httplib2.AuthorizedHttp(credentials, http=_get_transport())
+    return discovery.build_from_document(
+        _get_discovery_document(),
+        http=http,
+        requestBuilder=governed_request_builder(quota_user)
+    )
+
+
+def get_batch_size():
+    """Returns the configured batch size, clamped to the Gmail limit."""
+    batch_size = int(os.getenv('GMAIL_BATCH_SIZE', '50'))
+    return max(1, min(batch_size, GMAIL_BATCH_LIMIT))
+
+
+def resolve_label_id(service, label_name):
+    """Looks up a label ID by name with a single labels().list call."""
+    results = service.users().labels().list(userId='me').execute()
+    for label in results.get('labels', []):
+        if label['name'] == label_name:
+            return label['id']
+    return None
+
+
+def ensure_label_id(service, label_name):
+    """Returns the ID of a user label, creating the label if it is missing."""
+    label_id = resolve_label_id(service, label_name)
+    if label_id:
+        return label_id
+    
+    label = service.users().labels().create(
+        userId='me',
+        body={
+            'name': label_name,
+            'labelListVisibility': 'labelShow',
+            'messageListVisibility': 'show'
+        }
+    ).execute()
+    logger.info(f"Created Gmail label '{label_name}'")
+    return label['id']
+
+
+def get_processed_label():
+    """Returns the label added to processed messages, or None if disabled."""
+    return os.getenv('GMAIL_PROCESSED_LABEL') or None
+
+
+def is_label_not_found(error):
+    """True if an HttpError means the label ID no longer exists."""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status == 404:
+        return True
+    return status == 400 and 'label' in str(error).lower()
+
+
+def is_message_not_found(error):
+    """True if an error means the message no longer exists."""
+    return getattr(getattr(error, 'resp', None), 'status', None) == 404
+
+
+def get_label_cache_ttl():
+    """Returns how long a resolved label ID is trusted, in seconds."""
+    return int(os.getenv('GMAIL_LABEL_CACHE_TTL', '86400'))
+
+
+class LabelIdCache:
+    """In-process label name to ID cache with a TTL."""
+    
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else get_label_cache_ttl()
+        self._entries = {}
+    
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+    
+    def set(self, key, label_id):
+        self._entries[key] = (label_id, time.monotonic())
+    
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+
+def chunked(items, size):
+    """Yields successive slices of at most `size` items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def batch_get_messages(service, msg_ids, batch_size=None, quota_user='me', errors=None, **get_kwargs):
+    """
+    Fetches messages through the Gmail HTTP batch endpoint.
+    
+    Each batch is a single HTTP round trip, paid for up front from the
+    user's quota bucket. A failure on one message is logged and skipped
+    without affecting the rest of its batch; rate-limited items are retried
+    with backoff.
+    
+    Args:
+        service: Gmail API service object
+        msg_ids: List of Gmail message IDs
+        batch_size: Calls per batch request (max 100)
+        quota_user: Key of the user's quota bucket
+        errors: Optional dict that receives the exception for each message
+            that could not be fetched, keyed by message ID
+        **get_kwargs: Extra arguments for messages().get, e.g. format
+    
+    Yields:
+        Lists of message resources, one list per batch, in request order
+    """
+    batch_size = max(1, min(batch_size or get_batch_size(), GMAIL_BATCH_LIMIT))
+    get_kwargs.setdefault('format', 'full')
+    governor = get_quota_governor()
+    
+    for chunk in chunked(list(dict.fromkeys(msg_ids)), batch_size):
+        responses = {}
+        pending = chunk
+        attempt = 0
+        
+        while pending:
+            rate_limited = []
+            
+            def _callback(request_id, response, exception):
+                if exception is None:
+                    responses[request_id] = response
+                elif is_rate_limited(exception):
+                    rate_limited.append(request_id)
+                else:
+                    logger.error(f"Error fetching message {request_id}: {exception}")
+                    if errors is not None:
+                        errors[request_id] = exception
+            
+            batch = service.new_batch_http_request(callback=_callback)
+            for msg_id in pending:
+                batch.add(
+                    service.users().messages().get(userId='me', id=msg_id, **get_kwargs),
+                    request_id=msg_id
+                )
+            
+            governor.acquire(quota_user, 'gmail.users.messages.get', count=len(pending))
+            try:
+                batch.execute()
+            except Exception as e:
+                if not is_rate_limited(e):
+                    logger.error(f"Batch request for {len(pending)} messages failed: {e}")
+                    if errors is not None:
+                        errors.update((msg_id, e) for msg_id in pending)
+                    break
+                rate_limited = pending
+            
+            pending = rate_limited
+            if pending:
+                if attempt >= governor.max_retries:
+                    logger.error(f"Giving up on {len(pending)} rate-limited messages")
+                    if errors is not None:
+                        errors.update((msg_id, RuntimeError("Rate limited")) for msg_id in pending)
+                    break
+                governor.backoff(attempt)
+                attempt += 1
+        
+        yield [responses[msg_id] for msg_id in chunk if msg_id in responses]
+
+
+def batch_modify_messages(service, msg_ids, add_label_ids=None, remove_label_ids=('UNREAD',)):
+    """
+    Applies the same label change to many messages.
+    
+    Sends one messages().batchModify call per 1000 IDs.
+    
+    Args:
+        service: Gmail API service object
+        msg_ids: List of Gmail message IDs
+        add_label_ids: Label IDs to add
+        remove_label_ids: Label IDs to remove (UNREAD by default)
+    
+    Returns:
+        Number of messages modified
+    """
+    body = {}
+    if add_label_ids:
+        body['addLabelIds'] = list(add_label_ids)
+    if remove_label_ids:
+        body['removeLabelIds'] = list(remove_label_ids)
+    
+    modified = 0
+    for chunk in chunked(list(dict.fromkeys(msg_ids)), GMAIL_MODIFY_LIMIT):
+        service.users().messages().batchModify(
+            userId='me',
+            body=dict(body, ids=chunk)
+        ).execute()
+        modified += len(chunk)
+    
+    return modified
+
+
+class TriageRules:
+    """Per-user rules for deciding which messages are worth a full download."""
+    
+    def __init__(self, sender_allowlist=None, max_size=None):
+        """
+        Args:
+            sender_allowlist: Addresses, domains or list IDs to accept
+            max_size: Largest accepted sizeEstimate in bytes
+        """
+        self.sender_allowlist = [
+            entry.strip().lower() for entry in (sender_allowlist or []) if entry.strip()
+        ]
+        self.max_size = max_size or None
+    
+    @classmethod
+    def from_settings(cls, allowlist_text, max_kb=None):
+        """Builds rules from a comma or newline separated allowlist."""
+        return cls(
+            re.split(r'[,\s]+', allowlist_text or ''),
+            max_size=max_kb * 1024 if max_kb else None
+        )
+    
+    @property
+    def active(self):
+        """True if any rule needs message metadata to be checked."""
+        return bool(self.sender_allowlist or self.max_size)
+    
+    def accepts(self, message):
+        """Checks a metadata-format message against the rules."""
+        if self.max_size and message.get('sizeEstimate', 0) > self.max_size:
+            return False
+        
+        if not self.sender_allowlist:
+            return True
+        
+        headers = {
+            header['name'].lower(): header['value']
+            for header in message.get('payload', {}).get('headers', [])
+        }
+        address = parseaddr(headers.get('from', ''))[1].lower()
+        list_id = headers.get('list-id', '').lower()
+        
+        return any(self._matches(entry, address, list_id) for entry in self.sender_allowlist)
+    
+    @staticmethod
+    def _matches(entry, address, list_id):
+        """Matches an allowlist entry against a sender address or List-Id."""
+        if '@' in entry and not entry.startswith('@'):
+            return address == entry
+        domain = entry.lstrip('@')
+        return (
+            address.endswith('@' + domain)
+            or address.endswith('.' + domain)
+            or (bool(list_id) and domain in list_id)
+        )
+
+
+def triage_messages(service, msg_ids, rules, batch_size=None, quota_user='me', errors=None):
+    """
+    Filters message IDs using metadata-only fetches.
+    
+    Only Subject, From, List-Id, Message-ID and the size estimate are
+    downloaded, so rejected messages never cost a full fetch.
+    
+    Args:
+        service: Gmail API service object
+        msg_ids: List of Gmail message IDs
+        rules: TriageRules to apply
+        batch_size: Calls per batch request
+        quota_user: Key of the user's quota bucket
+        errors: Optional dict for fetch errors, as in batch_get_messages;
+            those messages are neither accepted nor rejected
+    
+    Returns:
+        IDs of accepted messages, in their original order
+    """
+    if not rules.active or not msg_ids:
+        return list(msg_ids)
+    
+    accepted = []
+    for batch in batch_get_messages(
+        service, msg_ids, batch_size=batch_size, quota_user=quota_user, errors=errors,
+        format='metadata', metadataHeaders=TRIAGE_HEADERS
+    ):
+        for message in batch:
+            if rules.accepts(message):
+                accepted.append(message['id'])
+    
+    logger.info(f"Triage kept {len(accepted)} of {len(msg_ids)} messages")
+    return accepted
+
+
+class BodyExtractor:
+    """
+    Single-pass extractor for the readable body of a Gmail message.
+    
+    Walks the MIME tree once and keeps only the best alternative (HTML, or
+    plain text when there is no HTML). Attachments and inline images are
+    skipped, and each part is capped at a byte budget before it is decoded.
+    """
+    
+    def __init__(self, max_part_bytes=None, stats_hook=None):
+        """
+        Args:
+            max_part_bytes: Decoded bytes kept per part (MAX_BODY_PART_BYTES)
+            stats_hook: Optional callable receiving a stats dict per message
+        """
+        self.max_part_bytes = max_part_bytes or int(os.getenv('MAX_BODY_PART_BYTES', str(512 * 1024)))
+        self.stats_hook = stats_hook
+    
+    def extract(self, payload):
+        """Returns the decoded body text of a message payload."""
+        stats = {'bytes_decoded': 0, 'bytes_skipped': 0, 'parts_skipped': 0}
+        text = self._decode(self._select_parts(payload, stats), stats)
+        
+        if self.stats_hook:
+            self.stats_hook(stats)
+        
+        return text
+    
+    def _select_parts(self, payload, stats):
+        """Walks the MIME tree once and returns the parts worth decoding."""
+        html_parts = []
+        plain_parts = []
+        
+        stack = [payload]
+        while stack:
+            part = stack.pop()
+            if part.get('parts'):
+                stack.extend(reversed(part['parts']))
+                continue
+            
+            body = part.get('body', {})
+            mime_type = part.get('mimeType', '')
+            if self._is_attachment(part) or mime_type not in ('text/html', 'text/plain'):
+                stats['bytes_skipped'] += body.get('size', 0)
+                stats['parts_skipped'] += 1
+                continue
+            
+            if body.get('data'):
+                (html_parts if mime_type == 'text/html' else plain_parts).append(part)
+        
+        chosen, dropped = (html_parts, plain_parts) if html_parts else (plain_parts, [])
+        for part in dropped:
+            stats['bytes_skipped'] += self._decoded_size(part['body']['data'])
+            stats['parts_skipped'] += 1
+        
+        return chosen
+    
+    def _decode(self, parts, stats):
+        """
+        Decodes parts into one preallocated buffer, within the budget. Each
+        part's bytes are then read with the charset of its own Content-Type.
+        """
+        if not parts:
+            return ''
+        
+        sizes = [min(self._decoded_size(part['body']['data']), self.max_part_bytes) for part in parts]
+        buffer = bytearray(sum(sizes))
+        view = memoryview(buffer)
+        offset = 0
+        texts = []
+        
+        for part, size in zip(parts, sizes):
+            data = part['body']['data']
+            full_size = self._decoded_size(data)
+            
+            # Only decode the base64 characters covering the budget
+            chunk = data[:-(-size // 3) * 4] if size < full_size else data
+            decoded = base64.urlsafe_b64decode(chunk + '=' * (-len(chunk) % 4))[:size]
+            
+            start = offset
+            view[offset:offset + len(decoded)] = decoded
+            offset += len(decoded)
+            stats['bytes_skipped'] += full_size - len(decoded)
+            
+            # final=False drops a character cut in half by the budget
+            decoder = codecs.getincrementaldecoder(self._charset(part))(errors='replace')
+            texts.append(decoder.decode(view[start:offset], final=False))
+        
+        stats['bytes_decoded'] = offset
+        return ''.join(texts)
+    
+    @staticmethod
+    def _is_attachment(part):
+        """True for attachments and inline images."""
+        if part.get('filename'):
+            return True
+        if part.get('mimeType', '').startswith('image/'):
+            return True
+        for header in part.get('headers', []):
+            if header['name'].lower() == 'content-disposition':
+                return header['value'].lower().startswith('attachment')
+        return False
+    
+    @staticmethod
+    def _charset(part):
+        """Reads the charset from a part's Content-Type header."""
+        for header in part.get('headers', []):
+            if header['name'].lower() == 'content-type' and 'charset=' in header['value'].lower():
+                charset = header['value'].lower().split('charset=', 1)[1]
+                charset = charset.split(';', 1)[0].strip().strip('"\'')
+                try:
+                    ''.encode(charset)
+                    return charset
+                except LookupError:
+                    break
+        return 'utf-8'
+    
+    @staticmethod
+    def _decoded_size(data):
+        """Decoded byte length of a base64url string."""
+        return len(data.rstrip('=')) * 3 // 4
+
+
+class RateLimiter:
+    """Caps throughput at a fixed number of messages per second."""
+    
+    def __init__(self, rate):
+        """
+        Args:
+            rate: Maximum messages per second (0 or less disables the cap)
+        """
+        self.rate = rate
+        self._next_allowed = time.monotonic()
+    
+    def acquire(self, count=1):
+        """Blocks until `count` more messages fit under the rate cap."""
+        if self.rate <= 0 or count <= 0:
+            return
+        
+        now = time.monotonic()
+        if self._next_allowed > now:
+            time.sleep(self._next_allowed - now)
+            now = self._next_allowed
+        
+        self._next_allowed = now + count / self.rate
@@ -0,0 +1,258 @@
+"""
+Gmail API quota governor
+Token buckets priced in Gmail quota units, shared across workers
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+logger = logging.getLogger(__name__)
+
+# Quota units charged by Gmail per method
+METHOD_COSTS = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.history.list': 2,
+    'gmail.users.labels.list': 1,
+    'gmail.users.labels.get': 1,
+    'gmail.users.labels.create': 5,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.modify': 5,
+    'gmail.users.messages.batchModify': 50,
+    'gmail.users.messages.send': 100,
+}
+DEFAULT_COST = 5
+
+# Reasons Gmail uses for 403 responses that are really rate limits
+RATE_LIMIT_REASONS = ('ratelimitexceeded', 'userratelimitexceeded', 'quotaexceeded')
+
+# Atomically refills every bucket and takes `units` from all or none of them.
+# Returns the seconds to wait before retrying, as a string ("0" if granted).
+_RESERVE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local units = tonumber(ARGV[1])
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < units then
+        wait = math.max(wait, (units - tokens) / rate)
+    end
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    local tokens = levels[i]
+    if wait == 0 then
+        tokens = tokens - units
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 60)
+end
+return tostring(wait)
+"""
+
+
+class MemoryQuotaBackend:
+    """Token buckets held in this process (tests and single-process runs)."""
+    
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    def reserve(self, buckets, units):
+        """
+        Takes `units` from every bucket, or from none of them.
+        
+        Args:
+            buckets: List of (key, rate per second, capacity)
+            units: Quota units to take
+        
+        Returns:
+            Seconds to wait before retrying (0 if granted)
+        """
+        with self._lock:
+            now = time.monotonic()
+            levels = []
+            wait = 0
+            for key, rate, capacity in buckets:
+                tokens, ts = self._buckets.get(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - ts) * rate)
+                levels.append(tokens)
+                if tokens < units:
+                    wait = max(wait, (units - tokens) / rate)
+            
+            for (key, _, _), tokens in zip(buckets, levels):
+                self._buckets[key] = (tokens - units if wait == 0 else tokens, now)
+            
+            return wait
+
+
+class RedisQuotaBackend:
+    """Token buckets shared by every worker process through Redis."""
+    
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self._reserve = self.client.register_script(_RESERVE_SCRIPT)
+    
+    def reserve(self, buckets, units):
+        """Same contract as MemoryQuotaBackend.reserve."""
+        args = [units]
+        for _, rate, capacity in buckets:
+            args.extend([rate, capacity])
+        
+        try:
+            return float(self._reserve(keys=[key for key, _, _ in buckets], args=args))
+        except Exception as e:
+            # Fail open: Gmail still enforces its own limits and we back off on 429
+            logger.warning(f"Quota backend unavailable, not throttling: {e}")
+            return 0
+
+
+class QuotaGovernor:
+    """
+    Throttles Gmail calls with per-user and global token buckets.
+    
+    Calls that still hit a 429 or rate-limit 403 are retried with
+    exponential backoff and full jitter.
+    """
+    
+    def __init__(self, backend=None):
+        self.backend = backend or _create_backend()
+        self.user_rate = float(os.getenv('GMAIL_USER_QUOTA_PER_SEC', '250'))
+        self.global_rate = float(os.getenv('GMAIL_PROJECT_QUOTA_PER_SEC', '20000'))
+        self.max_retries = int(os.getenv('GMAIL_MAX_RETRIES', '5'))
+        self.backoff_base = float(os.getenv('GMAIL_BACKOFF_BASE', '1'))
+        self.backoff_cap = float(os.getenv('GMAIL_BACKOFF_CAP', '32'))
+    
+    @staticmethod
+    def cost(method_id, count=1):
+        """Quota units for `count` calls of a Gmail method."""
+        return METHOD_COSTS.get(method_id, DEFAULT_COST) * count
+    
+    def acquire(self, user_key, method_id, count=1):
+        """Blocks until both buckets can pay for `count` calls."""
+        buckets = [
+            (f"gmail-quota:user:{user_key}", self.user_rate, self.user_rate),
+            ("gmail-quota:global", self.global_rate, self.global_rate),
+        ]
+        capacity = min(self.user_rate, self.global_rate)
+        
+        # Large batches cost more than a bucket holds; pay in installments
+        remaining = self.cost(method_id, count)
+        while remaining > 0:
+            units = min(remaining, capacity)
+            wait = self.backend.reserve(buckets, units)
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            remaining -= units
+    
+    def backoff(self, attempt):
+        """Sleeps for an exponentially growing, fully jittered delay."""
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        logger.info(f"Gmail rate limited, retrying in {delay:.1f}s")
+        time.sleep(delay)
+    
+    def call(self, func, user_key, method_id):
+        """
+        Runs a single Gmail request under the governor.
+        
+        Args:
+            func: Zero-argument callable performing the request
+            user_key: Identifies the user's bucket
+            method_id: Gmail method, e.g. gmail.users.messages.get
+        """
+        attempt = 0
+        while True:
+            self.acquire(user_key, method_id)
+            try:
+                return func()
+            except HttpError as e:
+                if not is_rate_limited(e) or attempt >= self.max_retries:
+                    raise
+                self.backoff(attempt)
+                attempt += 1
+
+
+def is_rate_limited(error):
+    """True for 429s and 403s whose reason is a rate or quota limit."""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status == 429:
+        return True
+    if status == 403:
+        content = getattr(error, 'content', b'') or b''
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', errors='ignore')
+        text = content.lower() + str(error).lower().replace(' ', '').replace('-', '')
+        return any(reason in text for reason in RATE_LIMIT_REASONS)
+    return False
+
+
+class GovernedHttpRequest(HttpRequest):
+    """HttpRequest whose execute() goes through the quota governor."""
+    
+    def __init__(self, governor, user_key, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.governor = governor
+        self.user_key = user_key
+    
+    def execute(self, http=None, num_retries=0):
+        parent_execute = super().execute
+        return self.governor.call(
+            lambda: parent_execute(http=http, num_retries=num_retries),
+            self.user_key,
+            self.methodId
+        )
+
+
+def governed_request_builder(user_key, governor=None):
+    """Returns a requestBuilder for discovery.build_from_document."""
+    governor = governor or get_quota_governor()
+    
+    def build_request(*args, **kwargs):
+        return GovernedHttpRequest(governor, user_key, *args, **kwargs)
+    
+    return build_request
+
+
+def _create_backend():
+    """
+    Picks the bucket backend from GMAIL_QUOTA_BACKEND. Redis by default, so
+    all workers share one quota; memory is for tests and single-process runs.
+    """
+    backend = os.getenv('GMAIL_QUOTA_BACKEND', 'redis').lower()
+    if backend == 'memory':
+        return MemoryQuotaBackend()
+    if backend == 'redis':
+        try:
+            return RedisQuotaBackend(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        except ImportError:
+            # The CLI's requirements do not include redis
+            logger.warning("redis is not installed, tracking Gmail quota per process")
+            return MemoryQuotaBackend()
+    raise ValueError(f"Unknown quota backend: {backend}")
+
+
+_governor = None
+
+
+def get_quota_governor():
+    """Returns the process-wide QuotaGovernor."""
+    global _governor
+    if _governor is None:
+        _governor = QuotaGovernor()
+    return _governor
@@ -0,0 +1,223 @@
+"""
+Link processing
+Unwraps tracking redirects, canonicalizes, dedupes and ranks newsletter links
+"""
+
+import os
+import re
+import json
+import base64
+import binascii
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, unquote
+
+# Query parameters that only identify the campaign or the click
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', '_hsenc', '_hsmi',
+    'mkt_tok', 'ck_subscriber_id', 'vero_id', 'vero_conv', 'oly_enc_id', 'oly_anon_id',
+}
+
+# Parameters redirectors commonly carry the destination in, checked first
+REDIRECT_PARAMS = (
+    'url', 'u', 'q', 'target', 'dest', 'destination', 'redirect', 'redirect_url',
+    'redirect_uri', 'link', 'href', 'goto', 'to', 'r', 'l',
+)
+
+# "https://" and "http://" in base64, as embedded in many click-tracking paths
+BASE64_URL = re.compile(r'aHR0c(?:HM6Ly|DovL)[A-Za-z0-9_\-+]+={0,2}')
+
+# Percent-encoded URL embedded in a path segment
+ENCODED_URL = re.compile(r'https?%3A%2F%2F[^/?#&]+', re.IGNORECASE)
+
+# Anchor text of links that are about the email rather than its content
+UTILITY_TEXT = re.compile(
+    r'unsubscribe|opt[ -]?out|view (?:this )?(?:email |issue |it )?(?:in|on) (?:your |a |the )?(?:browser|web)'
+    r'|view online|web version|(?:manage|update|change) (?:your )?(?:preferences|subscription|profile|email)'
+    r'|email preferences|forward (?:this|to a friend)|privacy policy|terms of (?:service|use)',
+    re.IGNORECASE
+)
+UTILITY_PATH = re.compile(r'unsubscribe|optout|opt-out|preferences|manage-subscription', re.IGNORECASE)
+
+# Profile links to these are social footers; deeper paths (posts, videos) are kept
+SOCIAL_HOSTS = {
+    'twitter.com', 'x.com', 'facebook.com', 'instagram.com', 'linkedin.com',
+    'youtube.com', 'tiktok.com', 'threads.net', 'pinterest.com',
+}
+
+# Anchor texts that say nothing about the target
+GENERIC_TEXT = {'here', 'click here', 'link', 'read more', 'more', 'this', 'read', 'learn more'}
+
+# A block with at least this many words counts as content when ranking
+CONTENT_MIN_WORDS = 12
+
+LINK_TEXT_LIMIT = 100
+
+
+def unwrap(url, max_depth=3):
+    """
+    Recovers the destination of a click-tracking redirect without fetching it.
+    
+    Looks for the target URL in the query string (plain or percent-encoded),
+    or base64-encoded in the path or query, and repeats for nested wrappers.
+    URLs that carry no recoverable destination are returned unchanged.
+    """
+    for _ in range(max_depth):
+        target = _wrapped_target(url)
+        if not target:
+            break
+        url = target
+    return url
+
+
+def _wrapped_target(url):
+    """Returns the URL wrapped inside `url`, if one can be decoded."""
+    parts = urlsplit(url)
+    params = parse_qsl(parts.query)
+    
+    named = {key.lower(): value for key, value in params}
+    for key in REDIRECT_PARAMS:
+        if _is_http(named.get(key)):
+            return named[key]
+    for _, value in params:
+        if _is_http(value):
+            return value
+    
+    match = ENCODED_URL.search(parts.path)
+    if match:
+        return unquote(parts.path[match.start():])
+    
+    match = BASE64_URL.search(f"{parts.path}?{parts.query}")
+    if match:
+        token = match.group(0).replace('-', '+').replace('_', '/')
+        try:
+            decoded = base64.b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+        except (binascii.Error, UnicodeDecodeError):
+            return None
+        if _is_http(decoded) and not any(c.isspace() for c in decoded):
+            return decoded
+    
+    return None
+
+
+def _is_http(value):
+    return bool(value) and value.startswith(('http://', 'https://'))
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name.startswith('utm_') or name in TRACKING_PARAMS
+
+
+def canonicalize(url):
+    """
+    Lowercases the scheme and host, drops the fragment, default ports and
+    tracking parameters. The query is left as written if nothing was removed.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if parts.port and parts.port != {'http': 80, 'https': 443}.get(scheme):
+        netloc = f"{netloc}:{parts.port}"
+    
+    query = parts.query
+    params = parse_qsl(query, keep_blank_values=True)
+    kept = [(key, value) for key, value in params if not is_tracking_param(key)]
+    if len(kept) != len(params):
+        query = urlencode(kept)
+    
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def dedupe_key(url):
+    """Key under which two canonical URLs are the same page."""
+    parts = urlsplit(url)
+    host = parts.netloc
+    if host.startswith('www.'):
+        host = host[4:]
+    query = '&'.join(sorted(parts.query.split('&'))) if parts.query else ''
+    return f"{host}{parts.path.rstrip('/')}?{query}"
+
+
+def is_utility(text, url):
+    """True for unsubscribe, view-in-browser, preferences and social profile links."""
+    if UTILITY_TEXT.search(text):
+        return True
+    
+    parts = urlsplit(url)
+    if UTILITY_PATH.search(parts.path):
+        return True
+    
+    host = parts.netloc[4:] if parts.netloc.startswith('www.') else parts.netloc
+    return host in SOCIAL_HOSTS and len([p for p in parts.path.split('/') if p]) <= 1
+
+
+class LinkProcessor:
+    """
+    Turns the raw anchors found by the cleaner into a short, ranked list.
+    
+    Links are unwrapped and canonicalized, utility links are dropped,
+    duplicates are merged, and the rest are ordered by their distance (in
+    blocks) from the newsletter's content. Links in template blocks come last.
+    """
+    
+    def __init__(self, max_links=None):
+        self.max_links = max_links or int(os.getenv('MAX_LINKS', '10'))
+    
+    def process(self, links, blocks, template_indices=()):
+        """
+        Args:
+            links: Dicts with text, url and the index of the block they sit in
+            blocks: Every text block of the newsletter, in order
+            template_indices: Indices of blocks recognised as boilerplate
+        
+        Returns:
+            List of {'text', 'url'} dicts, best first
+        """
+        template_indices = set(template_indices)
+        content = [
+            i for i, block in enumerate(blocks)
+            if i not in template_indices and len(block.split()) >= CONTENT_MIN_WORDS
+        ]
+        
+        best = {}
+        for order, link in enumerate(links):
+            try:
+                url = canonicalize(unwrap(link['url']))
+            except ValueError:
+                # Malformed host or port, e.g. an unfilled "https://[UNSUBSCRIBE]"
+                continue
+            text = link['text']
+            if not _is_http(url) or is_utility(text, url):
+                continue
+            
+            block = link.get('block', 0)
+            rank = (block in template_indices, self._distance(block, content), order)
+            key = dedupe_key(url)
+            
+            current = best.get(key)
+            if current is None:
+                best[key] = [rank, text, url]
+                continue
+            
+            # Keep the best position, and the most descriptive anchor text
+            if rank < current[0]:
+                current[0] = rank
+            if current[1].lower() in GENERIC_TEXT and text.lower() not in GENERIC_TEXT:
+                current[1] = text
+        
+        ranked = sorted(best.values(), key=lambda item: item[0])[:self.max_links]
+        return [
+            {'text': text[:LINK_TEXT_LIMIT], 'url': url}
+            for _, text, url in ranked
+        ]
+    
+    @staticmethod
+    def _distance(block, content):
+        """Blocks between a link and the nearest content block."""
+        if not content:
+            return 0
+        return min(abs(block - index) for index in content)
+
+
+def encode_links(links):
+    """Packs processed links as a compact JSON array of [url, text] pairs."""
+    return json.dumps([[link['url'], link['text']] for link in links], separators=(',', ':'))
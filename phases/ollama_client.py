@@ -0,0 +1,193 @@
+"""
+Ollama HTTP client
+Pooled keep-alive sessions (sync and async), streamed generation with an
+early stop, and model warm-up
+"""
+
+import os
+import re
+import json
+import asyncio
+import logging
+import weakref
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Start of a bullet line as _parse_bullets understands it
+BULLET = re.compile(r'(?:[-•*]\s|\d+\.)')
+
+
+def bullets_complete(text, count):
+    """True once text holds `count` finished bullet lines."""
+    # The last line may still be growing
+    lines = text.split('\n')[:-1]
+    return sum(1 for line in lines if BULLET.match(line.strip())) >= count
+
+
+def get_keep_alive():
+    """How long Ollama keeps the model loaded after a request (OLLAMA_KEEP_ALIVE)."""
+    return os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+
+
+class OllamaClient:
+    """
+    Calls Ollama's /api/generate through one pooled requests.Session, so
+    connections are reused across calls and threads. The async variant
+    (agenerate) pools its connections per event loop the same way.
+    """
+    
+    def __init__(self, base_url, model, pool_size=4, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.keep_alive = get_keep_alive()
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        # httpx clients are bound to the loop they run on; dropped with it
+        self._async_sessions = weakref.WeakKeyDictionary()
+    
+    def request_body(self, prompt, stream=False, json_output=False):
+        """Generate request body for /api/generate."""
+        body = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "temperature": 0.5
+        }
+        if json_output:
+            body["format"] = "json"
+        return body
+    
+    def generate(self, prompt, stream=False, stop_after_bullets=None, json_output=False):
+        """
+        Generates a reply to prompt.
+        
+        Args:
+            stream: Read the reply as NDJSON tokens as they are generated
+            stop_after_bullets: When streaming, close the connection once
+                this many bullet lines are complete; Ollama then stops
+                generating whatever the model would have added after them
+            json_output: Constrain the reply to valid JSON
+        """
+        response = self.session.post(
+            f"{self.base_url}/api/generate",
+            json=self.request_body(prompt, stream, json_output),
+            timeout=self.timeout,
+            stream=stream
+        )
+        
+        if response.status_code != 200:
+            raise Exception(
+                f"Ollama API returned {response.status_code}: {response.text}"
+            )
+        
+        if not stream:
+            return response.json().get('response', '')
+        
+        reader = StreamReader(stop_after_bullets)
+        with response:
+            for line in response.iter_lines():
+                if reader.feed(line):
+                    break
+        return reader.text
+    
+    def async_session(self):
+        """The httpx.AsyncClient for the running event loop, created on first use."""
+        loop = asyncio.get_running_loop()
+        session = self._async_sessions.get(loop)
+        if session is None:
+            import httpx
+            session = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            )
+            self._async_sessions[loop] = session
+        return session
+    
+    async def agenerate(self, prompt, stream=False, stop_after_bullets=None, json_output=False):
+        """Async generate(), through the running loop's pooled session."""
+        body = self.request_body(prompt, stream, json_output)
+        async with self.async_session().stream("POST", "/api/generate", json=body) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise Exception(
+                    f"Ollama API returned {response.status_code}: {response.text}"
+                )
+            
+            if not stream:
+                await response.aread()
+                return response.json().get('response', '')
+            
+            reader = StreamReader(stop_after_bullets)
+            async for line in response.aiter_lines():
+                if reader.feed(line):
+                    break
+            return reader.text
+    
+    def warm_up(self):
+        """
+        Loads the model without generating anything, so the first real
+        request does not wait for it.
+        """
+        response = self.session.post(
+            f"{self.base_url}/api/generate",
+            json={"model": self.model, "keep_alive": self.keep_alive},
+            timeout=max(self.timeout, 300)
+        )
+        if response.status_code != 200:
+            raise Exception(
+                f"Ollama API returned {response.status_code}: {response.text}"
+            )
+        logger.info(f"Loaded Ollama model {self.model} (keep_alive {self.keep_alive})")
+
+
+class StreamReader:
+    """
+    Joins the tokens of an Ollama NDJSON stream, for sync and async readers.
+    
+    Args:
+        stop_after_bullets: Report the reply finished once this many bullet
+            lines are complete
+    """
+    
+    def __init__(self, stop_after_bullets=None):
+        self.stop_after_bullets = stop_after_bullets
+        self.text = ''
+    
+    def feed(self, line):
+        """Adds one NDJSON line (bytes or str); returns True when finished."""
+        if not line:
+            return False
+        chunk = json.loads(line)
+        if 'error' in chunk:
+            raise Exception(f"Ollama API error: {chunk['error']}")
+        
+        token = chunk.get('response', '')
+        self.text += token
+        if chunk.get('done'):
+            return True
+        return bool(
+            self.stop_after_bullets
+            and '\n' in token
+            and bullets_complete(self.text, self.stop_after_bullets)
+        )
+
+
+_clients = {}
+
+
+def get_ollama_client(base_url, model, pool_size=4):
+    """Returns the process-wide client for a server and model."""
+    key = (base_url, model)
+    if key not in _clients:
+        _clients[key] = OllamaClient(base_url, model, pool_size=pool_size)
+    return _clients[key]
@@ -0,0 +1,131 @@
+"""
+Parallel cleaning
+Process pool that runs CleaningEngine over batches of newsletters
+"""
+
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from phases.boilerplate import SnapshotBoilerplate
+
+logger = logging.getLogger(__name__)
+
+# One engine per parser backend in each worker process
+_engines = {}
+
+
+def _get_engine(parser):
+    engine = _engines.get(parser)
+    if engine is None:
+        # Imported here: phase2_cleaning imports this module
+        from phases.phase2_cleaning import CleaningEngine
+        engine = CleaningEngine(parser=parser, boilerplate=False)
+        _engines[parser] = engine
+    return engine
+
+
+def clean_job(job):
+    """
+    Cleans one newsletter inside a worker process.
+    
+    Args:
+        job: (parser, UTF-8 body bytes, subject, sender or None, frozenset
+            of the sender's template fingerprints or None)
+    
+    Returns:
+        (clean_body, links, boilerplate tokens saved, observed (fingerprints,
+        signature) pairs)
+    """
+    parser, body, subject, sender, template = job
+    engine = _get_engine(parser)
+    
+    snapshot = None
+    if sender is not None:
+        snapshot = SnapshotBoilerplate(template or frozenset(), engine.token_counter)
+    engine.boilerplate = snapshot
+    
+    newsletter = {
+        'subject': subject,
+        'sender': sender,
+        'body': body.decode('utf-8', errors='replace'),
+    }
+    engine.clean_single(newsletter)
+    
+    return (
+        newsletter['clean_body'],
+        newsletter['links'],
+        newsletter.get('boilerplate_tokens_saved', 0),
+        snapshot.observed if snapshot else []
+    )
+
+
+def _mp_context():
+    """
+    Forkserver where the platform has it: forking a process that is already
+    running threads (a Celery worker's, say) can copy held locks.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class CleaningPool:
+    """
+    Process pool for cleaning, started on first use and kept for reuse.
+    
+    Daemonic processes, such as Celery prefork children, cannot start one,
+    so there the pool is unavailable from the start and callers clean
+    in-process. The backfill worker runs with the solo pool to use it (see
+    the Procfile). If worker processes fail to start for another reason,
+    the pool marks itself unavailable the same way.
+    """
+    
+    def __init__(self, workers=None):
+        self.workers = workers or int(os.getenv('CLEANING_WORKERS', '0')) or os.cpu_count() or 1
+        self.available = not multiprocessing.current_process().daemon
+        self._executor = None
+        self._lock = threading.Lock()
+    
+    def map(self, jobs, chunksize=None):
+        """
+        Runs clean_job over jobs in the pool, preserving order.
+        
+        Jobs are sent in chunks so each round trip carries several
+        newsletters; by default every worker gets about four chunks.
+        """
+        if chunksize is None:
+            chunksize = max(1, len(jobs) // (self.workers * 4))
+        
+        try:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=_mp_context()
+                    )
+                executor = self._executor
+            return list(executor.map(clean_job, jobs, chunksize=chunksize))
+        except (BrokenProcessPool, AssertionError, OSError) as e:
+            logger.warning(f"Cleaning pool unavailable, cleaning in-process: {e}")
+            self.available = False
+            self.shutdown()
+            raise
+    
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+
+
+def get_cleaning_pool():
+    """Returns the process-wide CleaningPool."""
+    global _pool
+    if _pool is None:
+        _pool = CleaningPool()
+    return _pool
@@ -9,13 +9,30 @@ import pickle
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+from phases.gmail_api import (
+    BodyExtractor,
+    LabelIdCache,
+    TriageRules,
+    batch_get_messages,
+    batch_modify_messages,
+    build_gmail_service,
+    ensure_label_id,
+    get_batch_size,
+    get_processed_label,
+    is_label_not_found,
+    resolve_label_id,
+    triage_messages,
+)
 
 logger = logging.getLogger(__name__)
 
 # Gmail API scopes
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 
+# Label name -> ID, shared by access layers in this process
+_label_id_cache = LabelIdCache()
+
 
 class GmailAccessLayer:
     """Handles OAuth 2.0 authentication and Gmail message fetching."""
@@ -24,6 +41,14 @@ class GmailAccessLayer:
         self.credentials_file = os.getenv('GMAIL_CREDENTIALS_FILE', 'credentials.json')
         self.token_file = os.getenv('GMAIL_TOKEN_FILE', 'token.pickle')
         self.newsletter_label = os.getenv('NEWSLETTER_LABEL', 'To-Summarize')
+        self.batch_size = get_batch_size()
+        self.max_results = int(os.getenv('GMAIL_MAX_RESULTS', '10'))
+        self.body_extractor = BodyExtractor()
+        max_kb = os.getenv('MAX_MESSAGE_KB')
+        self.triage_rules = TriageRules.from_settings(
+            os.getenv('NEWSLETTER_SENDER_ALLOWLIST'),
+            int(max_kb) if max_kb else None
+        )
         
         self.service = self._authenticate()
     
@@ -60,7 +85,7 @@ class GmailAccessLayer:
         
         logger.info("Gmail authentication successful")
         
-        return discovery.build('gmail', 'v1', credentials=creds)
+        return build_gmail_service(creds)
     
     def fetch_newsletters(self):
         """
@@ -69,14 +94,7 @@ class GmailAccessLayer:
         """
         try:
             # Get label ID for the newsletter label
-            results = self.service.users().labels().list(userId='me').execute()
-            labels = results.get('labels', [])
-            
-            label_id = None
-            for label in labels:
-                if label['name'] == self.newsletter_label:
-                    label_id = label['id']
-                    break
+            label_id = self._get_label_id()
             
             if not label_id:
                 logger.warning(
@@ -86,27 +104,35 @@ class GmailAccessLayer:
                 return []
             
             # Query for unread messages with the label
-            query = f'label:{self.newsletter_label} is:unread'
-            results = self.service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=10  # Adjust as needed
-            ).execute()
+            try:
+                results = self._list_unread(label_id)
+            except HttpError as e:
+                if not is_label_not_found(e):
+                    raise
+                # Label was recreated or renamed; resolve it again once
+                label_id = self._get_label_id(refresh=True)
+                if not label_id:
+                    logger.warning(f"Label '{self.newsletter_label}' no longer exists")
+                    return []
+                results = self._list_unread(label_id)
             
             messages = results.get('messages', [])
             logger.info(f"Found {len(messages)} unread newsletters")
             
-            # Fetch full message details
+            # Check metadata first so unwanted messages are never downloaded
+            msg_ids = triage_messages(
+                self.service,
+                [message['id'] for message in messages],
+                self.triage_rules,
+                batch_size=self.batch_size
+            )
+            
+            # Fetch full message details in batches
             newsletters = []
-            for message in messages:
-                full_message = self.service.users().messages().get(
-                    userId='me',
-                    id=message['id'],
-                    format='full'
-                ).execute()
-                
-                newsletter = self._parse_message(full_message)
-                newsletters.append(newsletter)
+            for batch in batch_get_messages(self.service, msg_ids, batch_size=self.batch_size):
+                for full_message in batch:
+                    newsletter = self._parse_message(full_message)
+                    newsletters.append(newsletter)
             
             return newsletters
         
@@ -114,6 +140,25 @@ class GmailAccessLayer:
             logger.error(f"Error fetching newsletters: {str(e)}")
             return []
     
+    def _get_label_id(self, refresh=False):
+        """Returns the label ID, from the cache unless `refresh` is set."""
+        label_id = None if refresh else _label_id_cache.get(self.newsletter_label)
+        if not label_id:
+            label_id = resolve_label_id(self.service, self.newsletter_label)
+            if label_id:
+                _label_id_cache.set(self.newsletter_label, label_id)
+            else:
+                _label_id_cache.invalidate(self.newsletter_label)
+        return label_id
+    
+    def _list_unread(self, label_id):
+        """Lists unread messages carrying the label."""
+        return self.service.users().messages().list(
+            userId='me',
+            labelIds=[label_id, 'UNREAD'],
+            maxResults=self.max_results
+        ).execute()
+    
     def _parse_message(self, message):
         """Extracts relevant data from a Gmail message."""
         headers = message['payload']['headers']
@@ -147,28 +192,7 @@ class GmailAccessLayer:
     def _get_message_body(self, message):
         """Extracts the body from a Gmail message (handles multipart)."""
         try:
-            if 'parts' in message['payload']:
-                # Multipart message
-                for part in message['payload']['parts']:
-                    if part['mimeType'] == 'text/html':
-                        if 'data' in part['body']:
-                            import base64
-                            return base64.urlsafe_b64decode(
-                                part['body']['data']
-                            ).decode('utf-8')
-                    elif part['mimeType'] == 'text/plain':
-                        if 'data' in part['body']:
-                            import base64
-                            return base64.urlsafe_b64decode(
-                                part['body']['data']
-                            ).decode('utf-8')
-            else:
-                # Simple message
-                if 'data' in message['payload']['body']:
-                    import base64
-                    return base64.urlsafe_b64decode(
-                        message['payload']['body']['data']
-                    ).decode('utf-8')
+            return self.body_extractor.extract(message['payload'])
         except Exception as e:
             logger.error(f"Error extracting message body: {str(e)}")
         
@@ -177,18 +201,22 @@ class GmailAccessLayer:
     def mark_as_processed(self, newsletters):
         """
         Marks newsletters as read after processing.
-        Optionally adds a 'Processed' label.
+        Optionally adds a 'Processed' label (GMAIL_PROCESSED_LABEL).
         """
         try:
-            for newsletter in newsletters:
-                # Remove UNREAD label
-                self.service.users().messages().modify(
-                    userId='me',
-                    id=newsletter['id'],
-                    body={'removeLabelIds': ['UNREAD']}
-                ).execute()
+            add_label_ids = None
+            processed_label = get_processed_label()
+            if processed_label:
+                add_label_ids = [ensure_label_id(self.service, processed_label)]
+            
+            # Remove UNREAD label in as few requests as possible
+            modified = batch_modify_messages(
+                self.service,
+                [newsletter['id'] for newsletter in newsletters],
+                add_label_ids=add_label_ids
+            )
             
-            logger.info(f"Marked {len(newsletters)} newsletters as read")
+            logger.info(f"Marked {modified} newsletters as read")
         
         except Exception as e:
             logger.error(f"Error marking newsletters as processed: {str(e)}")
@@ -3,43 +3,350 @@ Phase 2: The Cleaning Engine
 HTML sanitization and text extraction
 """
 
-import re
+import json
+import hashlib
 import logging
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup, NavigableString
+from bs4.element import PreformattedString
 import os
+from phases.tokenizer import get_token_counter
+from phases.boilerplate import BoilerplateFilter, FileTemplateStore, sender_key
+from phases.links import LinkProcessor
+from phases.parallel import get_cleaning_pool
+from phases.cache import create_cache
 
 logger = logging.getLogger(__name__)
 
+# Elements whose start and end separate text blocks
+BLOCK_TAGS = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'br', 'center', 'dd', 'div',
+    'dl', 'dt', 'figcaption', 'figure', 'footer', 'h1', 'h2', 'h3', 'h4', 'h5',
+    'h6', 'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section',
+    'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'ul',
+])
+
+# Elements whose content is never text
+SKIP_TAGS = frozenset(['script', 'style', 'noscript', 'title', 'template', 'svg'])
+
+# Marks the end of an element on the walk stack
+_CLOSE = object()
+
+# Bump when the parse-and-walk output changes, so cached results are not reused
+CLEANER_VERSION = 1
+
+# Characters fed per step when streaming a body that is already in memory
+STREAM_CHUNK_SIZE = 16 * 1024
+
+TRUNCATION_MARKER = "[TRUNCATED - Content was too long]"
+
+
+def _parse_with_lxml(body):
+    """Fast path: lxml's C parser."""
+    # lxml stops at NUL bytes and would silently drop the rest
+    if '\x00' in body:
+        raise ValueError("NUL byte in document")
+    
+    soup = BeautifulSoup(body, 'lxml')
+    if '<' in body and soup.find(True) is None:
+        raise ValueError("lxml produced an empty tree")
+    return soup
+
+
+def _parse_with_html_parser(body):
+    """Pure-Python parser; slow but tolerant of anything."""
+    return BeautifulSoup(body, 'html.parser')
+
+
+# Available parser backends, keyed by HTML_PARSER value
+PARSER_BACKENDS = {
+    'lxml': _parse_with_lxml,
+    'html.parser': _parse_with_html_parser,
+}
+
+# Used when the configured backend is unavailable or fails on a document
+FALLBACK_PARSER = 'html.parser'
+
+
+class _BudgetReached(Exception):
+    """Raised inside StreamingHTMLCleaner to stop parsing early."""
+
+
+class StreamingHTMLCleaner(HTMLParser):
+    """
+    Incremental (SAX-style) cleaner that emits text blocks as they close.
+    
+    Uses the same block and skip rules as the tree walk, but never builds a
+    tree: once the token budget is spent it stops consuming input, so the
+    rest of the document is neither parsed nor held in memory.
+    """
+    
+    def __init__(self, max_tokens, count_tokens, separator_tokens=0, skip_block=None):
+        """
+        Args:
+            max_tokens: Token budget for the emitted blocks
+            count_tokens: Callable returning the token count of a block
+            separator_tokens: Tokens added by the separator between blocks
+            skip_block: Optional predicate; matching blocks are left out of
+                `blocks` and do not use up the budget
+        """
+        super().__init__(convert_charrefs=True)
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self.separator_tokens = separator_tokens
+        self.skip_block = skip_block
+        self.blocks = []
+        self.flushed = []  # every block seen, including skipped ones
+        self.skipped_indices = set()
+        self.links = []
+        self.done = False
+        self.truncated = False
+        self._buffer = []
+        self._anchor = None
+        self._skip_depth = 0
+        self._tokens = 0
+    
+    def feed(self, data):
+        """Parses the next chunk; ignored once the budget is spent."""
+        if self.done:
+            return
+        try:
+            super().feed(data)
+        except _BudgetReached:
+            self.done = True
+    
+    def close(self):
+        """Flushes the final block."""
+        if not self.done:
+            try:
+                super().close()
+                self._flush()
+            except _BudgetReached:
+                self.done = True
+    
+    def handle_starttag(self, tag, attrs):
+        if self._skip_depth:
+            if tag in SKIP_TAGS:
+                self._skip_depth += 1
+            return
+        
+        if tag in SKIP_TAGS:
+            self._skip_depth = 1
+        elif tag in BLOCK_TAGS:
+            self._flush()
+        elif tag == 'a' and self._anchor is None:
+            href = dict(attrs).get('href')
+            if href:
+                self._anchor = [href, []]
+    
+    def handle_endtag(self, tag):
+        if self._skip_depth:
+            if tag in SKIP_TAGS:
+                self._skip_depth -= 1
+            return
+        
+        if tag == 'a' and self._anchor is not None:
+            url, parts = self._anchor
+            link_text = ' '.join(''.join(parts).split())
+            # Filter out tracking pixels and very short links
+            if url.startswith('http') and len(link_text) > 0:
+                self.links.append({
+                    'text': link_text,
+                    'url': url,
+                    'block': len(self.flushed)
+                })
+            self._anchor = None
+        elif tag in BLOCK_TAGS:
+            self._flush()
+    
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        self._buffer.append(data)
+        if self._anchor is not None:
+            self._anchor[1].append(data)
+    
+    def _flush(self):
+        """Closes the current block, stopping if it would exceed the budget."""
+        if not self._buffer:
+            return
+        
+        text = ' '.join(''.join(self._buffer).split())
+        self._buffer.clear()
+        if not text:
+            return
+        
+        if self.skip_block and self.skip_block(text):
+            self.skipped_indices.add(len(self.flushed))
+            self.flushed.append(text)
+            return
+        
+        tokens = self.count_tokens(text)
+        if self.blocks:
+            tokens += self.separator_tokens
+        if self._tokens + tokens > self.max_tokens:
+            self.truncated = True
+            raise _BudgetReached()
+        
+        self.blocks.append(text)
+        self.flushed.append(text)
+        self._tokens += tokens
+
+
+_clean_cache = None
+_clean_cache_ready = False
+
+
+def get_max_tokens():
+    """
+    Token budget for a cleaned newsletter (MAX_TOKENS).
+    
+    In chunked summary mode it is raised to what MAX_CHUNKS prompts of
+    MAX_PROMPT_TOKENS can hold, so map-reduce sees the whole issue rather
+    than the part that fits one prompt.
+    """
+    max_tokens = int(os.getenv('MAX_TOKENS', '2000'))
+    if os.getenv('SUMMARY_MODE', 'truncate').lower() == 'chunked':
+        # Each chunk also carries the map prompt, and chunks split on block
+        # boundaries are rarely full
+        chunk_tokens = int(int(os.getenv('MAX_PROMPT_TOKENS', '4000')) * 0.85)
+        max_tokens = max(max_tokens, int(os.getenv('MAX_CHUNKS', '8')) * chunk_tokens)
+    return max_tokens
+
+
+def get_clean_cache():
+    """Returns the process-wide cache of parsed blocks and links (or None)."""
+    global _clean_cache, _clean_cache_ready
+    if not _clean_cache_ready:
+        _clean_cache = create_cache('CLEAN_CACHE', os.path.join('.cache', 'cleaned'))
+        _clean_cache_ready = True
+    return _clean_cache
+
 
 class CleaningEngine:
     """Sanitizes newsletter HTML and extracts clean text and links."""
     
-    def __init__(self):
-        self.max_tokens = int(os.getenv('MAX_TOKENS', '2000'))
+    def __init__(self, parser=None, boilerplate=None, cache=None):
+        """
+        Args:
+            parser: HTML parser backend (defaults to HTML_PARSER)
+            boilerplate: BoilerplateFilter for per-sender template blocks;
+                defaults to one backed by BOILERPLATE_FILE
+            cache: Cache for parsed bodies, or False for none; defaults to
+                the shared CLEAN_CACHE tiers
+        """
+        self.max_tokens = get_max_tokens()
+        self.parser = self._select_parser(parser or os.getenv('HTML_PARSER', 'lxml'))
+        self.streaming = os.getenv('CLEANING_MODE', 'tree').lower() == 'streaming'
+        self.token_counter = get_token_counter()
+        self.link_processor = LinkProcessor()
+        self.parallel_min = int(os.getenv('CLEANING_PARALLEL_MIN', '16'))
+        
+        if boilerplate is None and os.getenv('BOILERPLATE_FILTER', 'true').lower() == 'true':
+            store = FileTemplateStore(os.getenv('BOILERPLATE_FILE', 'boilerplate.json'))
+            boilerplate = BoilerplateFilter(store, self.token_counter)
+        self.boilerplate = boilerplate
+        self.cache = get_clean_cache() if cache is None else cache
+    
+    def _select_parser(self, name):
+        """Validates the parser backend, falling back if lxml is missing."""
+        if name not in PARSER_BACKENDS:
+            raise ValueError(f"Unknown HTML parser: {name}")
+        
+        if name == 'lxml':
+            try:
+                import lxml  # noqa: F401
+            except ImportError:
+                logger.warning("lxml not installed, using html.parser. Run: pip install lxml")
+                return FALLBACK_PARSER
+        
+        return name
+    
+    def _parse(self, body):
+        """Parses HTML with the configured backend, retrying with the fallback."""
+        if self.parser != FALLBACK_PARSER:
+            try:
+                return PARSER_BACKENDS[self.parser](body)
+            except Exception as e:
+                logger.debug(f"{self.parser} failed ({e}), falling back to {FALLBACK_PARSER}")
+        
+        return PARSER_BACKENDS[FALLBACK_PARSER](body)
     
     def clean_all(self, newsletters):
-        """Cleans all newsletters and returns processed list."""
+        """
+        Cleans all newsletters and returns processed list.
+        
+        Batches of at least CLEANING_PARALLEL_MIN newsletters are cleaned in
+        the shared process pool; smaller ones are not worth the round trip.
+        """
+        pool = get_cleaning_pool()
+        if len(newsletters) >= self.parallel_min and pool.workers > 1 and pool.available:
+            try:
+                return self._clean_parallel(newsletters, pool)
+            except Exception as e:
+                logger.warning(f"Parallel cleaning failed ({e}), cleaning sequentially")
+        
         cleaned = []
         for newsletter in newsletters:
             cleaned_newsletter = self.clean_single(newsletter)
             cleaned.append(cleaned_newsletter)
         return cleaned
     
+    def _clean_parallel(self, newsletters, pool):
+        """
+        Cleans a batch in the process pool.
+        
+        Workers strip boilerplate with each sender's template as it stood at
+        the start of the batch; what they observed is learned here afterwards.
+        """
+        jobs = []
+        senders = []
+        for newsletter in newsletters:
+            sender = self._sender(newsletter)
+            senders.append(sender)
+            jobs.append((
+                self.parser,
+                newsletter.get('body', '').encode('utf-8'),
+                newsletter.get('subject', ''),
+                sender,
+                self.boilerplate.snapshot(sender) if sender else None
+            ))
+        
+        results = pool.map(jobs)
+        
+        for newsletter, sender, result in zip(newsletters, senders, results):
+            clean_body, links, saved, observed = result
+            newsletter['clean_body'] = clean_body
+            newsletter['links'] = links
+            newsletter['boilerplate_tokens_saved'] = saved
+            for fingerprints, signature in observed:
+                self.boilerplate.observe(sender, fingerprints, signature)
+        
+        return newsletters
+    
     def clean_single(self, newsletter):
         """
         Cleans a single newsletter:
-        1. Strips HTML tags (keeps text from <p> and <div>)
-        2. Preserves links
-        3. Truncates to token limit
+        1. Strips HTML tags (one text block per block element)
+        2. Drops the sender's recurring template blocks
+        3. Unwraps, dedupes and ranks links
+        4. Truncates to token limit
         """
+        if self.streaming:
+            body = newsletter.get('body', '')
+            chunks = (body[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(body), STREAM_CHUNK_SIZE))
+            return self.clean_stream(newsletter, chunks)
+        
         try:
             body = newsletter.get('body', '')
             
-            # Parse HTML
-            soup = BeautifulSoup(body, 'html.parser')
+            # Parse HTML and extract text and links (cached by body)
+            blocks, links = self._extract_blocks(body)
             
-            # Extract text and links
-            clean_text, links = self._extract_text_and_links(soup)
+            # Drop blocks the sender repeats in every issue
+            kept, template_indices = self._strip_boilerplate(newsletter, blocks)
+            links = self.link_processor.process(links, blocks, template_indices)
+            clean_text = '\n\n'.join(kept)
             
             # Truncate to token limit
             clean_text = self._truncate_text(clean_text)
@@ -61,48 +368,208 @@ class CleaningEngine:
             newsletter['links'] = []
             return newsletter
     
+    def clean_stream(self, newsletter, chunks):
+        """
+        Cleans a newsletter from body chunks, stopping at the token budget.
+        
+        Args:
+            newsletter: Newsletter dict to update
+            chunks: Iterable of body text chunks
+        """
+        try:
+            sender = self._sender(newsletter)
+            
+            # Leave room for the marker in case the budget runs out
+            cleaner = StreamingHTMLCleaner(
+                self.max_tokens - self._marker_tokens(),
+                self.token_counter.count_block,
+                self.token_counter.separator_cost('\n\n'),
+                skip_block=self.boilerplate.matcher(sender) if sender else None
+            )
+            for chunk in chunks:
+                cleaner.feed(chunk)
+                if cleaner.done:
+                    break
+            cleaner.close()
+            
+            # Only the part read before the budget ran out is learned
+            newsletter['boilerplate_tokens_saved'] = 0
+            if sender:
+                self.boilerplate.learn(sender, cleaner.flushed)
+                newsletter['boilerplate_tokens_saved'] = self.boilerplate.savings(
+                    cleaner.flushed, cleaner.blocks
+                )
+            
+            clean_text = '\n\n'.join(cleaner.blocks)
+            if cleaner.truncated:
+                clean_text += f"\n\n{TRUNCATION_MARKER}"
+            
+            newsletter['clean_body'] = clean_text
+            newsletter['links'] = self.link_processor.process(
+                cleaner.links, cleaner.flushed, cleaner.skipped_indices
+            )
+            
+            logger.debug(
+                f"Stream-cleaned newsletter: {newsletter.get('subject', '')[:50]}... "
+                f"({len(clean_text)} chars, stopped early: {cleaner.done})"
+            )
+            
+            return newsletter
+        
+        except Exception as e:
+            logger.error(f"Error cleaning newsletter: {str(e)}")
+            newsletter['clean_body'] = ""
+            newsletter['links'] = []
+            return newsletter
+        
+        finally:
+            # Stop a generator source (e.g. the Gmail decoder) from decoding further
+            if hasattr(chunks, 'close'):
+                chunks.close()
+    
+    def _extract_blocks(self, body):
+        """
+        Parses and walks a body, or returns the stored result for an
+        identical body. Only the sender-independent blocks and raw links are
+        cached; boilerplate, link ranking and truncation still run per user.
+        """
+        if not self.cache:
+            return self._walk(self._parse(body))
+        
+        key = self._cache_key(body)
+        cached = self.cache.get(key)
+        if cached is not None:
+            data = json.loads(cached)
+            return data['blocks'], data['links']
+        
+        blocks, links = self._walk(self._parse(body))
+        self.cache.set(key, json.dumps(
+            {'blocks': blocks, 'links': links},
+            ensure_ascii=False,
+            separators=(',', ':')
+        ).encode('utf-8'))
+        return blocks, links
+    
+    def _cache_key(self, body):
+        """Hash of the raw body, the parser and the cleaner version."""
+        digest = hashlib.sha256(f"{CLEANER_VERSION}:{self.parser}:".encode('utf-8'))
+        digest.update(body.encode('utf-8', errors='surrogatepass'))
+        return digest.hexdigest()
+    
+    def _sender(self, newsletter):
+        """Template key for a newsletter, or None if boilerplate is off."""
+        if not self.boilerplate:
+            return None
+        return sender_key(newsletter.get('sender') or newsletter.get('from'))
+    
+    def _strip_boilerplate(self, newsletter, blocks):
+        """
+        Removes template blocks and records the tokens saved.
+        
+        Returns:
+            (kept blocks, indices of the removed blocks)
+        """
+        newsletter['boilerplate_tokens_saved'] = 0
+        sender = self._sender(newsletter)
+        if not sender:
+            return blocks, set()
+        
+        kept, removed, saved = self.boilerplate.strip(sender, blocks)
+        newsletter['boilerplate_tokens_saved'] = saved
+        if saved:
+            logger.info(
+                f"Stripped {len(blocks) - len(kept)} boilerplate blocks "
+                f"({saved} tokens) from {sender}"
+            )
+        return kept, removed
+    
+    def _estimate_tokens(self, text):
+        """Token count of text, summed per paragraph so counts are memoized."""
+        return self.token_counter.count_blocks(text.split('\n\n'))
+    
+    def _marker_tokens(self):
+        """Tokens taken by the truncation marker and its separator."""
+        return self.token_counter.count(f"\n\n{TRUNCATION_MARKER}")
+    
     def _extract_text_and_links(self, soup):
-        """Extracts text from paragraphs/divs and collects links."""
-        text_parts = []
-        links = []
+        """Extracts text blocks and collects links in a single tree walk."""
+        blocks, links = self._walk(soup)
+        clean_text = '\n\n'.join(blocks)
+        return clean_text, links
+    
+    def _walk(self, soup):
+        """
+        Depth-first walk that emits every text node exactly once.
         
-        # Remove script and style tags
-        for script in soup(['script', 'style', 'noscript']):
-            script.decompose()
+        Text is gathered into the innermost open block and flushed whenever
+        a block element opens or closes, so nested layout tables and divs do
+        not repeat their children's text.
+        
+        Returns:
+            (list of text blocks, list of links)
+        """
+        blocks = []
+        links = []
+        buffer = []
+        anchor = None  # [url, text parts] while inside a link
         
-        # Extract text from paragraphs and divs
-        for tag in soup.find_all(['p', 'div', 'li', 'td', 'h1', 'h2', 'h3']):
-            text = tag.get_text(strip=True)
-            if text:
-                text_parts.append(text)
+        def flush():
+            if buffer:
+                text = ' '.join(''.join(buffer).split())
+                if text:
+                    blocks.append(text)
+                buffer.clear()
         
-        # Extract links
-        for link in soup.find_all('a', href=True):
-            url = link['href']
-            link_text = link.get_text(strip=True)
+        stack = [soup]
+        while stack:
+            node = stack.pop()
             
-            # Filter out tracking pixels and very short links
-            if url.startswith('http') and len(link_text) > 0:
-                links.append({
-                    'text': link_text,
-                    'url': url
-                })
+            if isinstance(node, tuple):
+                # Closing marker pushed when the tag was opened
+                tag = node[1]
+                if tag.name == 'a' and anchor is not None:
+                    url = anchor[0]
+                    link_text = ' '.join(''.join(anchor[1]).split())
+                    # Filter out tracking pixels and very short links
+                    if url.startswith('http') and len(link_text) > 0:
+                        links.append({
+                            'text': link_text,
+                            'url': url,
+                            'block': len(blocks)
+                        })
+                    anchor = None
+                elif tag.name in BLOCK_TAGS:
+                    flush()
+                continue
+            
+            if isinstance(node, NavigableString):
+                if not isinstance(node, PreformattedString):
+                    buffer.append(node)
+                    if anchor is not None:
+                        anchor[1].append(node)
+                continue
+            
+            if node.name in SKIP_TAGS:
+                continue
+            
+            if node.name in BLOCK_TAGS:
+                flush()
+            elif node.name == 'a' and anchor is None and node.get('href'):
+                anchor = [node['href'], []]
+            
+            stack.append((_CLOSE, node))
+            stack.extend(reversed(node.contents))
         
-        clean_text = '\n\n'.join(text_parts)
-        return clean_text, links
+        flush()
+        return blocks, links
     
     def _truncate_text(self, text):
         """
-        Truncates text based on token approximation.
-        Uses 4 characters ≈ 1 token rule.
+        Truncates text to the token budget on a paragraph or sentence
+        boundary, keeping room for the truncation marker.
         """
-        approx_tokens = len(text) / 4
-        
-        if approx_tokens > self.max_tokens:
-            # Truncate to approximately max_tokens
-            max_chars = self.max_tokens * 4
-            text = text[:max_chars]
-            text = text.rsplit('\n\n', 1)[0]  # Cut at paragraph boundary
-            text += "\n\n[TRUNCATED - Content was too long]"
+        if self._estimate_tokens(text) <= self.max_tokens:
+            return text
         
-        return text
+        text, _ = self.token_counter.truncate(text, self.max_tokens - self._marker_tokens())
+        return f"{text}\n\n{TRUNCATION_MARKER}"
@@ -4,23 +4,202 @@ AI-powered summarization using OpenAI or Ollama
 """
 
 import os
+import json
+import asyncio
+import hashlib
 import logging
+import contextlib
+import threading
+import collections
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from phases.tokenizer import get_token_counter
+from phases.dedupe import NearDuplicateIndex, simhash
+from phases.cache import create_cache
+from phases.ollama_client import get_ollama_client
 
 logger = logging.getLogger(__name__)
 
+# Summary stored when the provider call fails; never reused for duplicates
+ERROR_SUMMARY = ["Error during summarization"]
+
+# Bump whenever the prompt wording changes, so cached summaries are not reused
+PROMPT_VERSION = 1
+
+DEFAULT_STYLE = 'bullet-points'
+
+# Closing instructions of the prompt for each summary_style preference
+SUMMARY_STYLES = {
+    'bullet-points': """Please summarize the top 3 most important takeaways into concise bullet points (1-2 sentences each). 
+Maintain a neutral, informative tone.
+
+Provide only the bullet points, starting each with a dash (-).""",
+    'paragraph': """Please summarize the most important takeaways in one short paragraph (3-4 sentences).
+Maintain a neutral, informative tone.
+
+Provide only the paragraph.""",
+    'summary': """Please write an executive summary: one sentence with the main point, then the 2 most important details, each on its own line starting with a dash (-).
+Maintain a neutral, informative tone.""",
+}
+
+# Closing instructions of a packed prompt (several newsletters, JSON reply)
+PACKED_STYLES = {
+    'bullet-points': "For each newsletter, summarize the top 3 most important takeaways as 3 concise strings (1-2 sentences each).",
+    'paragraph': "For each newsletter, summarize the most important takeaways as one string holding a short paragraph (3-4 sentences).",
+    'summary': "For each newsletter, write an executive summary as 3 strings: the main point, then the 2 most important details.",
+}
+
+# Bullet lines that complete a reply in each style, so a streamed reply can
+# stop there; paragraphs have no such point
+STYLE_BULLETS = {'bullet-points': 3, 'summary': 2}
+
+SUMMARY_MODES = ('truncate', 'chunked')
+
+# Takeaways kept from each chunk in chunked mode
+MAP_BULLETS = 5
+
+# Requests in flight at once per process, by provider; a local Ollama
+# serves few requests in parallel, a hosted API many
+DEFAULT_CONCURRENCY = {'openai': 8, 'ollama': 2}
+
+# Shared by every IntelligenceLayer in the process, whichever event loop
+# (Celery task) it runs in
+_provider_limits = {}
+_provider_limits_lock = threading.Lock()
+
+_summary_cache = None
+_summary_cache_ready = False
+
+
+def get_summary_cache():
+    """Returns the process-wide cache of generated summaries (or None)."""
+    global _summary_cache, _summary_cache_ready
+    if not _summary_cache_ready:
+        _summary_cache = create_cache('SUMMARY_CACHE', os.path.join('.cache', 'summaries'))
+        _summary_cache_ready = True
+    return _summary_cache
+
+
+def get_provider_concurrency(provider):
+    """Requests allowed in flight to a provider (SUMMARY_CONCURRENCY_<PROVIDER>)."""
+    default = DEFAULT_CONCURRENCY.get(provider, 4)
+    return int(os.getenv(f'SUMMARY_CONCURRENCY_{provider.upper()}', str(default)))
+
+
+class ProviderLimit:
+    """
+    Async semaphore that holds across event loops and threads.
+    
+    Each Celery task runs its own asyncio.run, so an asyncio.Semaphore
+    (bound to one loop) would only limit a single task, not the process
+    when tasks overlap in it (a threads pool, or several threads calling
+    summarize_all_async). Waiters are woken on their own loop, in arrival order,
+    and a freed slot goes straight to the next waiter.
+    """
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self._active = 0
+        self._waiters = collections.deque()
+        self._lock = threading.Lock()
+    
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # The slot was handed over as we were cancelled; pass it on
+            self._release()
+            raise
+    
+    async def __aexit__(self, *exc_info):
+        self._release()
+    
+    def _release(self):
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(_wake, future)
+                    return
+                except RuntimeError:
+                    # That task's loop has closed
+                    continue
+            self._active -= 1
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _provider_limit(provider):
+    """Limit on this process's in-flight requests to a provider."""
+    with _provider_limits_lock:
+        if provider not in _provider_limits:
+            _provider_limits[provider] = ProviderLimit(get_provider_concurrency(provider))
+        return _provider_limits[provider]
+
 
 class IntelligenceLayer:
     """Handles AI summarization with support for OpenAI and Ollama."""
     
-    def __init__(self):
+    def __init__(self, summary_style=None, cache=None):
+        """
+        Args:
+            summary_style: Key of SUMMARY_STYLES; defaults to SUMMARY_STYLE
+            cache: Summary cache; defaults to the shared SUMMARY_CACHE_*
+                one, False disables caching
+        """
         self.provider = os.getenv('AI_PROVIDER', 'openai').lower()
+        self.max_prompt_tokens = int(os.getenv('MAX_PROMPT_TOKENS', '4000'))
+        self.token_counter = get_token_counter()
+        
+        self.summary_style = summary_style or os.getenv('SUMMARY_STYLE', DEFAULT_STYLE)
+        if self.summary_style not in SUMMARY_STYLES:
+            logger.warning(f"Unknown summary style {self.summary_style}, using {DEFAULT_STYLE}")
+            self.summary_style = DEFAULT_STYLE
+        
+        # chunked: content over the prompt budget is summarized in parts
+        # (up to MAX_CHUNKS) and the takeaways merged, instead of trimmed
+        self.mode = os.getenv('SUMMARY_MODE', 'truncate').lower()
+        if self.mode not in SUMMARY_MODES:
+            raise ValueError(f"Unknown summary mode: {self.mode}")
+        self.max_chunks = int(os.getenv('MAX_CHUNKS', '8'))
+        
+        # Packing: newsletters of up to PACK_ITEM_TOKENS share one request
+        # (up to PACK_MAX_ITEMS each) and get their summaries back as JSON
+        self.packing = os.getenv('SUMMARY_PACKING', 'false').lower() == 'true'
+        self.pack_item_tokens = int(os.getenv('PACK_ITEM_TOKENS', '600'))
+        self.pack_max_items = int(os.getenv('PACK_MAX_ITEMS', '8'))
+        
+        self.cache = get_summary_cache() if cache is None else cache
+        self.user_concurrency = int(os.getenv('SUMMARY_USER_CONCURRENCY', '4'))
         
         if self.provider == 'openai':
             self.client = self._init_openai()
+            self.model = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
         elif self.provider == 'ollama':
             self.ollama_url = os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
             self.ollama_model = os.getenv('OLLAMA_MODEL', 'llama3')
+            self.model = self.ollama_model
+            self.ollama_stream = os.getenv('OLLAMA_STREAM', 'true').lower() == 'true'
+            self.ollama = get_ollama_client(
+                self.ollama_url,
+                self.ollama_model,
+                pool_size=get_provider_concurrency('ollama')
+            )
         else:
             raise ValueError(f"Unknown AI provider: {self.provider}")
     
@@ -37,47 +216,475 @@ class IntelligenceLayer:
             raise
     
     def summarize_all(self, newsletters):
-        """Summarizes all newsletters."""
-        summarized = []
-        for newsletter in newsletters:
-            summarized_newsletter = self.summarize_single(newsletter)
-            summarized.append(summarized_newsletter)
-        return summarized
+        """
+        Summarizes all newsletters.
+        
+        A newsletter that is a near-duplicate of an earlier one from the
+        same sender (a resend or "in case you missed it" copy) reuses that
+        summary instead of calling the provider again. With packing on,
+        short newsletters are summarized several to a request.
+        """
+        originals, duplicates = self._find_duplicates(newsletters)
+        
+        packs, singles = self._pack(self._prepare_all(originals))
+        for pack in packs:
+            singles.extend(self._summarize_pack(pack))
+        for newsletter, content, key in singles:
+            self._summarize_prepared(newsletter, content, key)
+        
+        self._copy_duplicates(newsletters, duplicates)
+        self._log_cache_stats()
+        return newsletters
+    
+    async def summarize_all_async(self, newsletters, timeout=None):
+        """
+        Summarizes all newsletters concurrently, in input order.
+        
+        At most SUMMARY_USER_CONCURRENCY requests from this call (one
+        user's batch) and SUMMARY_CONCURRENCY_<PROVIDER> from the whole
+        process are in flight at once. Near-duplicates and packing work as
+        in summarize_all().
+        
+        Args:
+            newsletters: Newsletter dicts with sender and clean_body
+            timeout: Seconds to wait before cancelling outstanding requests;
+                their newsletters get ERROR_SUMMARY
+        """
+        originals, duplicates = self._find_duplicates(newsletters)
+        packs, singles = self._pack(self._prepare_all(originals))
+        
+        user_limit = asyncio.Semaphore(self.user_concurrency)
+        async with self._async_client() as client:
+            tasks = [
+                asyncio.ensure_future(self._summarize_pack_async(pack, client, user_limit))
+                for pack in packs
+            ] + [
+                asyncio.ensure_future(self._summarize_prepared_async(newsletter, content, key, client, user_limit))
+                for newsletter, content, key in singles
+            ]
+            try:
+                if tasks:
+                    await asyncio.wait(tasks, timeout=timeout)
+            finally:
+                # Also reached when the caller itself is cancelled
+                pending = [task for task in tasks if not task.done()]
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        
+        if pending:
+            logger.warning(f"Cancelled {len(pending)} summaries still running after {timeout}s")
+            for newsletter in originals:
+                newsletter.setdefault('summary', list(ERROR_SUMMARY))
+        
+        self._copy_duplicates(newsletters, duplicates)
+        self._log_cache_stats()
+        return newsletters
     
     def summarize_single(self, newsletter):
         """
         Generates a 3-bullet summary for a single newsletter.
         """
         try:
-            content = newsletter.get('clean_body', '')
+            content, key = self._prepare(newsletter)
+            if content is not None:
+                self._summarize_prepared(newsletter, content, key)
+            return newsletter
+        
+        except Exception as e:
+            logger.error(f"Error summarizing newsletter: {str(e)}")
+            newsletter['summary'] = list(ERROR_SUMMARY)
+            return newsletter
+    
+    def _find_duplicates(self, newsletters):
+        """
+        Splits newsletters into originals and near-duplicates of an earlier
+        one from the same sender, recording its position in 'duplicate_of'.
+        
+        Returns:
+            (originals, duplicates); originals have any old summary cleared
+        """
+        index = NearDuplicateIndex()
+        originals = []
+        duplicates = []
+        for position, newsletter in enumerate(newsletters):
             sender = newsletter.get('sender', 'Unknown')
+            signature = simhash(newsletter.get('clean_body', ''))
             
-            if not content or len(content.strip()) < 50:
-                logger.warning(f"Newsletter from {sender} is too short to summarize")
-                newsletter['summary'] = ["No content to summarize"]
-                return newsletter
-            
-            # Create the summarization prompt
-            prompt = self._create_prompt(content, sender)
-            
-            # Get summary from AI provider
-            if self.provider == 'openai':
-                summary = self._summarize_with_openai(prompt)
-            elif self.provider == 'ollama':
-                summary = self._summarize_with_ollama(prompt)
-            
-            # Parse bullet points
-            bullets = self._parse_bullets(summary)
+            original = index.find(sender, signature) if signature is not None else None
+            if original is not None:
+                newsletter['duplicate_of'] = original
+                duplicates.append(newsletter)
+            else:
+                newsletter.pop('summary', None)
+                originals.append(newsletter)
+                if signature is not None:
+                    index.add(sender, signature, position)
+        return originals, duplicates
+    
+    def _copy_duplicates(self, newsletters, duplicates):
+        for newsletter in duplicates:
+            newsletter['summary'] = newsletters[newsletter['duplicate_of']]['summary']
+            logger.info(f"Reusing summary for near-duplicate newsletter from {newsletter.get('sender', 'Unknown')}")
+    
+    def _prepare_all(self, newsletters):
+        """_prepare() for each newsletter; returns the (newsletter, content, key) still to summarize."""
+        prepared = []
+        for newsletter in newsletters:
+            try:
+                content, key = self._prepare(newsletter)
+            except Exception as e:
+                logger.error(f"Error summarizing newsletter: {str(e)}")
+                newsletter['summary'] = list(ERROR_SUMMARY)
+                continue
+            if content is not None:
+                prepared.append((newsletter, content, key))
+        return prepared
+    
+    def _summarize_prepared(self, newsletter, content, key):
+        """Summarizes prepared content in one call, or by map-reduce when it is long."""
+        try:
+            sender = newsletter.get('sender', 'Unknown')
+            chunks = self._split_content(content, sender)
+            if len(chunks) > 1:
+                summary = self._map_reduce(chunks, sender)
+            else:
+                summary = self._complete(self._create_prompt(content, sender), final=True)
             
-            newsletter['summary'] = bullets
-            logger.info(f"Summarized newsletter from {sender}")
+            self._store_summary(newsletter, key, summary)
+        
+        except Exception as e:
+            logger.error(f"Error summarizing newsletter: {str(e)}")
+            newsletter['summary'] = list(ERROR_SUMMARY)
+    
+    async def _summarize_prepared_async(self, newsletter, content, key, client, user_limit):
+        """_summarize_prepared() for the async path, within both concurrency limits."""
+        try:
+            sender = newsletter.get('sender', 'Unknown')
+            chunks = self._split_content(content, sender)
+            if len(chunks) > 1:
+                summary = await self._map_reduce_async(chunks, sender, client, user_limit)
+            else:
+                summary = await self._complete_async(
+                    client, self._create_prompt(content, sender), user_limit, final=True
+                )
             
-            return newsletter
+            self._store_summary(newsletter, key, summary)
         
         except Exception as e:
             logger.error(f"Error summarizing newsletter: {str(e)}")
-            newsletter['summary'] = ["Error during summarization"]
-            return newsletter
+            newsletter['summary'] = list(ERROR_SUMMARY)
+    
+    def _pack(self, prepared):
+        """
+        Bin-packs short newsletters into shared prompts of at most
+        MAX_PROMPT_TOKENS, largest first, each into the first pack with room.
+        
+        Returns:
+            (packs of two or more prepared items, items to summarize alone)
+        """
+        if not self.packing:
+            return [], list(prepared)
+        
+        separator_tokens = self.token_counter.separator_cost('\n\n')
+        # A little room for joins the item counts do not account for
+        capacity = int((self.max_prompt_tokens - self.token_counter.count(self._create_packed_prompt([]))) * 0.98)
+        
+        packable = []
+        singles = []
+        for item in prepared:
+            newsletter, content, _ = item
+            sender = newsletter.get('sender', 'Unknown')
+            cost = self.token_counter.count(self._packed_item(self.pack_max_items, sender, content)) + separator_tokens
+            if cost <= self.pack_item_tokens:
+                packable.append((cost, item))
+            else:
+                singles.append(item)
+        
+        bins = []
+        for cost, item in sorted(packable, key=lambda entry: -entry[0]):
+            for packed in bins:
+                if packed[0] + cost <= capacity and len(packed[1]) < self.pack_max_items:
+                    packed[0] += cost
+                    packed[1].append(item)
+                    break
+            else:
+                bins.append([cost, [item]])
+        
+        packs = []
+        for _, items in bins:
+            if len(items) > 1:
+                packs.append(items)
+            else:
+                singles.extend(items)
+        return packs, singles
+    
+    def _summarize_pack(self, pack):
+        """
+        Summarizes a pack in one request.
+        
+        Returns:
+            Items whose summary could not be read from the reply, to be
+            summarized alone
+        """
+        try:
+            reply = self._complete(self._create_packed_prompt(self._pack_items(pack)), json_items=len(pack))
+        except Exception as e:
+            logger.error(f"Error summarizing packed newsletters: {str(e)}")
+            return pack
+        return self._store_pack(pack, reply)
+    
+    async def _summarize_pack_async(self, pack, client, user_limit):
+        """_summarize_pack() for the async path, then summarizes the leftovers."""
+        try:
+            reply = await self._complete_async(
+                client, self._create_packed_prompt(self._pack_items(pack)), user_limit, json_items=len(pack)
+            )
+            leftovers = self._store_pack(pack, reply)
+        except Exception as e:
+            logger.error(f"Error summarizing packed newsletters: {str(e)}")
+            leftovers = pack
+        
+        await asyncio.gather(*[
+            self._summarize_prepared_async(newsletter, content, key, client, user_limit)
+            for newsletter, content, key in leftovers
+        ])
+    
+    def _pack_items(self, pack):
+        """(item ID, sender, content) for each newsletter in a pack."""
+        return [
+            (position, newsletter.get('sender', 'Unknown'), content)
+            for position, (newsletter, content, _) in enumerate(pack, 1)
+        ]
+    
+    def _store_pack(self, pack, reply):
+        """
+        Stores each item's summary from a packed JSON reply.
+        
+        Returns:
+            Items missing from the reply, or every item if it is not JSON
+        """
+        summaries = self._parse_packed(reply)
+        leftovers = []
+        for position, (newsletter, content, key) in enumerate(pack, 1):
+            bullets = summaries.get(str(position))
+            if bullets:
+                sender = newsletter.get('sender', 'Unknown')
+                self._store_bullets(newsletter, self._cache_key(content, sender, stage='packed'), bullets)
+            else:
+                leftovers.append((newsletter, content, key))
+        
+        if leftovers:
+            logger.warning(f"Packed reply missed {len(leftovers)} of {len(pack)} newsletters, summarizing them alone")
+        return leftovers
+    
+    def _parse_packed(self, reply):
+        """
+        Reads {"<item ID>": [strings]} from a packed reply.
+        
+        Returns:
+            Dict of item ID to bullets; empty if the reply is not such JSON
+        """
+        text = reply.strip()
+        if text.startswith('```'):
+            # Models sometimes fence JSON despite being asked not to
+            text = text.strip('`')
+            text = text[4:] if text.startswith('json') else text
+        
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        
+        summaries = {}
+        for item_id, value in data.items():
+            if isinstance(value, str):
+                value = [value]
+            if not isinstance(value, list):
+                continue
+            lines = [str(line).strip() for line in value if isinstance(line, (str, int, float))]
+            lines = [line for line in lines if line]
+            if lines:
+                summaries[str(item_id).strip()] = self._parse_bullets('\n'.join(lines))
+        return summaries
+    
+    def _prepare(self, newsletter):
+        """
+        Finds the content to summarize and its summary cache key.
+        
+        Returns:
+            (content, key), or (None, None) if the newsletter's summary was
+            already set because it is too short or cached
+        """
+        content = newsletter.get('clean_body', '')
+        sender = newsletter.get('sender', 'Unknown')
+        
+        if not content or len(content.strip()) < 50:
+            logger.warning(f"Newsletter from {sender} is too short to summarize")
+            newsletter['summary'] = ["No content to summarize"]
+            return None, None
+        
+        # Keep the prompt within the token budget (chunked mode splits instead)
+        if self.mode == 'truncate':
+            content = self._fit_content(content, sender)
+        
+        # Reruns, retries and issues many users receive skip the provider;
+        # a summary from a packed prompt is only reused while packing is on
+        key = self._cache_key(content, sender)
+        cached = self.cache.get(key) if self.cache else None
+        if cached is None and self.cache and self.packing:
+            cached = self.cache.get(self._cache_key(content, sender, stage='packed'))
+        if cached is not None:
+            newsletter['summary'] = json.loads(cached)
+            logger.info(f"Reused cached summary for newsletter from {sender}")
+            return None, None
+        
+        return content, key
+    
+    def _store_summary(self, newsletter, key, summary):
+        """Parses the provider's reply into the newsletter and caches it."""
+        if not summary.strip():
+            newsletter['summary'] = self._parse_bullets(summary)
+            return
+        self._store_bullets(newsletter, key, self._parse_bullets(summary))
+    
+    def _store_bullets(self, newsletter, key, bullets):
+        if self.cache:
+            self.cache.set(key, json.dumps(bullets).encode('utf-8'))
+        
+        newsletter['summary'] = bullets
+        logger.info(f"Summarized newsletter from {newsletter.get('sender', 'Unknown')}")
+    
+    def _split_content(self, content, sender):
+        """
+        Chunks of content for the map step, or [content] when it fits one
+        prompt. Content beyond MAX_CHUNKS chunks is dropped.
+        """
+        if self.mode != 'chunked':
+            return [content]
+        
+        overhead = self.token_counter.count(self._create_prompt('', sender))
+        if self.token_counter.count_blocks(content.split('\n\n')) <= self.max_prompt_tokens - overhead:
+            return [content]
+        
+        # Leave a little room for joins the chunk sizes do not account for
+        overhead = self.token_counter.count(self._create_map_prompt('', sender))
+        chunks = self.token_counter.split(content, int((self.max_prompt_tokens - overhead) * 0.95))
+        if len(chunks) > self.max_chunks:
+            logger.info(f"Summarizing the first {self.max_chunks} of {len(chunks)} parts of newsletter from {sender}")
+            chunks = chunks[:self.max_chunks]
+        return chunks
+    
+    def _map_reduce(self, chunks, sender):
+        """Summarizes chunks in parallel threads, then merges their takeaways."""
+        keys = [self._cache_key(chunk, sender, stage='map') for chunk in chunks]
+        takeaways = [self._cached_takeaways(key) for key in keys]
+        missing = [i for i, found in enumerate(takeaways) if found is None]
+        
+        if missing:
+            workers = min(len(missing), get_provider_concurrency(self.provider))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                replies = list(executor.map(
+                    lambda i: self._complete(self._create_map_prompt(chunks[i], sender)),
+                    missing
+                ))
+            for i, reply in zip(missing, replies):
+                takeaways[i] = self._store_takeaways(keys[i], reply)
+        
+        return self._complete(self._create_reduce_prompt(takeaways, sender), final=True)
+    
+    async def _map_reduce_async(self, chunks, sender, client, user_limit):
+        """_map_reduce() for the async path; map calls share the usual limits."""
+        keys = [self._cache_key(chunk, sender, stage='map') for chunk in chunks]
+        takeaways = [self._cached_takeaways(key) for key in keys]
+        missing = [i for i, found in enumerate(takeaways) if found is None]
+        
+        replies = await asyncio.gather(*[
+            self._complete_async(client, self._create_map_prompt(chunks[i], sender), user_limit)
+            for i in missing
+        ])
+        for i, reply in zip(missing, replies):
+            takeaways[i] = self._store_takeaways(keys[i], reply)
+        
+        return await self._complete_async(
+            client, self._create_reduce_prompt(takeaways, sender), user_limit, final=True
+        )
+    
+    def _cached_takeaways(self, key):
+        cached = self.cache.get(key) if self.cache else None
+        return json.loads(cached) if cached is not None else None
+    
+    def _store_takeaways(self, key, reply):
+        """Parses a map reply and caches it, so re-sent parts are not redone."""
+        if not reply.strip():
+            return []
+        takeaways = self._parse_bullets(reply, limit=MAP_BULLETS)
+        if self.cache:
+            self.cache.set(key, json.dumps(takeaways).encode('utf-8'))
+        return takeaways
+    
+    def _complete(self, prompt, final=False, json_items=None):
+        """
+        Sends one prompt to the configured provider. A `final` prompt asks
+        for the user's summary style, so a streamed reply can stop early;
+        `json_items` asks for a JSON reply covering that many newsletters.
+        """
+        if self.provider == 'openai':
+            return self._summarize_with_openai(prompt, json_items)
+        return self._summarize_with_ollama(prompt, self._stop_after(final), bool(json_items))
+    
+    async def _complete_async(self, client, prompt, user_limit, final=False, json_items=None):
+        """Sends one prompt once both the user's and the provider's limits allow."""
+        # Take the user's slot first, so a user waiting on the provider
+        # limit does not hold slots other users could run in
+        async with user_limit:
+            async with _provider_limit(self.provider):
+                if self.provider == 'openai':
+                    return await self._summarize_with_openai_async(client, prompt, json_items)
+                return await self._summarize_with_ollama_async(
+                    client, prompt, self._stop_after(final), bool(json_items)
+                )
+    
+    def _stop_after(self, final):
+        return STYLE_BULLETS.get(self.summary_style) if final else None
+    
+    def _log_cache_stats(self):
+        if self.cache:
+            stats = self.cache.stats()
+            logger.info(f"Summary cache: {stats['hits']} hits, {stats['misses']} misses")
+    
+    def _fit_content(self, content, sender):
+        """Trims content so the whole prompt fits in MAX_PROMPT_TOKENS."""
+        overhead = self.token_counter.count(self._create_prompt('', sender))
+        budget = self.max_prompt_tokens - overhead
+        if self.token_counter.count_blocks(content.split('\n\n')) <= budget:
+            return content
+        
+        # Text either side of the content can merge into its first and last
+        # tokens, so shrink the budget by whatever the joined prompt overshoots
+        trimmed, _ = self.token_counter.truncate(content, budget)
+        overshoot = self.token_counter.count(self._create_prompt(trimmed, sender)) - self.max_prompt_tokens
+        if overshoot > 0:
+            trimmed, _ = self.token_counter.truncate(content, budget - overshoot)
+        content = trimmed
+        
+        logger.info(f"Trimmed newsletter from {sender} to fit {self.max_prompt_tokens} prompt tokens")
+        return content
+    
+    def _cache_key(self, content, sender, stage='summary'):
+        """
+        Summary cache key: the prompt version, kind, provider, model and
+        style, then the sender (named in the prompt) and the content itself.
+        The kind (stage) is 'summary' for a newsletter's own prompt, 'packed'
+        for its part of a packed reply and 'map' for chunk takeaways.
+        """
+        digest = hashlib.sha256(
+            f"{PROMPT_VERSION}:{stage}:{self.provider}:{self.model}:{self.summary_style}:{sender}\n".encode('utf-8')
+        )
+        digest.update(content.encode('utf-8'))
+        return digest.hexdigest()
     
     def _create_prompt(self, content, sender):
         """Creates a structured prompt for the AI."""
@@ -86,31 +693,108 @@ class IntelligenceLayer:
 NEWSLETTER CONTENT:
 {content}
 
-Please summarize the top 3 most important takeaways into concise bullet points (1-2 sentences each). 
-Maintain a neutral, informative tone.
+{SUMMARY_STYLES[self.summary_style]}"""
+    
+    def _create_map_prompt(self, chunk, sender):
+        """Prompt for the takeaways of one part of a long newsletter."""
+        return f"""You are a professional research assistant. Below is one part of a long newsletter from {sender}.
+
+NEWSLETTER PART:
+{chunk}
+
+List the most important takeaways from this part as concise bullet points (at most {MAP_BULLETS}, 1 sentence each).
 
 Provide only the bullet points, starting each with a dash (-)."""
     
-    def _summarize_with_openai(self, prompt):
+    def _create_reduce_prompt(self, takeaways, sender):
+        """Prompt merging the takeaways of every part into the final summary."""
+        parts = '\n\n'.join(
+            f"Part {i}:\n" + '\n'.join(f"- {takeaway}" for takeaway in part)
+            for i, part in enumerate(takeaways, 1)
+            if part
+        )
+        overhead = self.token_counter.count(self._create_reduce_prompt_text('', sender))
+        parts, _ = self.token_counter.truncate(parts, self.max_prompt_tokens - overhead)
+        return self._create_reduce_prompt_text(parts, sender)
+    
+    def _create_packed_prompt(self, items):
+        """Prompt summarizing several newsletters, (item ID, sender, content) each, as JSON."""
+        newsletters = '\n\n'.join(self._packed_item(*item) for item in items)
+        return f"""You are a professional research assistant. Below are several newsletters, each marked with an item ID.
+
+{newsletters}
+
+{PACKED_STYLES[self.summary_style]}
+Maintain a neutral, informative tone.
+
+Reply with only a JSON object mapping each item ID to its list of strings, for example: {{"1": ["First takeaway.", "Second takeaway."], "2": ["..."]}}"""
+    
+    def _packed_item(self, item_id, sender, content):
+        return f"""=== ITEM {item_id} (newsletter from {sender}) ===
+{content}"""
+    
+    def _create_reduce_prompt_text(self, parts, sender):
+        return f"""You are a professional research assistant. Below are the takeaways from each part of a long newsletter from {sender}.
+
+TAKEAWAYS BY PART:
+{parts}
+
+{SUMMARY_STYLES[self.summary_style]}"""
+    
+    @contextlib.asynccontextmanager
+    async def _async_client(self):
+        """
+        Client for one async batch. The OpenAI client is closed with the
+        batch; the process-wide Ollama client keeps its connections for
+        later batches on the same loop.
+        """
+        if self.provider == 'openai':
+            from openai import AsyncOpenAI
+            async with AsyncOpenAI(api_key=self.client.api_key) as client:
+                yield client
+        else:
+            yield self.ollama
+    
+    def _openai_request(self, prompt, json_items=None):
+        """
+        Chat completion arguments shared by the sync and async calls; a
+        packed request gets JSON mode and room for every item's summary.
+        """
+        request = {
+            'model': self.model,
+            'messages': [
+                {
+                    "role": "system",
+                    "content": "You are a professional research assistant specializing in synthesizing information."
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            'temperature': 0.5,
+            'max_tokens': 300
+        }
+        if json_items:
+            request['response_format'] = {"type": "json_object"}
+            request['max_tokens'] = min(300 * json_items, 4096)
+        return request
+    
+    def _summarize_with_openai(self, prompt, json_items=None):
         """Calls OpenAI GPT model for summarization."""
         try:
-            model = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+            response = self.client.chat.completions.create(**self._openai_request(prompt, json_items))
             
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a professional research assistant specializing in synthesizing information."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.5,
-                max_tokens=300
-            )
+            return response.choices[0].message.content
+        
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            raise
+    
+    async def _summarize_with_openai_async(self, client, prompt, json_items=None):
+        """Async OpenAI call; `client` is an AsyncOpenAI."""
+        try:
+            response = await client.chat.completions.create(**self._openai_request(prompt, json_items))
             
             return response.choices[0].message.content
         
@@ -118,27 +802,19 @@ Provide only the bullet points, starting each with a dash (-)."""
             logger.error(f"OpenAI API error: {str(e)}")
             raise
     
-    def _summarize_with_ollama(self, prompt):
-        """Calls local Ollama model for summarization."""
+    def _summarize_with_ollama(self, prompt, stop_after_bullets=None, json_output=False):
+        """
+        Calls local Ollama model for summarization, through the pooled
+        client. Streamed replies (OLLAMA_STREAM) stop once
+        `stop_after_bullets` bullets are complete.
+        """
         try:
-            response = requests.post(
-                f"{self.ollama_url}/api/generate",
-                json={
-                    "model": self.ollama_model,
-                    "prompt": prompt,
-                    "stream": False,
-                    "temperature": 0.5
-                },
-                timeout=60
+            return self.ollama.generate(
+                prompt,
+                stream=self.ollama_stream,
+                stop_after_bullets=stop_after_bullets,
+                json_output=json_output
             )
-            
-            if response.status_code != 200:
-                raise Exception(
-                    f"Ollama API returned {response.status_code}: {response.text}"
-                )
-            
-            result = response.json()
-            return result.get('response', '')
         
         except requests.exceptions.ConnectionError:
             logger.error(
@@ -150,7 +826,28 @@ Provide only the bullet points, starting each with a dash (-)."""
             logger.error(f"Ollama API error: {str(e)}")
             raise
     
-    def _parse_bullets(self, text):
+    async def _summarize_with_ollama_async(self, client, prompt, stop_after_bullets=None, json_output=False):
+        """Async Ollama call; `client` is the pooled OllamaClient."""
+        import httpx
+        try:
+            return await client.agenerate(
+                prompt,
+                stream=self.ollama_stream,
+                stop_after_bullets=stop_after_bullets,
+                json_output=json_output
+            )
+        
+        except httpx.ConnectError:
+            logger.error(
+                f"Cannot connect to Ollama at {self.ollama_url}. "
+                "Ensure Ollama is running."
+            )
+            raise
+        except Exception as e:
+            logger.error(f"Ollama API error: {str(e)}")
+            raise
+    
+    def _parse_bullets(self, text, limit=3):
         """Parses bullet points from AI response."""
         bullets = []
         lines = text.strip().split('\n')
@@ -171,5 +868,5 @@ Provide only the bullet points, starting each with a dash (-)."""
             if line:
                 bullets.append(line)
         
-        # Return only first 3 bullets
-        return bullets[:3] if bullets else ["Unable to extract summary"]
+        # Return only the first `limit` bullets
+        return bullets[:limit] if bullets else ["Unable to extract summary"]
@@ -207,10 +207,16 @@ class DeliverySystem:
         
         return section
     
-    def send_digest(self, html_content):
+    def send_digest(self, html_content, recipient_email=None):
         """
         Sends the compiled digest via Gmail SMTP.
+        
+        Args:
+            html_content: Digest HTML from compile_digest()
+            recipient_email: Overrides RECIPIENT_EMAIL
         """
+        recipient_email = recipient_email or self.recipient_email
+        
         try:
             if not self.app_password:
                 logger.warning(
@@ -226,7 +232,7 @@ class DeliverySystem:
                 'Your Daily Newsletter Digest'
             )
             message['From'] = self.sender_email
-            message['To'] = self.recipient_email
+            message['To'] = recipient_email
             
             # Attach HTML
             part = MIMEText(html_content, 'html')
@@ -238,11 +244,11 @@ class DeliverySystem:
                 server.login(self.sender_email, self.app_password)
                 server.sendmail(
                     self.sender_email,
-                    self.recipient_email,
+                    recipient_email,
                     message.as_string()
                 )
             
-            logger.info(f"Digest sent to {self.recipient_email}")
+            logger.info(f"Digest sent to {recipient_email}")
             return True
         
         except smtplib.SMTPAuthenticationError:
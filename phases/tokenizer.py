@@ -0,0 +1,331 @@
+"""
+Token counting
+Pluggable counters for truncation and prompt budgeting
+"""
+
+import os
+import re
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Byte-level BPE merges bundled with the project (no network needed)
+DEFAULT_VOCAB_FILE = os.path.join(os.path.dirname(__file__), 'data', 'bpe_merges.txt')
+
+# Splits text into words before BPE, GPT-2 style
+PRETOKENIZE = re.compile(r"""'(?:s|t|re|ve|m|ll|d)| ?[^\W\d_]+| ?\d+| ?[^\s\w]+|\s+(?!\S)|\s+""")
+
+# Sentence ends used when a paragraph has to be split
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+# CJK, kana, Hangul and full-width forms: about one token per character
+WIDE = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef\U00020000-\U0002fa1f]')
+
+# Letters outside the Latin blocks the bundled merges were learned from
+NON_LATIN = re.compile(r'[^\W\d_\u0000-\u024f\u1e00-\u1eff]')
+
+
+def bytes_to_unicode():
+    """
+    Maps every byte to a printable character, so merges can be stored as
+    plain text (same table as GPT-2).
+    """
+    printable = (
+        list(range(ord('!'), ord('~') + 1))
+        + list(range(ord('¡'), ord('¬') + 1))
+        + list(range(ord('®'), ord('ÿ') + 1))
+    )
+    chars = printable[:]
+    extra = 0
+    for byte in range(256):
+        if byte not in printable:
+            printable.append(byte)
+            chars.append(256 + extra)
+            extra += 1
+    return dict(zip(printable, map(chr, chars)))
+
+
+class TokenCounter:
+    """
+    Base class for token counters.
+    
+    Subclasses implement count(). Block counts are memoized, so text that
+    grows one paragraph at a time is never recounted from the start.
+    """
+    
+    def __init__(self, cache_size=4096):
+        self.cache_size = cache_size
+        self._block_cache = OrderedDict()
+    
+    def count(self, text):
+        """Returns the number of tokens in text."""
+        raise NotImplementedError
+    
+    def count_block(self, block):
+        """Memoized count for a paragraph-sized block of text."""
+        cached = self._block_cache.get(block)
+        if cached is not None:
+            self._block_cache.move_to_end(block)
+            return cached
+        
+        tokens = self.count(block)
+        self._block_cache[block] = tokens
+        if len(self._block_cache) > self.cache_size:
+            self._block_cache.popitem(last=False)
+        return tokens
+    
+    def separator_cost(self, separator):
+        """Tokens a separator adds between two blocks, in context."""
+        return self.count(separator + 'x') - self.count('x')
+    
+    def count_blocks(self, blocks, separator='\n\n'):
+        """Token count of blocks joined by separator."""
+        if not blocks:
+            return 0
+        return (
+            sum(self.count_block(block) for block in blocks)
+            + self.separator_cost(separator) * (len(blocks) - 1)
+        )
+    
+    def truncate(self, text, budget, separator='\n\n'):
+        """
+        Cuts text to at most `budget` tokens on a paragraph boundary, or a
+        sentence boundary when the next paragraph only partly fits.
+        
+        Returns:
+            (text, whether anything was cut)
+        """
+        paragraphs = text.split(separator)
+        separator_tokens = self.separator_cost(separator)
+        
+        kept = []
+        used = 0
+        for paragraph in paragraphs:
+            cost = self.count_block(paragraph) + (separator_tokens if kept else 0)
+            if used + cost <= budget:
+                kept.append(paragraph)
+                used += cost
+                continue
+            
+            # Fill the rest of the budget with whole sentences
+            remaining = budget - used - (separator_tokens if kept else 0)
+            partial = self._take_sentences(paragraph, remaining)
+            if partial:
+                kept.append(partial)
+            return separator.join(kept), True
+        
+        return separator.join(kept), False
+    
+    def split(self, text, budget, separator='\n\n'):
+        """
+        Splits text into chunks of about `budget` tokens or fewer, keeping
+        whole paragraphs together where they fit. A longer paragraph is
+        split between sentences, and a longer sentence between words.
+        
+        Chunk sizes are summed per piece rather than recounted after
+        joining, so a chunk can be off by a token at each join.
+        """
+        separator_tokens = self.separator_cost(separator)
+        
+        chunks = []
+        current = []
+        used = 0
+        for paragraph in text.split(separator):
+            if self.count_block(paragraph) <= budget:
+                pieces = [paragraph]
+            else:
+                pieces = self._split_run(SENTENCE_END.split(paragraph), budget)
+            
+            for piece in pieces:
+                cost = self.count_block(piece)
+                if current and used + separator_tokens + cost > budget:
+                    chunks.append(separator.join(current))
+                    current, used = [], 0
+                used += cost + (separator_tokens if current else 0)
+                current.append(piece)
+        
+        if current:
+            chunks.append(separator.join(current))
+        return chunks
+    
+    def _split_run(self, parts, budget):
+        """Groups parts (sentences or words) into space-joined runs within budget."""
+        runs = []
+        taken = []
+        used = 0
+        for part in parts:
+            cost = self.count(' ' + part)
+            if cost > budget and ' ' in part.strip():
+                # A sentence longer than a chunk: split it between words
+                if taken:
+                    runs.append(' '.join(taken))
+                    taken, used = [], 0
+                runs.extend(self._split_run(part.split(), budget))
+                continue
+            if taken and used + cost > budget:
+                runs.append(' '.join(taken))
+                taken, used = [], 0
+            taken.append(part)
+            used += cost
+        
+        if taken:
+            runs.append(' '.join(taken))
+        return runs
+    
+    def _take_sentences(self, paragraph, budget):
+        """Longest run of leading sentences that fits the budget."""
+        if budget <= 0:
+            return ''
+        
+        taken = []
+        for sentence in SENTENCE_END.split(paragraph):
+            # Joining changes how the first word of a sentence is split, so
+            # count the joined run rather than summing sentence counts
+            if self.count(' '.join(taken + [sentence])) > budget:
+                break
+            taken.append(sentence)
+        return ' '.join(taken)
+
+
+class CharRatioCounter(TokenCounter):
+    """The old approximation: 4 characters ≈ 1 token."""
+    
+    def __init__(self, chars_per_token=4, **kwargs):
+        super().__init__(**kwargs)
+        self.chars_per_token = chars_per_token
+    
+    def count(self, text):
+        return -(-len(text) // self.chars_per_token)
+
+
+class TiktokenCounter(TokenCounter):
+    """
+    Counts with a tiktoken encoding, the tokenizer the OpenAI models use.
+    
+    Needs the tiktoken package, and the encoding is downloaded on first
+    use unless it is already in tiktoken's cache.
+    """
+    
+    def __init__(self, encoding=None, **kwargs):
+        super().__init__(**kwargs)
+        import tiktoken
+        self.encoding = tiktoken.get_encoding(encoding or os.getenv('TIKTOKEN_ENCODING', 'cl100k_base'))
+    
+    def count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+class BPETokenCounter(TokenCounter):
+    """
+    Byte-level BPE counter using a merges file bundled with the project.
+    
+    The merges were learned from English text and the vocabulary is smaller
+    than the hosted models', so Latin-script counts run somewhat high, which
+    keeps budgets on the safe side. Other scripts would fall apart into
+    single bytes, so words containing them are estimated instead: one token
+    per CJK character and one per two characters of any other script.
+    """
+    
+    def __init__(self, vocab_file=None, **kwargs):
+        super().__init__(**kwargs)
+        self.vocab_file = vocab_file or DEFAULT_VOCAB_FILE
+        self.ranks = self._load_merges(self.vocab_file)
+        self.byte_encoder = bytes_to_unicode()
+        self._word_tokens = lru_cache(maxsize=65536)(self._bpe_length)
+    
+    def count(self, text):
+        tokens = 0
+        for word in PRETOKENIZE.findall(text):
+            tokens += self._word_tokens(word)
+        return tokens
+    
+    def _bpe_length(self, word):
+        """Number of BPE tokens for one pre-tokenized word."""
+        wide = len(WIDE.findall(word))
+        if wide or NON_LATIN.search(word):
+            rest = len(word.strip()) - wide
+            return max(wide + -(-rest // 2), 1)
+        
+        symbols = [self.byte_encoder[byte] for byte in word.encode('utf-8')]
+        
+        while len(symbols) > 1:
+            # Apply the highest-priority merge present in the word
+            best_rank = None
+            best_index = None
+            for i in range(len(symbols) - 1):
+                rank = self.ranks.get((symbols[i], symbols[i + 1]))
+                if rank is not None and (best_rank is None or rank < best_rank):
+                    best_rank = rank
+                    best_index = i
+            
+            if best_index is None:
+                break
+            
+            first, second = symbols[best_index], symbols[best_index + 1]
+            merged = []
+            i = 0
+            while i < len(symbols):
+                if i < len(symbols) - 1 and symbols[i] == first and symbols[i + 1] == second:
+                    merged.append(first + second)
+                    i += 2
+                else:
+                    merged.append(symbols[i])
+                    i += 1
+            symbols = merged
+        
+        return len(symbols)
+    
+    @staticmethod
+    def _load_merges(path):
+        """Reads merges (one 'a b' pair per line) into a rank table."""
+        ranks = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('#version'):
+                    continue
+                parts = line.rstrip('\n').split(' ')
+                if len(parts) == 2:
+                    ranks[(parts[0], parts[1])] = len(ranks)
+        return ranks
+
+
+# Available counters, keyed by TOKEN_COUNTER value
+TOKEN_COUNTERS = {
+    'tiktoken': TiktokenCounter,
+    'bpe': BPETokenCounter,
+    'chars': CharRatioCounter,
+}
+
+_counter = None
+
+
+def get_token_counter():
+    """
+    Returns the process-wide token counter selected by TOKEN_COUNTER.
+    
+    The default, auto, uses tiktoken when it is installed and its encoding
+    loads, and the bundled BPE vocabulary otherwise.
+    """
+    global _counter
+    if _counter is None:
+        name = os.getenv('TOKEN_COUNTER', 'auto').lower()
+        if name != 'auto' and name not in TOKEN_COUNTERS:
+            raise ValueError(f"Unknown token counter: {name}")
+        
+        if name in ('auto', 'tiktoken'):
+            try:
+                _counter = TiktokenCounter()
+            except (ImportError, OSError) as e:
+                if name == 'tiktoken':
+                    logger.warning(f"tiktoken unavailable ({e}), using the bundled vocabulary")
+                name = 'bpe'
+        
+        if _counter is None:
+            try:
+                _counter = TOKEN_COUNTERS[name]()
+            except OSError as e:
+                logger.warning(f"BPE vocabulary unavailable ({e}), using character estimate")
+                _counter = CharRatioCounter()
+    return _counter
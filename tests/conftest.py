@@ -0,0 +1,32 @@
+"""
+Shared fixtures. The app is pointed at an in-memory SQLite database before
+config is imported, so tests never touch a real one.
+"""
+
+import os
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+import pytest
+
+
+@pytest.fixture
+def app():
+    from app import create_app, db
+    
+    app = create_app()
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def user(app):
+    from app import db
+    from app.models import User
+    
+    user = User(email='reader@example.com', password='x')
+    db.session.add(user)
+    db.session.commit()
+    return user
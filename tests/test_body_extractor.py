@@ -0,0 +1,33 @@
+"""
+BodyExtractor charset handling for multipart messages.
+"""
+
+import base64
+from phases.gmail_api import BodyExtractor
+
+
+def text_part(text, charset, mime_type='text/html'):
+    return {
+        'mimeType': mime_type,
+        'headers': [{'name': 'Content-Type', 'value': f'{mime_type}; charset="{charset}"'}],
+        'body': {'data': base64.urlsafe_b64encode(text.encode(charset)).decode('ascii').rstrip('=')},
+    }
+
+
+MIXED_CHARSETS = {
+    'mimeType': 'multipart/mixed',
+    'parts': [
+        text_part('<p>Grüße – 5 €</p>', 'utf-8'),
+        text_part('<p>Café naïve</p>', 'iso-8859-1'),
+    ],
+}
+
+
+def test_each_part_uses_its_own_charset():
+    assert BodyExtractor().extract(MIXED_CHARSETS) == '<p>Grüße – 5 €</p><p>Café naïve</p>'
+
+
+def test_budget_cut_drops_partial_character():
+    # 'ü' is two bytes in UTF-8; a 6-byte budget cuts it in half
+    text = BodyExtractor(max_part_bytes=6).extract(MIXED_CHARSETS)
+    assert text == '<p>Gr<p>Caf'
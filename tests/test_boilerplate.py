@@ -0,0 +1,122 @@
+"""
+Per-sender boilerplate learning and stripping.
+"""
+
+import pytest
+from phases.boilerplate import (
+    BoilerplateFilter, MemoryTemplateStore, SenderTemplate, SnapshotBoilerplate, fingerprint, sender_key,
+)
+from phases.phase2_cleaning import CleaningEngine
+from phases.tokenizer import get_token_counter
+
+SENDER = 'news@example.com'
+HEADER = 'Weekly Example Digest - Issue 12'
+FOOTER = 'You are receiving this because you subscribed. Unsubscribe or update your preferences.'
+
+STORIES = [
+    'Central banks signalled that interest rates may fall later this year as inflation cools.',
+    'A new open source database promises faster analytics on commodity hardware for small teams.',
+    'Researchers published a study on battery chemistry that could double electric car range.',
+    'The city council approved a plan to expand bike lanes across the downtown area next spring.',
+    'Chip makers reported record demand from data centres building out machine learning clusters.',
+]
+
+
+def issue(story, number=12):
+    return [HEADER.replace('12', str(number)), story, FOOTER]
+
+
+def html(blocks):
+    return ''.join(f'<p>{block}</p>' for block in blocks)
+
+
+def make_filter(store=None):
+    return BoilerplateFilter(store or MemoryTemplateStore(), get_token_counter(), threshold=0.6, min_issues=3)
+
+
+def test_fingerprint_ignores_case_whitespace_and_numbers():
+    assert fingerprint('Issue 12  of THE digest') == fingerprint('issue 13 of the\ndigest')
+    assert fingerprint('Issue 12') != fingerprint('Volume 12')
+
+
+def test_sender_key_normalizes_from_header():
+    assert sender_key('Example News <News@Example.com>') == 'news@example.com'
+    assert sender_key('') is None
+
+
+def test_strips_template_after_min_issues():
+    bp = make_filter()
+    for number, story in enumerate(STORIES[:3]):
+        kept, removed, _ = bp.strip(SENDER, issue(story, number))
+        assert kept == issue(story, number)
+    
+    kept, removed, saved = bp.strip(SENDER, issue(STORIES[3], 3))
+    assert kept == [STORIES[3]]
+    assert removed == {0, 2}
+    assert saved > 0
+
+
+def test_recleaning_the_same_issue_changes_nothing():
+    bp = make_filter()
+    blocks = issue(STORIES[0])
+    first = bp.strip(SENDER, list(blocks))
+    for _ in range(5):
+        assert bp.strip(SENDER, list(blocks)) == first
+    assert bp.template(SENDER).issues == 1
+
+
+def test_near_duplicate_is_not_learned():
+    bp = make_filter()
+    bp.learn(SENDER, issue(STORIES[0]))
+    resend = issue(STORIES[0].replace('this year', 'this year.'), 12)
+    bp.learn(SENDER, resend)
+    assert bp.template(SENDER).issues == 1
+    
+    bp.learn(SENDER, issue(STORIES[1], 13))
+    assert bp.template(SENDER).issues == 2
+
+
+def test_retries_through_the_engine_keep_the_content():
+    engine = CleaningEngine(boilerplate=make_filter(), cache=False)
+    body = html(issue(STORIES[0]))
+    for _ in range(6):
+        newsletter = engine.clean_single({'subject': 'Digest', 'from': SENDER, 'body': body})
+        assert STORIES[0] in newsletter['clean_body']
+        assert HEADER in newsletter['clean_body']
+
+
+def test_seen_issues_survive_a_round_trip_through_the_store():
+    store = MemoryTemplateStore()
+    make_filter(store).learn(SENDER, issue(STORIES[0]))
+    
+    reloaded = make_filter(store)
+    reloaded.learn(SENDER, issue(STORIES[0]))
+    assert reloaded.template(SENDER).issues == 1
+
+
+def test_reads_templates_saved_without_signatures():
+    old = SenderTemplate(issues=4, counts={1: 4, 2: 1}).to_bytes()[:-4]
+    template = SenderTemplate.from_bytes(old)
+    assert (template.issues, template.counts, template.recent) == (4, {1: 4, 2: 1}, [])
+
+
+def test_counts_halve_past_the_window():
+    template = SenderTemplate(window=4)
+    for i in range(5):
+        template.observe([1, 100 + i])
+    assert template.issues == 2
+    assert template.counts == {1: 2}
+
+
+@pytest.mark.parametrize('repeat', [False, True])
+def test_snapshot_observations_are_learned_once(repeat):
+    bp = make_filter()
+    blocks = issue(STORIES[0])
+    bp.learn(SENDER, blocks)
+    
+    snapshot = SnapshotBoilerplate(bp.snapshot(SENDER), get_token_counter())
+    snapshot.strip(SENDER, blocks if repeat else issue(STORIES[1], 13))
+    for fingerprints, signature in snapshot.observed:
+        bp.observe(SENDER, fingerprints, signature)
+    
+    assert bp.template(SENDER).issues == (1 if repeat else 2)
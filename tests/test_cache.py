@@ -0,0 +1,108 @@
+"""
+Cache tiers and the tiered cache built from settings.
+"""
+
+import os
+import time
+import pytest
+from phases.cache import DiskCache, LRUCache, TieredCache, create_cache
+
+
+def test_lru_evicts_least_recently_used_by_size():
+    cache = LRUCache(max_bytes=10)
+    cache.set('a', b'aaaa')
+    cache.set('b', b'bbbb')
+    assert cache.get('a') == b'aaaa'
+
+    cache.set('c', b'cccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'aaaa'
+    assert cache.size == 8
+
+
+def test_lru_replaces_and_skips_oversized_values():
+    cache = LRUCache(max_bytes=10)
+    cache.set('a', b'aaaa')
+    cache.set('a', b'aa')
+    cache.set('big', b'x' * 11)
+
+    assert cache.get('a') == b'aa'
+    assert cache.get('big') is None
+    assert cache.size == 2
+
+
+def test_lru_expires_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    cache = LRUCache(max_bytes=100, ttl=10)
+    cache.set('a', b'value')
+
+    now[0] += 9
+    assert cache.get('a') == b'value'
+    now[0] += 2
+    assert cache.get('a') is None
+    assert cache.size == 0
+
+
+def test_disk_cache_round_trip_and_eviction(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=30)
+    cache.set('aa01', b'x' * 10)
+    cache.set('bb02', b'y' * 10)
+    old = time.time() - 60
+    os.utime(cache._path('aa01'), (old, old))
+    os.utime(cache._path('bb02'), (old + 1, old + 1))
+    assert cache.get('bb02') == b'y' * 10
+
+    cache.set('cc03', b'z' * 15)
+    assert cache.get('aa01') is None
+    assert cache.get('bb02') == b'y' * 10
+    assert cache.get('cc03') == b'z' * 15
+
+
+def test_tiered_cache_promotes_hits_and_counts_them():
+    memory, shared = LRUCache(100), LRUCache(100)
+    cache = TieredCache([memory, shared])
+    shared.set('k', b'v')
+
+    assert cache.get('k') == b'v'
+    assert memory.get('k') == b'v'
+    assert cache.get('k') == b'v'
+    assert cache.get('missing') is None
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (2, 1)
+    assert stats['hit_rate'] == pytest.approx(2 / 3)
+    assert stats['tier_hits'] == {'LRUCache': 1}
+
+
+def test_tiered_cache_writes_every_tier():
+    tiers = [LRUCache(100), LRUCache(100)]
+    TieredCache(tiers).set('k', b'v')
+    assert [tier.get('k') for tier in tiers] == [b'v', b'v']
+
+
+def test_create_cache_from_settings(monkeypatch, tmp_path):
+    monkeypatch.setenv('TEST_CACHE_MEMORY_MB', '1')
+    monkeypatch.setenv('TEST_CACHE_BACKEND', 'disk')
+    monkeypatch.setenv('TEST_CACHE_DIR', str(tmp_path))
+    cache = create_cache('TEST_CACHE', 'unused')
+    assert [type(tier) for tier in cache.tiers] == [LRUCache, DiskCache]
+    assert cache.tiers[0].max_bytes == 1024 * 1024
+
+    monkeypatch.setenv('TEST_CACHE_MEMORY_MB', '0')
+    monkeypatch.setenv('TEST_CACHE_BACKEND', 'none')
+    assert create_cache('TEST_CACHE', 'unused') is None
+
+    monkeypatch.setenv('TEST_CACHE_BACKEND', 'memcached')
+    with pytest.raises(ValueError):
+        create_cache('TEST_CACHE', 'unused')
+
+
+def test_create_cache_with_extra_backend(monkeypatch):
+    monkeypatch.setenv('TEST_CACHE_MEMORY_MB', '0')
+    monkeypatch.delenv('TEST_CACHE_BACKEND', raising=False)
+    monkeypatch.setenv('TEST_CACHE_TTL', '60')
+    shared = LRUCache(100)
+
+    cache = create_cache('TEST_CACHE', 'unused', backends={'db': lambda ttl: shared}, default_backend='db')
+    assert cache.tiers == [shared]
@@ -0,0 +1,98 @@
+"""
+SimHash signatures and the banded LSH near-duplicate indexes.
+"""
+
+import pytest
+from app import db
+from app.models import Newsletter
+from app.workers.duplicate_index import DatabaseDuplicateIndex, from_signed, to_signed
+from phases.dedupe import BANDS, NearDuplicateIndex, bands, get_max_distance, hamming, simhash
+
+SENDER = 'news@example.com'
+TEXT = ' '.join(
+    f'Story {i} covers interest rates, battery chemistry and the new bike lanes downtown.'
+    for i in range(40)
+)
+
+
+def flip(signature, *bits):
+    for bit in bits:
+        signature ^= 1 << bit
+    return signature
+
+
+def test_simhash_is_stable_and_ignores_case_and_punctuation():
+    assert simhash(TEXT) == simhash(TEXT.upper().replace(',', ''))
+    assert 0 <= simhash(TEXT) < 1 << 64
+    assert simhash('') is None
+    assert simhash('...') is None
+
+
+def test_small_edits_stay_close_and_other_text_does_not():
+    resend = 'In case you missed it: ' + TEXT
+    other = ' '.join(f'Recipe {i}: slow roasted tomatoes with garlic and basil.' for i in range(40))
+
+    assert hamming(simhash(TEXT), simhash(resend)) <= get_max_distance()
+    assert hamming(simhash(TEXT), simhash(other)) > 10
+
+
+def test_bands_split_the_signature():
+    signature = 0x0123_4567_89AB_CDEF
+    assert bands(signature) == [(0, 0xCDEF), (1, 0x89AB), (2, 0x4567), (3, 0x0123)]
+
+
+@pytest.mark.parametrize('bits', [(), (0,), (5, 20), (3, 19, 35), (15, 31, 47)])
+def test_signatures_within_max_distance_share_a_band(bits):
+    # Pigeonhole: 3 flipped bits cannot touch all 4 bands
+    signature = simhash(TEXT)
+    assert set(bands(signature)) & set(bands(flip(signature, *bits)))
+
+
+def test_max_distance_is_capped_below_the_band_count(monkeypatch):
+    monkeypatch.setenv('NEAR_DUPLICATE_DISTANCE', '10')
+    assert get_max_distance() == BANDS - 1
+    monkeypatch.setenv('NEAR_DUPLICATE_DISTANCE', '1')
+    assert get_max_distance() == 1
+
+
+def test_index_finds_closest_match_within_distance():
+    signature = simhash(TEXT)
+    index = NearDuplicateIndex(max_distance=3)
+    index.add(SENDER, flip(signature, 1, 2, 3), 'far')
+    index.add(SENDER, flip(signature, 40), 'near')
+
+    assert index.find(SENDER, signature) == 'near'
+    assert index.find(SENDER, flip(signature, 10, 26, 42, 58)) is None
+
+
+def test_index_is_per_sender():
+    signature = simhash(TEXT)
+    index = NearDuplicateIndex(max_distance=3)
+    index.add(SENDER, signature, 0)
+    assert index.find('other@example.com', signature) is None
+
+
+def test_signed_storage_round_trips():
+    for signature in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+        assert -(1 << 63) <= to_signed(signature) < 1 << 63
+        assert from_signed(to_signed(signature)) == signature
+
+
+def add_newsletter(user, index, signature, status='completed', summary='- One'):
+    newsletter = Newsletter(user_id=user.id, gmail_message_id=str(signature), status=status, summary=summary)
+    index.add(newsletter, SENDER, signature)
+    db.session.add(newsletter)
+    db.session.commit()
+    return newsletter
+
+
+def test_database_index_finds_completed_near_duplicates(user):
+    index = DatabaseDuplicateIndex(user.id)
+    signature = (1 << 64) - 1 - simhash(TEXT)
+    original = add_newsletter(user, index, signature)
+    add_newsletter(user, index, flip(signature, 7), status='failed')
+
+    assert index.find(SENDER, flip(signature, 9, 30)) == original
+    assert index.find(SENDER, signature, exclude_id=original.id) is None
+    assert index.find(SENDER, flip(signature, 1, 17, 33, 49)) is None
+    assert index.find('other@example.com', signature) is None
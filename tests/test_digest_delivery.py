@@ -0,0 +1,51 @@
+"""
+The worker's Phase 4: one digest email per run, to the user's address.
+"""
+
+import pytest
+import app.workers.tasks as tasks
+from app import db
+from app.models import UserPreferences
+
+ENTRIES = [
+    {'sender': 'a@example.com', 'subject': 'Issue 1', 'summary': ['One.'], 'links': []},
+    {'sender': 'b@example.com', 'subject': 'Issue 7', 'summary': ['Two.'], 'links': []},
+]
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        tasks.DeliverySystem, 'send_digest',
+        lambda self, html, recipient_email=None: calls.append((html, recipient_email))
+    )
+    return calls
+
+
+def set_preferences(user, **values):
+    db.session.add(UserPreferences(user_id=user.id, **values))
+    db.session.commit()
+
+
+def test_one_digest_for_all_entries(user, sent):
+    set_preferences(user, auto_send=True, send_to_email='inbox@example.com')
+    tasks._send_digest(user, ENTRIES)
+    
+    assert len(sent) == 1
+    html, recipient = sent[0]
+    assert recipient == 'inbox@example.com'
+    assert 'Issue 1' in html and 'Issue 7' in html
+
+
+def test_digest_defaults_to_account_address(user, sent):
+    set_preferences(user, auto_send=True)
+    tasks._send_digest(user, ENTRIES)
+    assert sent[0][1] == user.email
+
+
+def test_nothing_sent_without_auto_send_or_entries(user, sent):
+    tasks._send_digest(user, ENTRIES)
+    set_preferences(user, auto_send=True)
+    tasks._send_digest(user, [])
+    assert sent == []
@@ -0,0 +1,142 @@
+"""
+Gmail quota token buckets, rate-limit detection and retries.
+"""
+
+import time
+from types import SimpleNamespace
+import pytest
+from googleapiclient.errors import HttpError
+from phases import gmail_quota
+from phases.gmail_quota import MemoryQuotaBackend, QuotaGovernor, is_rate_limited
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake monotonic clock; sleeping advances it instead of waiting."""
+    now = [1000.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(time, 'sleep', sleep)
+    return SimpleNamespace(now=now, sleeps=sleeps)
+
+
+def http_error(status, content=b''):
+    return HttpError(SimpleNamespace(status=status, reason=''), content)
+
+
+@pytest.fixture
+def governor(monkeypatch, clock):
+    monkeypatch.setenv('GMAIL_USER_QUOTA_PER_SEC', '250')
+    monkeypatch.setenv('GMAIL_PROJECT_QUOTA_PER_SEC', '1000')
+    monkeypatch.setenv('GMAIL_MAX_RETRIES', '2')
+    return QuotaGovernor(MemoryQuotaBackend())
+
+
+def test_bucket_grants_until_empty_then_reports_wait(clock):
+    backend = MemoryQuotaBackend()
+    bucket = [('user', 10, 20)]
+
+    assert backend.reserve(bucket, 15) == 0
+    assert backend.reserve(bucket, 10) == pytest.approx(0.5)
+
+    clock.now[0] += 0.5
+    assert backend.reserve(bucket, 10) == 0
+
+
+def test_bucket_refill_is_capped_at_capacity(clock):
+    backend = MemoryQuotaBackend()
+    bucket = [('user', 10, 20)]
+    backend.reserve(bucket, 20)
+
+    clock.now[0] += 60
+    assert backend.reserve(bucket, 20) == 0
+    assert backend.reserve(bucket, 1) > 0
+
+
+def test_reserve_takes_from_all_buckets_or_none(clock):
+    backend = MemoryQuotaBackend()
+    user, shared = ('user', 10, 100), ('global', 10, 10)
+
+    assert backend.reserve([user, shared], 8) == 0
+    # The global bucket is short, so the user's is not charged either
+    assert backend.reserve([user, shared], 5) > 0
+    assert backend.reserve([user], 92) == 0
+
+
+def test_cost_by_method():
+    assert QuotaGovernor.cost('gmail.users.messages.get') == 5
+    assert QuotaGovernor.cost('gmail.users.messages.batchModify', 2) == 100
+    assert QuotaGovernor.cost('gmail.users.unknown') == gmail_quota.DEFAULT_COST
+
+
+def test_acquire_pays_large_batches_in_installments(governor, clock):
+    # 100 messages.get = 500 units, twice the user bucket
+    governor.acquire('a', 'gmail.users.messages.get', 100)
+    assert sum(clock.sleeps) == pytest.approx(1.0)
+
+
+def test_users_have_separate_buckets(governor, clock):
+    governor.acquire('a', 'gmail.users.messages.get', 50)
+    governor.acquire('b', 'gmail.users.messages.get', 50)
+    assert clock.sleeps == []
+
+
+@pytest.mark.parametrize('error, limited', [
+    (http_error(429), True),
+    (http_error(403, b'{"error": {"errors": [{"reason": "userRateLimitExceeded"}]}}'), True),
+    (http_error(403, b'{"error": {"errors": [{"reason": "insufficientPermissions"}]}}'), False),
+    (http_error(500), False),
+    (ValueError('not an HTTP error'), False),
+])
+def test_is_rate_limited(error, limited):
+    assert is_rate_limited(error) == limited
+
+
+def test_call_retries_rate_limits_with_backoff(governor, clock):
+    outcomes = [http_error(429), http_error(429), 'ok']
+
+    def request():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert governor.call(request, 'a', 'gmail.users.messages.get') == 'ok'
+    assert len(clock.sleeps) == 2
+
+
+def test_call_gives_up_after_max_retries(governor, clock):
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise http_error(429)
+
+    with pytest.raises(HttpError):
+        governor.call(request, 'a', 'gmail.users.messages.get')
+    assert len(calls) == 3
+
+
+def test_call_does_not_retry_other_errors(governor):
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise http_error(404)
+
+    with pytest.raises(HttpError):
+        governor.call(request, 'a', 'gmail.users.messages.get')
+    assert len(calls) == 1
+
+
+def test_memory_backend_from_settings(monkeypatch):
+    monkeypatch.setenv('GMAIL_QUOTA_BACKEND', 'memory')
+    assert isinstance(gmail_quota._create_backend(), MemoryQuotaBackend)
+    monkeypatch.setenv('GMAIL_QUOTA_BACKEND', 'carrier-pigeon')
+    with pytest.raises(ValueError):
+        gmail_quota._create_backend()
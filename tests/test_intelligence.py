@@ -0,0 +1,132 @@
+"""
+IntelligenceLayer prompts, packing and the summary cache, against the
+local stand-in server in benchmarks.fake_provider.
+"""
+
+import os
+import re
+import pytest
+from phases.cache import LRUCache, TieredCache
+from phases.phase3_intelligence import DEFAULT_STYLE, PACKED_STYLES, SUMMARY_STYLES, IntelligenceLayer
+from benchmarks.fake_provider import FakeOllama, REPLY
+
+BULLETS = [line[2:] for line in REPLY.splitlines()]
+TOPICS = ['interest rates', 'battery chemistry', 'bike lanes']
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    with FakeOllama(latency=0) as server:
+        monkeypatch.setenv('AI_PROVIDER', 'ollama')
+        monkeypatch.setenv('OLLAMA_BASE_URL', server.url)
+        monkeypatch.setenv('OLLAMA_STREAM', 'false')
+        yield server
+
+
+def batch():
+    return [
+        {'sender': f'{topic.split()[0]}@example.com',
+         'clean_body': f'This week we look at {topic} and what it means for the months ahead.'}
+        for topic in TOPICS
+    ]
+
+
+def make_layer(monkeypatch, cache, packing):
+    monkeypatch.setenv('SUMMARY_PACKING', 'true' if packing else 'false')
+    return IntelligenceLayer(cache=cache)
+
+
+def test_packed_summaries_are_cached_apart_from_single_ones(fake, monkeypatch):
+    cache = TieredCache([LRUCache(1 << 20)])
+
+    packed = make_layer(monkeypatch, cache, packing=True).summarize_all(batch())
+    assert fake.requests == 1
+    assert all(newsletter['summary'] == BULLETS for newsletter in packed)
+
+    # Same newsletters with packing off: a packed reply is not reused
+    make_layer(monkeypatch, cache, packing=False).summarize_all(batch())
+    assert fake.requests == 1 + len(TOPICS)
+
+
+def test_packing_reuses_either_kind_of_cached_summary(fake, monkeypatch):
+    cache = TieredCache([LRUCache(1 << 20)])
+    make_layer(monkeypatch, cache, packing=True).summarize_all(batch())
+    make_layer(monkeypatch, cache, packing=False).summarize_all(batch()[:1])
+    requests = fake.requests
+
+    make_layer(monkeypatch, cache, packing=True).summarize_all(batch())
+    assert fake.requests == requests
+
+
+# The prompt before summary styles existed; the default style must keep it
+BASELINE_PROMPT = """You are a professional research assistant. Below is a newsletter from a@example.com.
+
+NEWSLETTER CONTENT:
+Body
+
+Please summarize the top 3 most important takeaways into concise bullet points (1-2 sentences each). 
+Maintain a neutral, informative tone.
+
+Provide only the bullet points, starting each with a dash (-)."""
+
+
+def style_layer(monkeypatch, style=None):
+    monkeypatch.setenv('AI_PROVIDER', 'ollama')
+    monkeypatch.delenv('SUMMARY_STYLE', raising=False)
+    return IntelligenceLayer(summary_style=style, cache=False)
+
+
+def test_every_settings_option_has_a_style():
+    with open(os.path.join(os.path.dirname(__file__), '..', 'app', 'templates', 'dashboard', 'settings.html')) as f:
+        options = re.findall(r'<option value="([^"]+)"[^>]*prefs.summary_style', f.read())
+    assert sorted(options) == sorted(SUMMARY_STYLES) == sorted(PACKED_STYLES)
+
+
+def test_default_style_keeps_the_original_prompt(monkeypatch):
+    layer = style_layer(monkeypatch)
+    assert layer.summary_style == DEFAULT_STYLE == 'bullet-points'
+    assert layer._create_prompt('Body', 'a@example.com') == BASELINE_PROMPT
+
+
+def test_unknown_style_falls_back_to_default(monkeypatch):
+    assert style_layer(monkeypatch, 'haiku').summary_style == DEFAULT_STYLE
+
+
+@pytest.mark.parametrize('style', sorted(SUMMARY_STYLES))
+def test_prompts_end_with_the_style_instructions(monkeypatch, style):
+    layer = style_layer(monkeypatch, style)
+
+    assert layer._create_prompt('Body', 'a@example.com').endswith(SUMMARY_STYLES[style])
+    assert layer._create_reduce_prompt([['One'], ['Two']], 'a@example.com').endswith(SUMMARY_STYLES[style])
+    assert PACKED_STYLES[style] in layer._create_packed_prompt([(1, 'a@example.com', 'Body')])
+    # Map prompts collect takeaways whatever the final style
+    assert SUMMARY_STYLES[style] not in layer._create_map_prompt('Body', 'a@example.com')
+
+
+@pytest.mark.parametrize('style, reply, summary', [
+    ('bullet-points', '- One.\n- Two.\n- Three.', ['One.', 'Two.', 'Three.']),
+    ('paragraph', 'One. Two. Three.', ['One. Two. Three.']),
+    ('summary', 'Main point.\n- Detail one.\n- Detail two.', ['Main point.', 'Detail one.', 'Detail two.']),
+])
+def test_each_style_reply_parses_into_its_summary(monkeypatch, style, reply, summary):
+    layer = style_layer(monkeypatch, style)
+    assert layer._parse_bullets(reply) == summary
+
+
+def test_streams_stop_once_a_style_reply_is_complete(monkeypatch):
+    assert style_layer(monkeypatch, 'bullet-points')._stop_after(final=True) == 3
+    assert style_layer(monkeypatch, 'summary')._stop_after(final=True) == 2
+    # A paragraph has no bullet to stop at
+    assert style_layer(monkeypatch, 'paragraph')._stop_after(final=True) is None
+    assert style_layer(monkeypatch, 'bullet-points')._stop_after(final=False) is None
+
+
+def test_styles_are_cached_separately(fake, monkeypatch):
+    cache = TieredCache([LRUCache(1 << 20)])
+    monkeypatch.setenv('SUMMARY_PACKING', 'false')
+
+    for style in sorted(SUMMARY_STYLES):
+        IntelligenceLayer(summary_style=style, cache=cache).summarize_all(batch()[:1])
+    IntelligenceLayer(summary_style='paragraph', cache=cache).summarize_all(batch()[:1])
+
+    assert fake.requests == len(SUMMARY_STYLES)
@@ -0,0 +1,84 @@
+"""
+Link unwrapping, canonicalization and ranking.
+"""
+
+import base64
+import pytest
+from phases.links import LinkProcessor, canonicalize, dedupe_key, is_utility, unwrap
+from phases.phase2_cleaning import CleaningEngine
+
+CONTENT = 'This paragraph is long enough to count as real newsletter content for ranking links.'
+
+
+def link(url, text='Article', block=0):
+    return {'url': url, 'text': text, 'block': block}
+
+
+def test_canonicalize_strips_tracking_and_defaults():
+    url = 'HTTPS://Example.COM:443/post?id=7&utm_source=mail&fbclid=abc#comments'
+    assert canonicalize(url) == 'https://example.com/post?id=7'
+
+
+def test_canonicalize_keeps_query_untouched_without_tracking():
+    assert canonicalize('http://example.com:8080?b=2&a=1') == 'http://example.com:8080/?b=2&a=1'
+
+
+def test_unwrap_query_and_base64_redirects():
+    target = 'https://example.com/story'
+    assert unwrap(f'https://click.example.net/r?url={target}') == target
+    encoded = base64.urlsafe_b64encode(target.encode()).decode().rstrip('=')
+    assert unwrap(f'https://track.example.net/c/{encoded}') == target
+    assert unwrap('https://example.com/plain') == 'https://example.com/plain'
+
+
+def test_dedupe_key_ignores_www_and_param_order():
+    assert dedupe_key('https://www.example.com/a/?x=1&y=2') == dedupe_key('https://example.com/a?y=2&x=1')
+
+
+def test_utility_links():
+    assert is_utility('Unsubscribe', 'https://example.com/u')
+    assert is_utility('Us', 'https://twitter.com/example')
+    assert not is_utility('Thread', 'https://twitter.com/example/status/1')
+
+
+@pytest.mark.parametrize('href', [
+    'https://[UNSUBSCRIBE]',
+    'https://example.com:port/',
+    'http://[::1/broken',
+    '/relative/path',
+    'mailto:editor@example.com',
+    '#top',
+    '',
+])
+def test_process_drops_unusable_hrefs(href):
+    links = [link(href), link('https://example.com/story')]
+    assert LinkProcessor().process(links, [CONTENT]) == [
+        {'text': 'Article', 'url': 'https://example.com/story'}
+    ]
+
+
+def test_process_merges_duplicates_and_ranks_by_content_distance():
+    blocks = ['Header', CONTENT, 'Footer']
+    links = [
+        link('https://example.com/far', block=2),
+        link('https://example.com/near?utm_medium=email', 'here', block=1),
+        link('https://www.example.com/near', 'Full story', block=1),
+    ]
+    result = LinkProcessor().process(links, blocks, template_indices=[2])
+    assert result == [
+        {'text': 'Full story', 'url': 'https://example.com/near'},
+        {'text': 'Article', 'url': 'https://example.com/far'},
+    ]
+
+
+def test_malformed_href_does_not_empty_newsletter():
+    body = (
+        f'<p>{CONTENT}</p>'
+        '<p><a href="https://[UNSUBSCRIBE]">Unsubscribe</a> '
+        '<a href="https://example.com/story">Story</a></p>'
+    )
+    engine = CleaningEngine(boilerplate=False, cache=False)
+    newsletter = engine.clean_single({'subject': 'Test', 'from': 'news@example.com', 'body': body})
+    
+    assert CONTENT in newsletter['clean_body']
+    assert newsletter['links'] == [{'text': 'Story', 'url': 'https://example.com/story'}]
@@ -0,0 +1,71 @@
+"""
+Worker fetch bookkeeping: which stored newsletters are retried, and when
+the history cursor may move forward.
+"""
+
+from types import SimpleNamespace
+import pytest
+import app.workers.multi_user_phase1 as phase1
+from app import db
+from app.models import Newsletter
+
+
+class FakeHttpError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = SimpleNamespace(status=status)
+
+
+def add_rows(user, *rows):
+    for msg_id, status, attempts in rows:
+        db.session.add(Newsletter(user_id=user.id, gmail_message_id=msg_id, status=status, attempts=attempts))
+    db.session.commit()
+
+
+@pytest.fixture
+def access_layer(user):
+    layer = object.__new__(phase1.MultiUserGmailAccessLayer)
+    layer.user = user
+    layer.service = None
+    layer.quota_user = 'test'
+    layer.batch_size = 10
+    layer.triage_rules = SimpleNamespace(active=False)
+    layer.sync_history_id = '100'
+    return layer
+
+
+def fetch_with(monkeypatch, layer, msg_ids, statuses):
+    """Runs _fetch_messages with every fetch failing with the given HTTP statuses."""
+    def batch_get_messages(service, ids, errors=None, **kwargs):
+        errors.update({msg_id: FakeHttpError(status) for msg_id, status in statuses.items()})
+        yield []
+    
+    monkeypatch.setattr(phase1, 'batch_get_messages', batch_get_messages)
+    return layer._fetch_messages(msg_ids)
+
+
+def test_retries_unfinished_rows_with_attempts_left(access_layer, user, monkeypatch):
+    monkeypatch.setenv('NEWSLETTER_MAX_ATTEMPTS', '3')
+    add_rows(user, ('a', 'failed', 1), ('b', 'failed', 3), ('c', 'pending', 0), ('d', 'completed', 1))
+    assert sorted(access_layer._list_retry_messages()) == ['a', 'c']
+
+
+def test_missing_message_is_failed_for_good_and_keeps_cursor(access_layer, user, monkeypatch):
+    add_rows(user, ('a', 'failed', 1))
+    fetch_with(monkeypatch, access_layer, ['a', 'new'], {'a': 404, 'new': 404})
+    
+    row = Newsletter.query.filter_by(gmail_message_id='a').one()
+    assert (row.status, row.attempts) == ('failed', phase1.get_max_attempts())
+    assert access_layer._list_retry_messages() == []
+    assert access_layer.sync_history_id == '100'
+
+
+def test_transient_error_holds_cursor(access_layer, monkeypatch):
+    fetch_with(monkeypatch, access_layer, ['a'], {'a': 500})
+    assert access_layer.sync_history_id is None
+
+
+def test_triage_rejections_do_not_hold_cursor(access_layer, monkeypatch):
+    monkeypatch.setattr(phase1, 'triage_messages', lambda *args, **kwargs: [])
+    fetch_with(monkeypatch, access_layer, ['a', 'b'], {})
+    assert access_layer.sync_history_id == '100'
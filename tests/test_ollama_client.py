@@ -0,0 +1,145 @@
+"""
+OllamaClient against the local stand-in server in benchmarks.fake_provider.
+"""
+
+import json
+import asyncio
+import pytest
+from phases.ollama_client import OllamaClient, StreamReader
+from phases.phase3_intelligence import IntelligenceLayer
+from benchmarks.fake_provider import FakeOllama, REPLY, EPILOGUE
+
+
+@pytest.fixture
+def fake():
+    with FakeOllama(latency=0) as server:
+        yield server
+
+
+def test_stream_stops_after_bullets(fake):
+    # Reading the epilogue would take about a second at this rate
+    fake.token_latency = 0.05
+    client = OllamaClient(fake.url, 'llama3')
+    
+    text = client.generate('Summarize', stream=True, stop_after_bullets=3)
+    
+    # The token holding the third newline also carries the next word
+    assert text.startswith(REPLY)
+    assert 'capture the main points' not in text
+    
+    # The cut-off connection is not reused for the next request
+    client.generate('Summarize', stream=True, stop_after_bullets=3)
+    assert fake.connections == 2
+
+
+def test_stream_without_stop_reads_whole_reply(fake):
+    client = OllamaClient(fake.url, 'llama3')
+    assert client.generate('Summarize', stream=True) == REPLY + EPILOGUE
+
+
+def test_non_stream_json_output(fake):
+    client = OllamaClient(fake.url, 'llama3')
+    prompt = "=== ITEM 0 (newsletter from a) ===\nText\n\n=== ITEM 1 (newsletter from b) ===\nText"
+    
+    reply = json.loads(client.generate(prompt, json_output=True))
+    
+    assert sorted(reply) == ['0', '1']
+    assert reply['0'] == [line[2:] for line in REPLY.splitlines()]
+    assert fake.requests == 1
+
+
+def test_error_line_in_stream_raises(fake):
+    fake.stream_error = 'model runner has unexpectedly stopped'
+    client = OllamaClient(fake.url, 'llama3')
+    
+    with pytest.raises(Exception, match='unexpectedly stopped'):
+        client.generate('Summarize', stream=True)
+
+
+def test_stream_reader_error_line():
+    reader = StreamReader()
+    assert not reader.feed(b'{"response": "- One", "done": false}')
+    with pytest.raises(Exception, match='out of memory'):
+        reader.feed(b'{"error": "out of memory"}')
+
+
+def test_stream_reader_skips_keep_alive_lines():
+    reader = StreamReader(stop_after_bullets=1)
+    assert not reader.feed(b'')
+    assert not reader.feed('{"response": "- One", "done": false}')
+    assert reader.feed('{"response": "\\n", "done": false}')
+    assert reader.text == '- One\n'
+
+
+def test_warm_up_loads_model(fake):
+    fake.load_time = 0.2
+    client = OllamaClient(fake.url, 'llama3')
+    
+    client.warm_up()
+    
+    assert fake.loaded
+    assert fake.warm_ups == 1
+    assert fake.requests == 0
+    # Later requests no longer wait for the model
+    client.generate('Summarize')
+    assert fake.warm_ups == 1 and fake.requests == 1
+
+
+def test_warm_up_raises_when_server_is_down():
+    client = OllamaClient('http://127.0.0.1:9', 'llama3', timeout=1)
+    with pytest.raises(Exception):
+        client.warm_up()
+
+
+def run(coroutine, loop=None):
+    loop = loop or asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_async_stream_stops_after_bullets(fake):
+    fake.token_latency = 0.05
+    client = OllamaClient(fake.url, 'llama3')
+    
+    text = run(client.agenerate('Summarize', stream=True, stop_after_bullets=3))
+    
+    assert text.startswith(REPLY)
+    assert 'capture the main points' not in text
+
+
+def test_async_session_is_pooled_per_loop(fake):
+    client = OllamaClient(fake.url, 'llama3')
+    
+    async def twice():
+        first = client.async_session()
+        await client.agenerate('Summarize')
+        await client.agenerate('Summarize')
+        return first is client.async_session()
+    
+    assert run(twice())
+    assert fake.requests == 2
+    assert fake.connections == 1
+    
+    # A new loop gets its own session
+    run(client.agenerate('Summarize'))
+    assert fake.connections == 2
+
+
+def test_async_batches_share_the_process_client(fake, monkeypatch):
+    monkeypatch.setenv('AI_PROVIDER', 'ollama')
+    monkeypatch.setenv('OLLAMA_BASE_URL', fake.url)
+    monkeypatch.setenv('OLLAMA_STREAM', 'false')
+    layer = IntelligenceLayer(cache=False)
+    loop = asyncio.new_event_loop()
+    
+    async def batches():
+        for topic in ('interest rates', 'battery chemistry'):
+            body = f'This week we look at {topic} and what it means for the months ahead.'
+            newsletters = await layer.summarize_all_async([{'sender': 'a@example.com', 'clean_body': body}])
+            assert newsletters[0]['summary'] == [line[2:] for line in REPLY.splitlines()]
+    
+    run(batches(), loop)
+    assert fake.requests == 2
+    assert fake.connections == 1
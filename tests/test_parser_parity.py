@@ -0,0 +1,51 @@
+"""
+Parser parity: lxml and html.parser must give the same cleaned text and
+links, so switching HTML_PARSER never changes a summary.
+"""
+
+import pytest
+from phases.phase2_cleaning import CleaningEngine
+from benchmarks.corpus import generate_corpus
+
+MALFORMED = {
+    'unclosed tags': '<html><body><div><p>First paragraph<p>Second <b>bold<i>both</b> text</div>',
+    'stray end tags': '<body></span><p>Text</p></div></td><p>More text</p></body>',
+    'misnested inline': '<p><b>bold <i>both</b> italic</i> plain</p>',
+    'unquoted attributes': '<p>Read <a href=https://example.com/post?id=1&ref=mail>the post</a></p>',
+    'no root': 'Plain words <a href="https://example.com/a">a link</a> and more',
+    'comments and doctype': '<!DOCTYPE html><!-- hidden --><p>Shown<!-- also hidden --> text</p>',
+    'entities': '<p>Fish &amp; chips &mdash; &lt;tag&gt; &nbsp;caf&eacute; &#8364;5</p>',
+    'script and style': '<style>p { color: red }</style><p>Kept</p><script>var x = "<p>no</p>";</script>',
+    'table layout': '<table><tr><td>Cell one<td>Cell two<tr><td><a href="https://example.com/c">Cell link</a></table>',
+    'nul byte': '<p>Before the NUL\x00 after it</p><p><a href="https://example.com/n">link</a></p>',
+    'nul byte in markup': '<div><p>One</p>\x00<p>Two <a href="https://example.com/m">two</a></p></div>',
+}
+
+
+def clean(parser, body):
+    engine = CleaningEngine(parser=parser, boilerplate=False, cache=False)
+    newsletter = engine.clean_single({'subject': 'Test', 'from': 'news@example.com', 'body': body})
+    return newsletter['clean_body'], newsletter['links']
+
+
+@pytest.fixture(autouse=True)
+def tree_mode(monkeypatch):
+    monkeypatch.setenv('CLEANING_MODE', 'tree')
+    monkeypatch.setenv('MAX_TOKENS', '100000')
+
+
+@pytest.mark.parametrize('newsletter', generate_corpus(12, max_size=256 * 1024), ids=lambda n: n['language'])
+def test_corpus_parity(newsletter):
+    text, links = clean('lxml', newsletter['body'])
+    assert text and links
+    assert (text, links) == clean('html.parser', newsletter['body'])
+
+
+@pytest.mark.parametrize('body', MALFORMED.values(), ids=list(MALFORMED))
+def test_malformed_parity(body):
+    assert clean('lxml', body) == clean('html.parser', body)
+
+
+def test_nul_byte_keeps_text_after_it():
+    text, _ = clean('lxml', MALFORMED['nul byte'])
+    assert 'after it' in text
@@ -0,0 +1,151 @@
+"""
+Gmail token refresh: margins, credential caching and single-flight locking.
+"""
+
+import time
+import threading
+from datetime import datetime, timedelta
+import pytest
+from google.oauth2.credentials import Credentials
+from app import db
+from app.models import GmailToken, User
+from app.workers.token_manager import LocalLockBackend, TokenManager
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setenv('TOKEN_REFRESH_MARGIN', '600')
+    monkeypatch.setenv('TOKEN_LOCK_TIMEOUT', '1')
+    return TokenManager(LocalLockBackend())
+
+
+@pytest.fixture
+def refreshes(monkeypatch):
+    """Stands in for Google's token endpoint; records each refresh."""
+    calls = []
+
+    def refresh(creds, request):
+        calls.append(creds.refresh_token)
+        creds.token = f'fresh-{len(calls)}'
+        creds.expiry = datetime.utcnow() + timedelta(hours=1)
+
+    monkeypatch.setattr(Credentials, 'refresh', refresh)
+    return calls
+
+
+def add_token(user, expires_in, refresh_token='refresh', access_token='old'):
+    token = GmailToken(
+        user_id=user.id,
+        access_token=access_token,
+        refresh_token=refresh_token,
+        token_expires_at=datetime.utcnow() + expires_in if expires_in is not None else None
+    )
+    db.session.add(token)
+    db.session.commit()
+    return token
+
+
+def test_needs_refresh_within_margin(manager, user):
+    token = add_token(user, timedelta(hours=1))
+    assert not manager.needs_refresh(token)
+
+    token.token_expires_at = datetime.utcnow() + timedelta(minutes=5)
+    assert manager.needs_refresh(token)
+
+    token.token_expires_at = None
+    assert manager.needs_refresh(token)
+
+
+def test_credentials_are_cached_until_the_token_changes(manager, user, refreshes):
+    token = add_token(user, timedelta(hours=1))
+    creds = manager.get_credentials(token)
+    assert manager.get_credentials(token) is creds
+
+    token.access_token = 'rotated'
+    assert manager.get_credentials(token).token == 'rotated'
+    assert refreshes == []
+
+
+def test_expired_token_is_refreshed_inline(manager, user, refreshes):
+    token = add_token(user, timedelta(minutes=-1))
+    creds = manager.get_credentials(token)
+
+    assert refreshes == ['refresh']
+    assert creds.token == 'fresh-1'
+    assert token.access_token == 'fresh-1'
+    assert not manager.needs_refresh(token)
+
+
+def test_refresh_leaves_fresh_tokens_alone(manager, user, refreshes):
+    token = add_token(user, timedelta(hours=1))
+    assert manager.refresh(token).token == 'old'
+    assert refreshes == []
+
+
+def test_refresh_waits_for_the_lock_holder(manager, user, refreshes):
+    token = add_token(user, timedelta(minutes=5))
+    lock = manager.lock_backend.lock(f'gmail-token-refresh:{user.id}', timeout=1)
+    lock.acquire()
+
+    # Another worker stores a fresh token, then releases while this one waits
+    db.session.execute(
+        db.update(GmailToken)
+        .where(GmailToken.user_id == user.id)
+        .values(access_token='refreshed-elsewhere', token_expires_at=datetime.utcnow() + timedelta(hours=1))
+    )
+    timer = threading.Timer(0.1, lock.release)
+    timer.start()
+    started = time.monotonic()
+    creds = manager.refresh(token)
+    timer.join()
+
+    # Took the lock on release rather than timing out
+    assert time.monotonic() - started < manager.lock_timeout
+    assert creds.token == 'refreshed-elsewhere'
+    assert refreshes == []
+
+
+def test_refresh_gives_up_on_a_stuck_lock(manager, user, refreshes):
+    token = add_token(user, timedelta(minutes=5))
+    manager.lock_backend.lock(f'gmail-token-refresh:{user.id}', timeout=1).acquire()
+
+    assert manager.refresh(token).token == 'old'
+    assert refreshes == []
+
+
+def test_refresh_expiring_skips_fresh_and_unrefreshable_tokens(manager, user, refreshes):
+    add_token(user, timedelta(minutes=5))
+    for email, expires_in, refresh_token in [
+        ('fresh@example.com', timedelta(hours=2), 'refresh-fresh'),
+        ('revoked@example.com', timedelta(minutes=5), None),
+    ]:
+        other = User(email=email, password='x')
+        db.session.add(other)
+        db.session.commit()
+        add_token(other, expires_in, refresh_token=refresh_token)
+
+    assert manager.refresh_expiring() == 1
+    assert refreshes == ['refresh']
+
+
+def test_refresh_expiring_counts_only_successes(manager, user, monkeypatch):
+    add_token(user, timedelta(minutes=5))
+
+    def refresh(creds, request):
+        raise RuntimeError('invalid_grant')
+
+    monkeypatch.setattr(Credentials, 'refresh', refresh)
+    assert manager.refresh_expiring() == 0
+
+
+def test_local_locks_are_shared_by_name():
+    backend = LocalLockBackend()
+    lock = backend.lock('a', timeout=1)
+    assert backend.lock('a', timeout=1) is lock
+    assert backend.lock('b', timeout=1) is not lock
+
+    assert lock.acquire(blocking=False)
+    assert not lock.acquire(blocking_timeout=0.05)
+    lock.release()
+    assert lock.acquire(blocking=False)
+    lock.release()
@@ -0,0 +1,122 @@
+"""
+Token counting, truncation and splitting.
+"""
+
+import sys
+import pytest
+from phases import tokenizer
+from phases.tokenizer import BPETokenCounter, CharRatioCounter, TiktokenCounter, get_token_counter
+
+PARAGRAPHS = [
+    'Central banks signalled that interest rates may fall later this year. Markets rallied on the news.',
+    'A new open source database promises faster analytics on commodity hardware for small teams.',
+    'Researchers published a study on battery chemistry that could double electric car range.',
+]
+TEXT = '\n\n'.join(PARAGRAPHS)
+
+# "Markets rose sharply today, and investors were optimistic about the Fed's decision."
+CHINESE = '今天市场大幅上涨，投资者对美联储的决定感到乐观。'
+RUSSIAN = 'Рынки выросли во вторник после того, как ФРС сохранила ставки.'
+
+
+@pytest.fixture(scope='module')
+def bpe():
+    return BPETokenCounter()
+
+
+@pytest.fixture(params=['bpe', 'chars'])
+def counter(request, bpe):
+    return bpe if request.param == 'bpe' else CharRatioCounter()
+
+
+def test_bpe_counts_common_english_words_as_one_token(bpe):
+    assert bpe.count('It is one of the best') == 6
+    # cl100k_base gives 10; the smaller vocabulary splits the rarer words
+    assert 10 <= bpe.count('The quick brown fox jumps over the lazy dog.') <= 15
+    assert bpe.count('') == 0
+
+
+def test_bpe_estimates_scripts_missing_from_its_merges(bpe):
+    # One token per CJK character, not one per UTF-8 byte
+    assert bpe.count(CHINESE) == len(CHINESE)
+    # About two characters per token, as hosted tokenizers give for Cyrillic
+    assert bpe.count(RUSSIAN) <= len(RUSSIAN) // 2 + 2
+    assert bpe.count('Die Märkte stiegen am Dienstag') < 20
+
+
+def test_char_ratio_counts_rounds_up():
+    assert CharRatioCounter().count('abcde') == 2
+    assert CharRatioCounter(chars_per_token=1).count('abc') == 3
+
+
+def test_count_blocks_matches_joined_count(counter):
+    assert abs(counter.count_blocks(PARAGRAPHS) - counter.count(TEXT)) <= len(PARAGRAPHS)
+    assert counter.count_blocks([]) == 0
+
+
+def test_truncate_keeps_text_within_budget(counter):
+    assert counter.truncate(TEXT, counter.count(TEXT) + 10) == (TEXT, False)
+
+    budget = counter.count_blocks(PARAGRAPHS[:2]) + 2
+    text, cut = counter.truncate(TEXT, budget)
+    assert cut
+    assert text.startswith('\n\n'.join(PARAGRAPHS[:2]))
+    assert counter.count(text) <= budget
+
+
+def test_truncate_ends_on_a_sentence(counter):
+    first_sentence = PARAGRAPHS[0].split('. ')[0] + '.'
+    text, cut = counter.truncate(TEXT, counter.count(first_sentence) + 1)
+    assert cut
+    assert text == first_sentence
+
+
+def test_truncate_non_latin_text(bpe):
+    text, cut = bpe.truncate(CHINESE + '\n\n' + RUSSIAN, len(CHINESE) + 1)
+    assert cut
+    assert text == CHINESE
+
+
+def test_split_covers_text_in_budgeted_chunks(counter):
+    budget = counter.count(PARAGRAPHS[0]) + 1
+    chunks = counter.split(TEXT, budget)
+
+    assert len(chunks) == len(PARAGRAPHS)
+    assert '\n\n'.join(chunks) == TEXT
+    assert all(counter.count(chunk) <= budget + 1 for chunk in chunks)
+
+
+def test_split_breaks_long_paragraphs_between_sentences_and_words(counter):
+    sentence = 'Chip makers reported record demand from data centres building out clusters.'
+    paragraph = ' '.join([sentence] * 6)
+    budget = counter.count(sentence) // 2
+    chunks = counter.split(paragraph, budget)
+
+    assert len(chunks) > 6
+    assert ' '.join(chunks).split() == paragraph.split()
+    assert all(counter.count(chunk) <= budget + 1 for chunk in chunks)
+
+
+def test_tiktoken_counter():
+    pytest.importorskip('tiktoken')
+    try:
+        counter = TiktokenCounter()
+    except OSError:
+        pytest.skip('tiktoken encoding not cached and no network')
+
+    assert counter.count('The quick brown fox jumps over the lazy dog.') == 10
+    assert counter.count('<|endoftext|>') > 1
+
+
+def test_auto_falls_back_to_bundled_vocabulary(monkeypatch):
+    monkeypatch.setattr(tokenizer, '_counter', None)
+    monkeypatch.setitem(sys.modules, 'tiktoken', None)
+    monkeypatch.delenv('TOKEN_COUNTER', raising=False)
+    assert isinstance(get_token_counter(), BPETokenCounter)
+
+
+def test_unknown_counter_is_rejected(monkeypatch):
+    monkeypatch.setattr(tokenizer, '_counter', None)
+    monkeypatch.setenv('TOKEN_COUNTER', 'words')
+    with pytest.raises(ValueError):
+        get_token_counter()